@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+ICAN Adaptive Timeouts
+======================
+
+Per-provider timeouts derived from live latency instead of hard-coded
+constants. Latencies are kept in decaying log-scale histograms per
+(endpoint, input-size bucket); the read timeout is the observed p99 of the
+matching bucket times a headroom factor, clamped to configured bounds.
+The connect timeout is derived from the fastest observed calls (p10 of the
+endpoint, an upper bound on the network round trip), also clamped.
+
+Until a size bucket has enough samples the caller's static timeout
+applies (a bucket of large contracts must not inherit the limits learned
+from small ones); calls without a size use the endpoint-wide histogram.
+
+Configuration (constructor arguments override these):
+    ADAPTIVE_TIMEOUTS                   enable adaptive timeouts (true)
+    ADAPTIVE_TIMEOUT_PERCENTILE         latency percentile to cover (0.99)
+    ADAPTIVE_TIMEOUT_HEADROOM           multiplier on that percentile (1.5)
+    ADAPTIVE_TIMEOUT_MIN_SAMPLES        samples before a histogram is trusted (30)
+    ADAPTIVE_READ_TIMEOUT_MIN           read timeout bounds in seconds (2)
+    ADAPTIVE_READ_TIMEOUT_MAX           (180)
+    ADAPTIVE_CONNECT_TIMEOUT_MIN        connect timeout bounds in seconds (1)
+    ADAPTIVE_CONNECT_TIMEOUT_MAX        (10)
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import os
+import bisect
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# Log-spaced bucket upper bounds from 50 ms to ~10 min (25% apart)
+BUCKET_BOUNDS: List[float] = [0.05 * (1.25 ** i) for i in range(43)]
+
+# Input-size buckets by order of magnitude, in bytes/characters
+SIZE_BUCKETS = [(100, '<100B'), (1_000, '<1KB'), (10_000, '<10KB'), (100_000, '<100KB'),
+                (1_000_000, '<1MB'), (10_000_000, '<10MB')]
+
+
+def size_bucket(size: Optional[int]) -> str:
+    """Order-of-magnitude label for an input size"""
+    if size is None:
+        return 'unknown'
+    for limit, label in SIZE_BUCKETS:
+        if size < limit:
+            return label
+    return '>=10MB'
+
+
+class LatencyHistogram:
+    """Log-scale latency histogram whose counts halve every decay_every samples, so it follows live traffic"""
+
+    def __init__(self, decay_every: int = 1000):
+        self.counts = [0.0] * (len(BUCKET_BOUNDS) + 1)
+        self.samples = 0
+        self.decay_every = decay_every
+        self._since_decay = 0
+
+    def record(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.samples += 1
+        self._since_decay += 1
+        if self._since_decay >= self.decay_every:
+            self.counts = [count / 2 for count in self.counts]
+            self._since_decay = 0
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Upper bound of the bucket holding the given percentile"""
+        total = sum(self.counts)
+        if not total:
+            return None
+        threshold = fraction * total
+        running = 0.0
+        for index, count in enumerate(self.counts):
+            running += count
+            if running >= threshold:
+                return BUCKET_BOUNDS[min(index, len(BUCKET_BOUNDS) - 1)]
+        return BUCKET_BOUNDS[-1]
+
+
+class AdaptiveTimeouts:
+    """
+    Chooses (connect, read) timeouts per endpoint and input size.
+
+    Args:
+        name: Provider name, for stats
+        percentile: Latency percentile the read timeout must cover
+        headroom: Multiplier applied to that percentile
+        min_samples: Samples before a histogram is trusted
+        read_bounds: (min, max) read timeout in seconds
+        connect_bounds: (min, max) connect timeout in seconds
+        enabled: When False, the caller's static timeout is always used
+    """
+
+    def __init__(self, name: str, percentile: Optional[float] = None, headroom: Optional[float] = None,
+                 min_samples: Optional[int] = None, read_bounds: Optional[Tuple[float, float]] = None,
+                 connect_bounds: Optional[Tuple[float, float]] = None, enabled: Optional[bool] = None):
+        self.name = name
+        self.percentile = percentile or float(os.getenv('ADAPTIVE_TIMEOUT_PERCENTILE', '0.99'))
+        self.headroom = headroom or float(os.getenv('ADAPTIVE_TIMEOUT_HEADROOM', '1.5'))
+        self.min_samples = min_samples or int(os.getenv('ADAPTIVE_TIMEOUT_MIN_SAMPLES', '30'))
+        self.read_bounds = read_bounds or (float(os.getenv('ADAPTIVE_READ_TIMEOUT_MIN', '2')),
+                                           float(os.getenv('ADAPTIVE_READ_TIMEOUT_MAX', '180')))
+        self.connect_bounds = connect_bounds or (float(os.getenv('ADAPTIVE_CONNECT_TIMEOUT_MIN', '1')),
+                                                 float(os.getenv('ADAPTIVE_CONNECT_TIMEOUT_MAX', '10')))
+        self.enabled = enabled if enabled is not None else os.getenv('ADAPTIVE_TIMEOUTS', 'true').lower() == 'true'
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+
+    def _histogram(self, endpoint: str, bucket: str) -> LatencyHistogram:
+        key = (endpoint, bucket)
+        if key not in self._histograms:
+            self._histograms[key] = LatencyHistogram()
+        return self._histograms[key]
+
+    def record(self, endpoint: str, size: Optional[int], seconds: float) -> None:
+        """Record one call; timed-out calls should be recorded at their timeout so short limits grow"""
+        with self._lock:
+            self._histogram(endpoint, size_bucket(size)).record(seconds)
+            self._histogram(endpoint, '*').record(seconds)
+
+    @staticmethod
+    def _clamp(value: float, bounds: Tuple[float, float]) -> float:
+        return max(bounds[0], min(bounds[1], value))
+
+    def choose(self, endpoint: str, size: Optional[int],
+               default: Tuple[float, float]) -> Tuple[Tuple[float, float], Dict[str, Any]]:
+        """
+        Pick the (connect, read) timeout for a call.
+
+        Returns:
+            Tuple of ((connect, read), info) where info describes where the
+            numbers came from, for debug metadata.
+        """
+        bucket = size_bucket(size)
+        info: Dict[str, Any] = {'endpoint': endpoint, 'size_bucket': bucket}
+        if not self.enabled:
+            info.update(source='static', connect_timeout=default[0], read_timeout=default[1])
+            return default, info
+
+        with self._lock:
+            exact = self._histograms.get((endpoint, bucket))
+            overall = self._histograms.get((endpoint, '*'))
+            if size is not None and exact is not None and exact.samples >= self.min_samples:
+                source, histogram = 'size_bucket', exact
+            elif size is None and overall is not None and overall.samples >= self.min_samples:
+                source, histogram = 'endpoint', overall
+            else:
+                source, histogram = 'static', None
+
+            if histogram is None:
+                info.update(source=source, connect_timeout=default[0], read_timeout=default[1],
+                            samples=exact.samples if exact else 0)
+                return default, info
+            observed = histogram.percentile(self.percentile)
+            fastest = overall.percentile(0.10)
+            samples = histogram.samples
+
+        read_timeout = round(self._clamp(observed * self.headroom, self.read_bounds), 2)
+        connect_timeout = round(self._clamp(3 * fastest, self.connect_bounds), 2)
+        info.update(source=source, samples=samples, observed_percentile=self.percentile,
+                    observed_seconds=round(observed, 3),
+                    connect_timeout=connect_timeout, read_timeout=read_timeout)
+        return (connect_timeout, read_timeout), info
+
+    def expected_seconds(self, endpoint: str, size: Optional[int], fraction: float = 0.5) -> Optional[float]:
+        """Typical (median) latency of this kind of call, None until the size bucket has enough samples"""
+        if not self.enabled or size is None:
+            return None
+        with self._lock:
+            histogram = self._histograms.get((endpoint, size_bucket(size)))
+            if histogram is None or histogram.samples < self.min_samples:
+                return None
+            return histogram.percentile(fraction)
+
+    def stats(self) -> Dict[str, Any]:
+        """Current timeout choice for every (endpoint, size bucket) seen"""
+        with self._lock:
+            keys = [key for key in self._histograms if key[1] != '*']
+        table = {}
+        for endpoint, bucket in sorted(keys):
+            _, info = self.choose(endpoint, None if bucket == 'unknown' else _bucket_size(bucket), (0.0, 0.0))
+            keys_shown = ('source', 'samples') if info['source'] == 'static' else \
+                ('source', 'samples', 'connect_timeout', 'read_timeout')
+            table.setdefault(endpoint, {})[bucket] = {key: info[key] for key in keys_shown if key in info}
+        return {
+            'enabled': self.enabled,
+            'percentile': self.percentile,
+            'headroom': self.headroom,
+            'read_bounds': list(self.read_bounds),
+            'connect_bounds': list(self.connect_bounds),
+            'endpoints': table
+        }
+
+
+def _bucket_size(label: str) -> int:
+    """A representative size inside a size bucket (used to look buckets up again)"""
+    previous = 0
+    for limit, bucket_label in SIZE_BUCKETS:
+        if bucket_label == label:
+            return previous
+        previous = limit
+    return previous
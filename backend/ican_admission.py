@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+ICAN Admission Control
+======================
+
+Inbound limits applied before a request reaches its view, so one heavy
+client cannot saturate an endpoint (vet_contract in particular) for
+everyone else:
+
+- per-client token buckets, one per API key (X-API-Key header or an
+  Authorization bearer token) and one per client IP; a request needs a
+  token from each bucket that applies
+- a body-size limit checked against Content-Length before anything reads
+  or parses the body (bodies without a length are capped by Flask's
+  MAX_CONTENT_LENGTH while streaming)
+
+Rejections are cheap: no body is read, and the app's own short error
+payload is returned as 429 with Retry-After (413 for oversized bodies).
+Buckets live in sharded, size-bounded LRU tables so thousands of requests
+per second from many clients neither contend on one lock nor grow memory
+without bound. Limits are per process: with several workers a client may
+get up to workers x the limit.
+
+Configuration:
+    ADMISSION_CONTROL               enable admission control (true)
+    RATE_LIMIT_PER_MINUTE           default requests per minute per client (100)
+    RATE_LIMIT_PER_MINUTE_PER_KEY   per API key (RATE_LIMIT_PER_MINUTE)
+    RATE_LIMIT_PER_MINUTE_PER_IP    per client IP (RATE_LIMIT_PER_MINUTE)
+    RATE_LIMIT_BURST                requests a client may send at once (20)
+    ADMISSION_TRUSTED_PROXIES       proxies in front of the service whose
+                                    X-Forwarded-For entries are trusted (0)
+    ADMISSION_MAX_CLIENTS           clients tracked per table (100000)
+    ADMISSION_EXEMPT_PATHS          comma-separated paths never limited
+                                    (/api/health)
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import os
+import math
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+SHARDS = 64
+
+
+class ClientBuckets:
+    """
+    Token buckets keyed by client identity.
+
+    Args:
+        name: Table name for stats ('api_key', 'ip')
+        per_minute: Refill rate in requests per minute (0 disables the table)
+        burst: Bucket capacity
+        max_clients: Clients kept per table; the least recently seen are dropped
+    """
+
+    def __init__(self, name: str, per_minute: float, burst: float, max_clients: int = 100_000):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.burst = max(1.0, burst)
+        self.max_per_shard = max(1, max_clients // SHARDS)
+        self._shards: List[Tuple[threading.Lock, 'OrderedDict[str, List[float]]']] = [
+            (threading.Lock(), OrderedDict()) for _ in range(SHARDS)]
+
+    def take(self, key: str) -> float:
+        """Spend one token for key; returns 0 when admitted, else seconds until a token is available"""
+        if self.rate <= 0:
+            return 0.0
+        lock, table = self._shards[hash(key) % SHARDS]
+        now = time.monotonic()
+        with lock:
+            bucket = table.get(key)
+            if bucket is None:
+                bucket = table[key] = [self.burst, now]
+                if len(table) > self.max_per_shard:
+                    table.popitem(last=False)
+            else:
+                table.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1.0:
+                bucket[0] -= 1.0
+                return 0.0
+            return (1.0 - bucket[0]) / self.rate
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'per_minute': round(self.rate * 60, 1),
+            'burst': self.burst,
+            'clients': sum(len(table) for _, table in self._shards)
+        }
+
+
+class AdmissionController:
+    """
+    Per-API-key and per-IP rate limits plus a request body-size limit.
+
+    Args:
+        max_body_bytes: Largest accepted request body
+        per_key: Requests per minute per API key
+        per_ip: Requests per minute per client IP
+        burst: Requests a client may send at once
+        trusted_proxies: Proxies whose X-Forwarded-For entries are trusted
+        exempt_paths: Paths that are never limited (health checks), in
+            addition to those in ADMISSION_EXEMPT_PATHS
+        enabled: When False every request is admitted
+    """
+
+    def __init__(self, max_body_bytes: int, per_key: Optional[float] = None, per_ip: Optional[float] = None,
+                 burst: Optional[float] = None, trusted_proxies: Optional[int] = None,
+                 exempt_paths: Optional[List[str]] = None, enabled: Optional[bool] = None):
+        default_rate = os.getenv('RATE_LIMIT_PER_MINUTE', '100')
+        per_key = per_key if per_key is not None else float(os.getenv('RATE_LIMIT_PER_MINUTE_PER_KEY', default_rate))
+        per_ip = per_ip if per_ip is not None else float(os.getenv('RATE_LIMIT_PER_MINUTE_PER_IP', default_rate))
+        burst = burst if burst is not None else float(os.getenv('RATE_LIMIT_BURST', '20'))
+        max_clients = int(os.getenv('ADMISSION_MAX_CLIENTS', '100000'))
+        self.max_body_bytes = max_body_bytes
+        self.keys = ClientBuckets('api_key', per_key, burst, max_clients)
+        self.ips = ClientBuckets('ip', per_ip, burst, max_clients)
+        self.trusted_proxies = (trusted_proxies if trusted_proxies is not None
+                                else int(os.getenv('ADMISSION_TRUSTED_PROXIES', '0')))
+        # The app's own paths are added to the operator's, never instead of them
+        self.exempt_paths = {path.strip() for path in os.getenv('ADMISSION_EXEMPT_PATHS', '/api/health').split(',')
+                             if path.strip()} | set(exempt_paths or [])
+        self.enabled = enabled if enabled is not None else os.getenv('ADMISSION_CONTROL', 'true').lower() == 'true'
+        self._lock = threading.Lock()
+        self.counters = {'admitted': 0, 'oversized': 0, 'api_key_limited': 0, 'ip_limited': 0}
+
+    def client_ip(self, environ: Dict[str, Any]) -> str:
+        """The client address, taken from X-Forwarded-For only as far as trusted proxies vouch for it"""
+        if self.trusted_proxies:
+            forwarded = [part.strip() for part in environ.get('HTTP_X_FORWARDED_FOR', '').split(',') if part.strip()]
+            if len(forwarded) >= self.trusted_proxies:
+                return forwarded[-self.trusted_proxies]
+        return environ.get('REMOTE_ADDR', '')
+
+    @staticmethod
+    def api_key(headers: Any) -> Optional[str]:
+        """Caller's API key (hashed, so raw keys are never held in the table)"""
+        key = headers.get('X-API-Key')
+        if not key:
+            authorization = headers.get('Authorization', '')
+            if authorization[:7].lower() == 'bearer ':
+                key = authorization[7:].strip()
+        return hashlib.blake2b(key.encode(), digest_size=16).hexdigest() if key else None
+
+    def check(self, path: str, content_length: Optional[int], headers: Any,
+              environ: Dict[str, Any]) -> Optional[Tuple[int, str, float]]:
+        """
+        Decide on one request.
+
+        Returns:
+            None to admit, else (status, reason, retry_after_seconds) where
+            reason is 'BODY_TOO_LARGE', 'API_KEY_RATE_LIMITED' or 'IP_RATE_LIMITED'
+        """
+        if not self.enabled or path in self.exempt_paths:
+            return None
+        if content_length is not None and content_length > self.max_body_bytes:
+            self._count('oversized')
+            return 413, 'BODY_TOO_LARGE', 0.0
+        key = self.api_key(headers)
+        if key is not None:
+            wait = self.keys.take(key)
+            if wait:
+                self._count('api_key_limited')
+                return 429, 'API_KEY_RATE_LIMITED', wait
+        wait = self.ips.take(self.client_ip(environ))
+        if wait:
+            self._count('ip_limited')
+            return 429, 'IP_RATE_LIMITED', wait
+        self._count('admitted')
+        return None
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self.counters[counter] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'max_body_bytes': self.max_body_bytes,
+            **self.counters,
+            'api_key': self.keys.stats(),
+            'ip': self.ips.stats()
+        }
+
+
+def init_admission_control(app: Any, max_body_bytes: int, on_rejected: Callable[[int, str, float], Any],
+                           exempt_paths: Optional[List[str]] = None) -> AdmissionController:
+    """
+    Check every request of a Flask app against the admission limits before
+    its view runs (register before init_request_context so rejected
+    requests cost nothing more).
+
+    Args:
+        app: Flask application
+        max_body_bytes: Largest accepted request body
+        on_rejected: Returns the app's error response for (status, reason,
+            retry_after_seconds); Retry-After is added here
+        exempt_paths: Paths never limited, such as the app's health check
+            (added to those in ADMISSION_EXEMPT_PATHS)
+
+    Returns:
+        The controller, for stats
+    """
+    from flask import make_response, request
+
+    controller = AdmissionController(max_body_bytes, exempt_paths=exempt_paths)
+    # Bodies sent without Content-Length are cut off at the same size while being read
+    app.config['MAX_CONTENT_LENGTH'] = max_body_bytes
+
+    @app.before_request
+    def _admit_request():
+        if request.method == 'OPTIONS':
+            return None  # CORS preflights are answered without reaching a view
+        rejection = controller.check(request.path, request.content_length, request.headers, request.environ)
+        if rejection is None:
+            return None
+        status, reason, retry_after = rejection
+        response = make_response(on_rejected(status, reason, retry_after))
+        if status == 429:
+            response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
+
+    return controller
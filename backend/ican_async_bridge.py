@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+ICAN Async Bridge
+=================
+
+Runs the existing synchronous request code (Flask views, the parse
+cascade, ProviderClient) on an asyncio event loop without rewriting it.
+Each request executes in its own greenlet; wherever that code would block
+on the network or a timer it calls await_only(), which hands the awaitable
+to the event loop and suspends the greenlet until it completes. Thousands
+of requests waiting on Gemini/OpenAI therefore share one thread instead of
+pinning one OS thread each.
+
+The same pattern lets SQLAlchemy drive its sync core from asyncio. Code
+that is not running inside a bridge greenlet is unaffected: in_async_bridge()
+is False and every caller keeps its blocking path.
+
+Requires the optional greenlet package (only for the async serving mode,
+see ican_async_server).
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import sys
+import asyncio
+from contextvars import copy_context
+from typing import Any, Awaitable, Callable
+
+from ican_request_context import RequestCancelled, current_context, disconnect_watcher
+
+try:
+    import greenlet
+except ImportError:  # optional: only the async serving mode needs it
+    greenlet = None
+
+
+def in_async_bridge() -> bool:
+    """True when running inside a greenlet started by greenlet_spawn()"""
+    return greenlet is not None and getattr(greenlet.getcurrent(), 'ican_async_bridge', False)
+
+
+def await_only(awaitable: Awaitable[Any]) -> Any:
+    """
+    Wait for an awaitable from synchronous code running in a bridge greenlet.
+
+    Raises:
+        RequestCancelled: The request's handler task was cancelled (the client
+            disconnected); the current request is marked cancelled
+    """
+    current = greenlet.getcurrent() if greenlet is not None else None
+    if current is None or not getattr(current, 'ican_async_bridge', False):
+        raise RuntimeError('await_only() called outside the async bridge')
+    try:
+        return current.parent.switch(awaitable)
+    except asyncio.CancelledError:
+        context = current_context()
+        if context is not None and not context.cancelled.is_set():
+            disconnect_watcher.disconnected(context)
+        raise RequestCancelled('client disconnected') from None
+
+
+def run_blocking(fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    fn(*args) for CPU-bound or otherwise blocking work: in a bridge greenlet
+    it runs in the event loop's default thread pool (in the request's
+    context) so the loop keeps serving other requests; elsewhere it is
+    simply called.
+    """
+    if not in_async_bridge():
+        return fn(*args)
+    loop = asyncio.get_running_loop()
+    return await_only(loop.run_in_executor(None, copy_context().run, fn, *args))
+
+
+async def greenlet_spawn(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Run fn(*args, **kwargs) in a new bridge greenlet, serving its awaits on
+    the current event loop, and return its result.
+
+    A cancellation of the calling task is delivered to fn at its pending
+    await (as RequestCancelled) and re-raised once fn has finished.
+    """
+    if greenlet is None:
+        raise RuntimeError('The async serving mode needs the greenlet package (pip install greenlet)')
+    bridge = greenlet.greenlet(fn)
+    bridge.ican_async_bridge = True
+    bridge.gr_context = copy_context()
+
+    result = bridge.switch(*args, **kwargs)
+    cancelled = None
+    while not bridge.dead:
+        try:
+            value = await result
+        except asyncio.CancelledError as error:
+            cancelled = cancelled or error
+            result = bridge.throw(error)
+        except BaseException:
+            result = bridge.throw(*sys.exc_info())
+        else:
+            result = bridge.switch(value)
+    if cancelled is not None:
+        raise cancelled
+    return result
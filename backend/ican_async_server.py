@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+ICAN Async Server
+=================
+
+Serves an unchanged Flask app from an asyncio event loop (aiohttp). Each
+request runs the WSGI app in its own bridge greenlet (see ican_async_bridge),
+so its provider calls, retry backoffs and waits on shared work yield to the
+loop instead of holding an OS thread: thousands of requests waiting on
+Gemini/OpenAI share one thread. Routes, payloads and status codes are the
+same as with the threaded server.
+
+The request body is not read up front: the WSGI app gets it as a stream
+that pulls from the connection a chunk at a time through the bridge. The
+app's before_request checks (admission limits, memory budget) therefore
+run on the headers before any of the body arrives, and streamed uploads
+go straight to their spool instead of into memory first.
+
+A client that disconnects cancels its request's task; the cancellation
+reaches the pending provider call as RequestCancelled and the view answers
+499 as in the threaded server.
+
+Selected with ICAN_SERVER_MODE=async in the service entry points. Requires
+the optional aiohttp and greenlet packages.
+
+Configuration:
+    ICAN_SERVER_MODE        threaded (default) or async
+    ASYNC_MAX_BODY_MB       largest request body accepted in async mode when the
+                            Flask app sets no MAX_CONTENT_LENGTH (64)
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import io
+import os
+import sys
+import logging
+from urllib.parse import unquote
+from typing import Any, Callable, Dict, List, Tuple
+
+from ican_async_bridge import await_only, greenlet_spawn
+from ican_http_pool import close_async_sessions
+
+try:
+    from aiohttp import web
+    from multidict import CIMultiDict
+except ImportError:  # optional: only the async serving mode needs it
+    web = None
+
+logger = logging.getLogger(__name__)
+
+# Connection-level headers the WSGI app may set that aiohttp manages itself
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+                      'te', 'trailers', 'transfer-encoding', 'upgrade', 'content-length'}
+
+
+def server_mode() -> str:
+    """Serving mode chosen for this process: 'threaded' or 'async'"""
+    return os.getenv('ICAN_SERVER_MODE', 'threaded').lower()
+
+
+class BridgedInput(io.RawIOBase):
+    """
+    wsgi.input reading an aiohttp request body as the app asks for it,
+    waiting for each chunk through the bridge. Refuses to go past
+    max_bytes (a chunked body has no Content-Length to check up front).
+    """
+
+    def __init__(self, content: Any, max_bytes: int):
+        self.content = content
+        self.max_bytes = max_bytes
+        self.received = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        if not len(buffer):
+            return 0
+        # One byte past the limit tells a body at the limit from a longer one
+        size = min(len(buffer), self.max_bytes + 1 - self.received)
+        chunk = await_only(self.content.read(size)) if size > 0 else b''
+        self.received += len(chunk)
+        if self.received > self.max_bytes:
+            from werkzeug.exceptions import RequestEntityTooLarge
+            raise RequestEntityTooLarge()
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+def build_environ(request: Any, max_body: int) -> Dict[str, Any]:
+    """WSGI environ for an aiohttp request, its body streamed from the connection"""
+    path, _, query = request.raw_path.partition('?')
+    transport = request.transport
+    sockname = transport.get_extra_info('sockname') if transport is not None else None
+    peer = transport.get_extra_info('peername') if transport is not None else None
+    host, port = sockname[:2] if sockname else ('localhost', 0)
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': '',
+        # PEP 3333: the path is decoded bytes carried as latin-1
+        'PATH_INFO': unquote(path, encoding='latin-1'),
+        'QUERY_STRING': query,
+        'SERVER_NAME': str(host),
+        'SERVER_PORT': str(port),
+        'SERVER_PROTOCOL': f'HTTP/{request.version.major}.{request.version.minor}',
+        'REMOTE_ADDR': peer[0] if peer else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': request.scheme,
+        'wsgi.input': BridgedInput(request.content, max_body),
+        # The stream ends with the body (chunked bodies included), so it is safe to read to the end
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if request.content_length is not None:
+        environ['CONTENT_LENGTH'] = str(request.content_length)
+    if request.headers.get('Content-Type'):
+        environ['CONTENT_TYPE'] = request.headers['Content-Type']
+    for name, value in request.headers.items():
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        if key in ('HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH'):
+            continue
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def run_wsgi(app: Callable[..., Any], environ: Dict[str, Any]) -> Tuple[str, List[Tuple[str, str]], bytes]:
+    """Call a WSGI app and collect its response (runs inside the bridge greenlet)"""
+    started: Dict[str, Any] = {}
+
+    def start_response(status: str, headers: List[Tuple[str, str]], exc_info: Any = None) -> Callable[[bytes], None]:
+        if exc_info and started:
+            raise exc_info[1].with_traceback(exc_info[2])
+        started['status'], started['headers'] = status, headers
+        return chunks.append
+
+    chunks: List[bytes] = []
+    result = app(environ, start_response)
+    try:
+        for chunk in result:
+            chunks.append(chunk)
+    finally:
+        close = getattr(result, 'close', None)
+        if close is not None:
+            close()
+    return started['status'], started['headers'], b''.join(chunks)
+
+
+def create_async_app(flask_app: Any) -> Any:
+    """aiohttp application that serves every route of flask_app"""
+    if web is None:
+        raise RuntimeError('The async serving mode needs the aiohttp package (pip install aiohttp)')
+    max_body = (flask_app.config.get('MAX_CONTENT_LENGTH')
+                or int(float(os.getenv('ASYNC_MAX_BODY_MB', '64')) * 1024 * 1024))
+
+    async def handle(request: Any) -> Any:
+        status, headers, content = await greenlet_spawn(run_wsgi, flask_app.wsgi_app,
+                                                        build_environ(request, max_body))
+        code, _, reason = status.partition(' ')
+        kept = CIMultiDict((name, value) for name, value in headers if name.lower() not in HOP_BY_HOP_HEADERS)
+        return web.Response(status=int(code), reason=reason or None, body=content, headers=kept)
+
+    async def close_sessions(_: Any) -> None:
+        await close_async_sessions()
+
+    # The body is streamed, so aiohttp's own read limit never applies; BridgedInput enforces max_body
+    async_app = web.Application(client_max_size=max_body)
+    async_app.router.add_route('*', '/{tail:.*}', handle)
+    async_app.on_cleanup.append(close_sessions)
+    return async_app
+
+
+def run_async(flask_app: Any, host: str = '0.0.0.0', port: int = 5000) -> None:
+    """Serve flask_app on the event loop until interrupted"""
+    logger.info(f"Serving {flask_app.name} in async mode on {host}:{port}")
+    # handler_cancellation: a client disconnect cancels its handler task
+    web.run_app(create_async_app(flask_app), host=host, port=port, handler_cancellation=True, print=None)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+ICAN Circuit Breaker
+====================
+
+Per-provider circuit breaker with closed, open and half-open states,
+driven by the error rate and the slow-call rate over a sliding window.
+While the circuit is open, provider calls fail in microseconds with
+CircuitOpenError so callers can route straight to their local fallback
+instead of waiting out timeouts and retries.
+
+Configuration (constructor arguments override these):
+    BREAKER_WINDOW_SECONDS      sliding window for error/latency rates (30)
+    BREAKER_MIN_CALLS           calls in the window before the breaker may trip (10)
+    BREAKER_FAILURE_RATE        failure ratio that opens the circuit (0.5)
+    BREAKER_SLOW_CALL_SECONDS   calls slower than this count as slow (10)
+    BREAKER_SLOW_CALL_RATE      slow-call ratio that opens the circuit (0.8)
+    BREAKER_OPEN_SECONDS        time spent open before probing (30)
+    BREAKER_HALF_OPEN_PROBES    trial calls allowed while half-open (3)
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """The provider's circuit is open; the call was rejected without a network request"""
+
+    status = 'CIRCUIT_OPEN'
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed → open on high error/slow rate, open → half-open after a cool-down, half-open → closed on good probes"""
+
+    def __init__(self, name: str, window_seconds: Optional[float] = None, min_calls: Optional[int] = None,
+                 failure_rate: Optional[float] = None, slow_call_seconds: Optional[float] = None,
+                 slow_call_rate: Optional[float] = None, open_seconds: Optional[float] = None,
+                 half_open_probes: Optional[int] = None):
+        self.name = name
+        self.window_seconds = window_seconds or float(os.getenv('BREAKER_WINDOW_SECONDS', '30'))
+        self.min_calls = min_calls or int(os.getenv('BREAKER_MIN_CALLS', '10'))
+        self.failure_rate = failure_rate or float(os.getenv('BREAKER_FAILURE_RATE', '0.5'))
+        self.slow_call_seconds = slow_call_seconds or float(os.getenv('BREAKER_SLOW_CALL_SECONDS', '10'))
+        self.slow_call_rate = slow_call_rate or float(os.getenv('BREAKER_SLOW_CALL_RATE', '0.8'))
+        self.open_seconds = open_seconds or float(os.getenv('BREAKER_OPEN_SECONDS', '30'))
+        self.half_open_probes = half_open_probes or int(os.getenv('BREAKER_HALF_OPEN_PROBES', '3'))
+
+        self._lock = threading.Lock()
+        self._outcomes: deque = deque()  # (timestamp, failed, slow)
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self.transitions: deque = deque(maxlen=20)
+        self.rejected = 0
+
+    def _transition(self, new_state: str, reason: str) -> None:
+        if new_state == self.state:
+            return
+        logger.warning(f"Circuit breaker {self.name}: {self.state} -> {new_state} ({reason})")
+        self.transitions.append({
+            'from': self.state,
+            'to': new_state,
+            'reason': reason,
+            'at': datetime.utcnow().isoformat()
+        })
+        self.state = new_state
+        if new_state == OPEN:
+            self._opened_at = time.monotonic()
+        if new_state in (HALF_OPEN, CLOSED):
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+        if new_state == CLOSED:
+            self._outcomes.clear()
+
+    def _trim(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        while self._outcomes and self._outcomes[0][0] < cutoff:
+            self._outcomes.popleft()
+
+    def allow(self) -> bool:
+        """Ask permission for one call; every allowed call must be followed by record_*"""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return False
+                self._transition(HALF_OPEN, 'cool-down elapsed')
+            if self.state == HALF_OPEN:
+                if self._probes_in_flight >= self.half_open_probes:
+                    self.rejected += 1
+                    return False
+                self._probes_in_flight += 1
+            return True
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker will let a probe through"""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def record_success(self, latency: float) -> None:
+        self._record(failed=False, latency=latency)
+
+    def record_failure(self, latency: float) -> None:
+        self._record(failed=True, latency=latency)
+
+    def release(self) -> None:
+        """Give back an allowed call that never reached the provider"""
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes_in_flight > 0:
+                self._probes_in_flight -= 1
+
+    def _record(self, failed: bool, latency: float) -> None:
+        slow = latency >= self.slow_call_seconds
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if failed or slow:
+                    self._transition(OPEN, 'probe failed' if failed else f'probe slow ({latency:.1f}s)')
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_probes:
+                        self._transition(CLOSED, f'{self._probe_successes} probes succeeded')
+                return
+            if self.state == OPEN:
+                return
+
+            self._outcomes.append((now, failed, slow))
+            self._trim(now)
+            calls = len(self._outcomes)
+            if calls < self.min_calls:
+                return
+            failures = sum(1 for _, f, _ in self._outcomes if f)
+            slow_calls = sum(1 for _, _, s in self._outcomes if s)
+            if failures / calls >= self.failure_rate:
+                self._transition(OPEN, f'failure rate {failures}/{calls}')
+            elif slow_calls / calls >= self.slow_call_rate:
+                self._transition(OPEN, f'slow-call rate {slow_calls}/{calls}')
+
+    def stats(self) -> Dict[str, Any]:
+        """State, recent rates and transition history for the health endpoint"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._transition(HALF_OPEN, 'cool-down elapsed')
+            self._trim(time.monotonic())
+            calls = len(self._outcomes)
+            failures = sum(1 for _, f, _ in self._outcomes if f)
+            slow_calls = sum(1 for _, _, s in self._outcomes if s)
+            return {
+                'provider': self.name,
+                'state': self.state,
+                'window_calls': calls,
+                'failure_rate': round(failures / calls, 3) if calls else 0.0,
+                'slow_call_rate': round(slow_calls / calls, 3) if calls else 0.0,
+                'rejected': self.rejected,
+                'thresholds': {
+                    'failure_rate': self.failure_rate,
+                    'slow_call_seconds': self.slow_call_seconds,
+                    'slow_call_rate': self.slow_call_rate,
+                    'min_calls': self.min_calls,
+                    'open_seconds': self.open_seconds
+                },
+                'transitions': list(self.transitions)
+            }
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+ICAN Document Text
+==================
+
+Local text extraction for contract documents, so that a text-only model
+(the OpenAI Treasury edition) is prompted with the contract's words rather
+than base64 characters.
+
+Supported documents, recognised by their leading bytes before their
+declared MIME type:
+- PDF, page by page with pypdf (optional dependency)
+- DOCX, paragraph by paragraph from word/document.xml, parsed as a stream
+  with the standard library (zipfile, ElementTree)
+- plain text (text/*, JSON, XML, CSV), decoded chunk by chunk
+
+Pages are read only until enough text for the prompt has been collected,
+so a 300-page PDF costs as much as its first few pages. The text is then
+cleaned before it is used:
+- whitespace is normalized: runs collapsed, hyphenated line breaks joined,
+  blank lines limited to one
+- boilerplate is dropped: rules and signature lines, and on PDF pages
+  running headers/footers (lines repeated at the top or bottom of most
+  pages) and page numbers in those top and bottom lines
+
+Extracted text is cached by the document's SHA-256, so the same contract
+uploaded again is not parsed twice. A document with no extractable text
+(a scanned PDF, an image) yields an empty string; a type that cannot be
+read at all raises UnsupportedDocument.
+
+Configuration:
+    DOCUMENT_TEXT_MAX_CHARS             characters of text extracted per document (5000)
+    DOCUMENT_TEXT_CACHE_SIZE            documents whose text is cached (256)
+    DOCUMENT_TEXT_CACHE_TTL_SECONDS     lifetime of a cached text (86400)
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import os
+import re
+import codecs
+import logging
+import zipfile
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from xml.etree.ElementTree import ParseError, iterparse
+
+from ican_document_upload import CHUNK_BYTES, SpooledDocument
+from ican_result_cache import TTLCache
+
+try:
+    from pypdf import PdfReader
+    from pypdf.errors import PyPdfError
+except ImportError:  # optional: only PDF extraction needs it
+    PdfReader = None
+    PyPdfError = Exception
+
+logger = logging.getLogger(__name__)
+
+TEXT_MAX_CHARS = int(os.getenv('DOCUMENT_TEXT_MAX_CHARS', '5000'))
+
+# Lines from the top and bottom of each PDF page that may be running headers/footers
+RUNNING_LINE_DEPTH = 2
+
+_WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_TEXT_MIME_TYPES = ('application/json', 'application/xml', 'application/csv', 'application/rtf')
+
+_SPACES_RE = re.compile(r'[^\S\n]+')
+_HYPHENATED_BREAK_RE = re.compile(r'(\w)-\n(\w)')
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+# Only dropped at the top or bottom of a page: elsewhere a bare number is content (an amount, a clause)
+_PAGE_NUMBER_RES = [
+    re.compile(r'^(page\s*)?\d{1,4}(\s*(of|/)\s*\d{1,4})?$', re.IGNORECASE),  # "Page 3 of 12", "3/12", "3"
+    re.compile(r'^[-–—\s]*\d{1,4}[-–—\s]*$'),  # "- 3 -"
+]
+_BOILERPLATE_RES = [
+    re.compile(r'^[\W_]+$'),  # rules, signature lines, table-of-contents leaders
+    re.compile(r'^(strictly\s+)?(private\s+(and|&)\s+)?confidential$|^draft$', re.IGNORECASE),
+]
+
+
+class UnsupportedDocument(ValueError):
+    """A document whose type has no text extractor (or whose extractor is not installed)"""
+
+
+def normalize_whitespace(text: str) -> str:
+    """Collapse runs of spaces, join words hyphenated across lines and drop extra blank lines"""
+    text = text.replace('\r\n', '\n').replace('\r', '\n').replace('\x00', '')
+    text = _HYPHENATED_BREAK_RE.sub(r'\1\2', text)
+    lines = [_SPACES_RE.sub(' ', line).strip() for line in text.split('\n')]
+    return _BLANK_LINES_RE.sub('\n\n', '\n'.join(lines)).strip()
+
+
+def is_boilerplate(line: str) -> bool:
+    return any(pattern.match(line) for pattern in _BOILERPLATE_RES)
+
+
+def is_page_number(line: str) -> bool:
+    return any(pattern.match(line) for pattern in _PAGE_NUMBER_RES)
+
+
+def drop_boilerplate(pages: List[str], running_lines: bool) -> str:
+    """
+    Join cleaned pages without boilerplate lines.
+
+    Args:
+        pages: Normalized page texts
+        running_lines: Also drop running headers and footers: lines at the
+            top or bottom of at least half of the pages, and page numbers
+            at the top or bottom of any page; only meaningful for real pages
+    """
+    page_lines = [page.split('\n') for page in pages]
+    page_edges = []
+    for lines in page_lines:
+        text_lines = [index for index, line in enumerate(lines) if line]
+        page_edges.append(set(text_lines[:RUNNING_LINE_DEPTH] + text_lines[-RUNNING_LINE_DEPTH:])
+                          if running_lines else set())
+    repeated = set()
+    if running_lines and len(pages) >= 3:
+        edges = []
+        for lines, edge in zip(page_lines, page_edges):
+            edges.extend({lines[index] for index in edge})
+        repeated = {line for line, count in Counter(edges).items() if count * 2 >= len(pages)}
+    kept = [line for lines, edge in zip(page_lines, page_edges) for index, line in enumerate(lines)
+            if line not in repeated and not (line and is_boilerplate(line))
+            and not (index in edge and is_page_number(line))]
+    return _BLANK_LINES_RE.sub('\n\n', '\n'.join(kept)).strip()
+
+
+def document_kind(document: SpooledDocument) -> str:
+    """'pdf', 'docx' or 'text', from the leading bytes and then the declared type and name"""
+    head = bytearray(1024)
+    head = bytes(head[:document.readinto_at(0, head)])
+    mime_type = (document.mime_type or '').split(';')[0].strip().lower()
+    filename = (document.filename or '').lower()
+    if head.startswith(b'%PDF'):
+        return 'pdf'
+    if head.startswith(b'PK\x03\x04'):
+        if ('wordprocessingml' in mime_type or filename.endswith('.docx')
+                or mime_type in ('', 'application/zip', 'application/octet-stream')):
+            return 'docx'
+        raise UnsupportedDocument(f'Cannot extract text from {mime_type or "zip"} documents')
+    if b'\x00' in head:
+        raise UnsupportedDocument(f'Cannot extract text from a binary {mime_type or "unknown"} document')
+    if mime_type.startswith('text/') or mime_type in _TEXT_MIME_TYPES or not mime_type:
+        return 'text'
+    raise UnsupportedDocument(f'Cannot extract text from {mime_type} documents')
+
+
+def iter_pdf_pages(document: SpooledDocument) -> Iterator[str]:
+    """Text of each PDF page in order, read one page at a time"""
+    if PdfReader is None:
+        raise UnsupportedDocument('PDF text extraction needs the pypdf package (pip install pypdf)')
+    try:
+        reader = PdfReader(document)
+        if reader.is_encrypted and not reader.decrypt(''):
+            raise UnsupportedDocument('The PDF is password protected')
+        for page in reader.pages:
+            yield page.extract_text() or ''
+    except UnsupportedDocument:
+        raise
+    except (PyPdfError, ValueError, KeyError) as error:
+        raise UnsupportedDocument(f'Unreadable PDF: {error}') from error
+
+
+def iter_docx_pages(document: SpooledDocument) -> Iterator[str]:
+    """Text of a DOCX body, a page (explicit page break) at a time, streamed from the XML"""
+    try:
+        archive = zipfile.ZipFile(document)
+        xml = archive.open('word/document.xml')
+    except (zipfile.BadZipFile, KeyError) as error:
+        raise UnsupportedDocument(f'Unreadable DOCX: {error}') from error
+    paragraphs: List[str] = []
+    runs: List[str] = []
+    with archive, xml:
+        try:
+            for _, element in iterparse(xml, events=('end',)):
+                tag = element.tag
+                if tag == _WORD_NS + 't':
+                    runs.append(element.text or '')
+                elif tag == _WORD_NS + 'tab':
+                    runs.append('\t')
+                elif tag == _WORD_NS + 'br':
+                    if element.get(_WORD_NS + 'type') == 'page':
+                        paragraphs.append(''.join(runs))
+                        runs = []
+                        yield '\n'.join(paragraphs)
+                        paragraphs = []
+                    else:
+                        runs.append('\n')
+                elif tag == _WORD_NS + 'p':
+                    paragraphs.append(''.join(runs))
+                    runs = []
+                    element.clear()
+        except (ParseError, zipfile.BadZipFile) as error:
+            raise UnsupportedDocument(f'Unreadable DOCX: {error}') from error
+        if paragraphs or runs:
+            paragraphs.append(''.join(runs))
+            yield '\n'.join(paragraphs)
+
+
+def iter_text_pages(document: SpooledDocument) -> Iterator[str]:
+    """A plain-text document in chunks of whole lines, decoded as UTF-8"""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    pending = ''
+    for chunk in document.chunks(CHUNK_BYTES):
+        pending += decoder.decode(chunk)
+        cut = pending.rfind('\n') + 1
+        if cut:
+            yield pending[:cut]
+            pending = pending[cut:]
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+PAGE_READERS = {'pdf': iter_pdf_pages, 'docx': iter_docx_pages, 'text': iter_text_pages}
+
+
+class TextExtractor:
+    """
+    Extracts, cleans and caches the text of spooled documents.
+
+    Args:
+        max_chars: Characters of text kept per document
+        cache_size: Documents whose text is cached
+        cache_ttl: Lifetime of a cached text in seconds
+    """
+
+    def __init__(self, max_chars: int = TEXT_MAX_CHARS, cache_size: Optional[int] = None,
+                 cache_ttl: Optional[float] = None):
+        self.max_chars = max_chars
+        self.cache = TTLCache(
+            cache_size if cache_size is not None else int(os.getenv('DOCUMENT_TEXT_CACHE_SIZE', '256')),
+            cache_ttl if cache_ttl is not None else float(os.getenv('DOCUMENT_TEXT_CACHE_TTL_SECONDS', '86400')))
+        self._lock = threading.Lock()
+        self.counters = {'extracted': 0, 'empty': 0, 'unsupported': 0, 'pages_read': 0,
+                         'bytes_in': 0, 'chars_out': 0}
+        self.kinds: Counter = Counter()
+
+    def _read_pages(self, document: SpooledDocument, kind: str) -> Tuple[List[str], int]:
+        """Normalized pages until there is enough text (with room for boilerplate to be dropped)"""
+        pages: List[str] = []
+        collected = 0
+        read = 0
+        for page in PAGE_READERS[kind](document):
+            read += 1
+            page = normalize_whitespace(page)
+            pages.append(page)
+            collected += len(page)
+            if collected >= self.max_chars * 2:
+                break
+        return pages, read
+
+    def extract(self, document: SpooledDocument) -> str:
+        """
+        The document's cleaned text, at most max_chars characters ('' when
+        it has none, e.g. a scanned PDF).
+
+        Raises:
+            UnsupportedDocument: The document's type cannot be read
+        """
+        key = ('document_text', document.sha256, self.max_chars)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        try:
+            kind = document_kind(document)
+            pages, read = self._read_pages(document, kind)
+        except UnsupportedDocument:
+            self._count(unsupported=1)
+            raise
+        text = drop_boilerplate(pages, running_lines=(kind == 'pdf'))
+        if len(text) > self.max_chars:
+            # End on a word boundary rather than mid-word
+            cut = text.rfind(' ', 0, self.max_chars + 1)
+            text = text[:cut if cut > self.max_chars // 2 else self.max_chars].rstrip()
+        self._count(extracted=1, empty=int(not text), pages_read=read, bytes_in=document.size,
+                    chars_out=len(text))
+        with self._lock:
+            self.kinds[kind] += 1
+        logger.info(f"Extracted {len(text)} characters from {read} {kind} page(s) of {document.size} bytes")
+        self.cache.set(key, text)
+        return text
+
+    def _count(self, **increments: int) -> None:
+        with self._lock:
+            for counter, increment in increments.items():
+                self.counters[counter] += increment
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.counters)
+            kinds = dict(self.kinds)
+        return {
+            'max_chars': self.max_chars,
+            'pdf_supported': PdfReader is not None,
+            **counters,
+            'kinds': kinds,
+            'cache': self.cache.stats()
+        }
+
+
+# Process-wide extractor (its cache is shared by every request)
+text_extractor = TextExtractor()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+ICAN Document Upload
+====================
+
+Receives contract documents without holding them in memory as Python
+strings. Besides base64 inside a JSON body, documents may be uploaded as
+multipart/form-data (a "file" part plus form fields) or as the raw request
+body (Content-Type set to the document's MIME type, other fields in the
+query string), which avoids base64's 33% inflation on the wire.
+
+Uploads are read in chunks and spooled to a temporary file (kept in memory
+only while small). The size limit is enforced while streaming, so an
+oversized upload is cut off as soon as it passes the limit, and the
+SHA-256 of the content is computed on the fly. JSON base64 documents are
+decoded into the same kind of spool, so the analysis pipeline always gets
+a file-backed SpooledDocument.
+
+Configuration:
+    DOCUMENT_SPOOL_MEMORY_KB    uploads up to this size stay in memory (1024)
+    DOCUMENT_SPOOL_DIR          directory for spooled uploads (system temp dir)
+    DOCUMENT_CHUNK_KB           read/write chunk size (256)
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import os
+import base64
+import hashlib
+import binascii
+import tempfile
+import threading
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+CHUNK_BYTES = int(os.getenv('DOCUMENT_CHUNK_KB', '256')) * 1024
+SPOOL_MEMORY_BYTES = int(os.getenv('DOCUMENT_SPOOL_MEMORY_KB', '1024')) * 1024
+SPOOL_DIR = os.getenv('DOCUMENT_SPOOL_DIR') or None
+
+# Multipart limits: werkzeug applies the memory cap to form fields and to the bytes it
+# buffers while looking for the next line break in binary file data
+FORM_FIELD_MEMORY_BYTES = 1024 * 1024
+FORM_MAX_PARTS = 32
+
+
+class DocumentTooLarge(Exception):
+    """The document passed the size limit while being received"""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f'Document exceeds {max_bytes} bytes')
+        self.max_bytes = max_bytes
+
+
+class InvalidDocument(ValueError):
+    """The request carries no usable document"""
+
+
+class SpooledDocument:
+    """
+    A document received in chunks: spooled to a temporary file, size-checked
+    and hashed as it is written. Close it (or use it as a context manager)
+    to delete the spool.
+
+    Args:
+        max_bytes: Largest accepted document
+        mime_type: Document MIME type
+        filename: Client-supplied file name, if any
+    """
+
+    def __init__(self, max_bytes: int, mime_type: str = '', filename: str = ''):
+        self.max_bytes = max_bytes
+        self.mime_type = mime_type
+        self.filename = filename
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES, dir=SPOOL_DIR)
+        self._lock = threading.Lock()
+
+    # File protocol: werkzeug's multipart parser writes a part through it, pypdf and zipfile read through it
+    def write(self, chunk: bytes) -> int:
+        if self.size + len(chunk) > self.max_bytes:
+            raise DocumentTooLarge(self.max_bytes)
+        self.size += len(chunk)
+        self._hash.update(chunk)
+        return self._file.write(chunk)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._file.seek(offset, whence)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto_at(self, offset: int, buffer: bytearray) -> int:
+        """Fill buffer from offset (short only at the end); safe while others read elsewhere"""
+        view = memoryview(buffer)
+        filled = 0
+        with self._lock:
+            self._file.seek(offset)
+            while filled < len(view):
+                size = self._file.readinto(view[filled:])
+                if not size:
+                    break
+                filled += size
+        return filled
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    @property
+    def base64_length(self) -> int:
+        """Length of the document once base64-encoded"""
+        return (self.size + 2) // 3 * 4
+
+    def chunks(self, chunk_size: int = CHUNK_BYTES) -> Iterator[bytes]:
+        """The document's bytes from the start, chunk_size at a time"""
+        self._file.seek(0)
+        while True:
+            chunk = self._file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            'filename': self.filename or None,
+            'mime_type': self.mime_type,
+            'size_bytes': self.size,
+            'sha256': self.sha256
+        }
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> 'SpooledDocument':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def spool_stream(stream: Any, max_bytes: int, mime_type: str = '', filename: str = '') -> SpooledDocument:
+    """Spool a readable byte stream, chunk by chunk, into a SpooledDocument"""
+    document = SpooledDocument(max_bytes, mime_type, filename)
+    try:
+        while True:
+            chunk = stream.read(CHUNK_BYTES)
+            if not chunk:
+                break
+            document.write(chunk)
+    except BaseException:
+        document.close()
+        raise
+    document.seek(0)
+    return document
+
+
+def spool_base64(text: str, max_bytes: int, mime_type: str = '', filename: str = '') -> SpooledDocument:
+    """Decode a base64 string (optionally a data: URL) chunk by chunk into a SpooledDocument"""
+    if text.startswith('data:') and ',' in text[:256]:
+        text = text.split(',', 1)[1]
+    if ' ' in text or '\n' in text or '\r' in text or '\t' in text:
+        text = ''.join(text.split())
+    # Decoding in whole 4-character groups keeps every chunk independently decodable
+    step = CHUNK_BYTES // 3 * 4
+    document = SpooledDocument(max_bytes, mime_type, filename)
+    try:
+        for start in range(0, len(text), step):
+            document.write(base64.b64decode(text[start:start + step], validate=True))
+    except (binascii.Error, ValueError) as error:
+        document.close()
+        raise InvalidDocument(f'Document is not valid base64: {error}') from error
+    except BaseException:
+        document.close()
+        raise
+    document.seek(0)
+    return document
+
+
+def is_streamed_upload(request: Any) -> bool:
+    """Whether a Flask request carries its document as multipart or raw body rather than JSON"""
+    return not request.is_json and request.mimetype not in ('', 'application/x-www-form-urlencoded')
+
+
+def receive_upload(request: Any, max_bytes: int, field: str = 'file') -> Tuple[SpooledDocument, Dict[str, str]]:
+    """
+    Spool the document of a multipart or raw-body Flask request.
+
+    Multipart requests carry the document in the `field` part, with the
+    other fields as form fields; its MIME type is the part's Content-Type
+    unless a mime_type field is given. Raw-body requests carry the
+    document as the whole body, with its MIME type as the Content-Type
+    and the other fields in the query string.
+
+    Returns:
+        (document, fields)
+
+    Raises:
+        DocumentTooLarge: The document passed max_bytes while streaming
+        InvalidDocument: No document in the request
+    """
+    if request.mimetype == 'multipart/form-data':
+        from werkzeug.exceptions import RequestEntityTooLarge
+        from werkzeug.formparser import FormDataParser
+
+        def stream_factory(total_content_length: Optional[int], content_type: Optional[str],
+                           filename: Optional[str], content_length: Optional[int] = None) -> SpooledDocument:
+            return SpooledDocument(max_bytes, content_type or '', filename or '')
+
+        parser = FormDataParser(stream_factory, max_form_memory_size=FORM_FIELD_MEMORY_BYTES,
+                                max_form_parts=FORM_MAX_PARTS, silent=False)
+        try:
+            _, form, files = parser.parse(request.stream, request.mimetype, request.content_length,
+                                          request.mimetype_params)
+        except (ValueError, RequestEntityTooLarge) as error:
+            raise InvalidDocument(f'Malformed multipart upload: {error}') from error
+        fields = form.to_dict()
+        document = None
+        for name, upload in files.items(multi=True):
+            if name == field and document is None:
+                document = upload.stream
+            else:
+                upload.stream.close()
+        if document is None:
+            raise InvalidDocument(f"Multipart upload has no '{field}' part")
+        document.mime_type = fields.get('mime_type') or document.mime_type
+        return document, fields
+    fields = request.args.to_dict()
+    document = spool_stream(request.stream, max_bytes, fields.get('mime_type') or request.mimetype,
+                            fields.get('filename', ''))
+    if not document.size:
+        document.close()
+        raise InvalidDocument('Request body is empty')
+    return document, fields
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+ICAN HTTP Connection Pools
+==========================
+
+One shared, thread-safe requests.Session per LLM provider, so calls to
+generativelanguage.googleapis.com and api.openai.com reuse keep-alive
+connections instead of paying a fresh TCP+TLS handshake every time.
+
+Every connection checked out of a pool is tied to the inbound request using
+it (see ican_request_context); when that request is cancelled because its
+client disconnected, the connection's socket is shut down, which aborts the
+provider call in flight instead of waiting it out.
+
+In the async serving mode (see ican_async_bridge) the same pool sends
+through an aiohttp session on the event loop instead, with the same limits
+and stats; callers still receive a requests.Response and requests
+exceptions, so nothing above the pool changes.
+
+Configuration (per provider, falling back to the PROVIDER_* defaults):
+    <NAME>_POOL_SIZE / PROVIDER_POOL_SIZE              max pooled connections (20)
+    <NAME>_POOL_BLOCK / PROVIDER_POOL_BLOCK            wait for a free connection when full (false)
+    <NAME>_CONNECT_TIMEOUT / PROVIDER_CONNECT_TIMEOUT  seconds (5)
+    <NAME>_READ_TIMEOUT / PROVIDER_READ_TIMEOUT        seconds (30)
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import os
+import socket
+import asyncio
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from typing import Any, Dict, Optional, Tuple, Union
+
+from ican_async_bridge import await_only, in_async_bridge
+from ican_request_context import current_context
+
+
+def _provider_setting(name: str, setting: str, default: str) -> str:
+    return os.getenv(f'{name.upper()}_{setting}', os.getenv(f'PROVIDER_{setting}', default))
+
+
+class _CancellableConnections:
+    """Pool mixin: connections in use can be shut down by the request that checked them out"""
+
+    def _get_conn(self, timeout: Optional[float] = None) -> Any:
+        conn = super()._get_conn(timeout)
+        context = current_context()
+        if context is not None:
+            def abort() -> None:
+                sock = getattr(conn, 'sock', None)
+                if getattr(conn, 'ican_context', None) is context and sock is not None:
+                    try:
+                        sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+            conn.ican_context = context
+            conn.ican_abort = abort
+            context.on_cancel(abort)
+        return conn
+
+    def _put_conn(self, conn: Any) -> None:
+        context = getattr(conn, 'ican_context', None)
+        if context is not None:
+            context.remove_cancel_callback(conn.ican_abort)
+            conn.ican_context = None
+        super()._put_conn(conn)
+
+
+class CancellableHTTPConnectionPool(_CancellableConnections, HTTPConnectionPool):
+    pass
+
+
+class CancellableHTTPSConnectionPool(_CancellableConnections, HTTPSConnectionPool):
+    pass
+
+
+class CancellableHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections abort when their request is cancelled"""
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CancellableHTTPConnectionPool,
+            'https': CancellableHTTPSConnectionPool
+        }
+
+
+class PooledSession:
+    """
+    Keep-alive session with a bounded connection pool and saturation stats.
+
+    Args:
+        name: Provider name, used for configuration lookup and stats
+        pool_size: Maximum connections kept per host
+        pool_block: Block callers when every connection is busy instead of
+            opening (and then discarding) an extra connection
+        connect_timeout: Default TCP/TLS connect timeout in seconds
+        read_timeout: Default read timeout in seconds
+    """
+
+    def __init__(self, name: str, pool_size: int = 20, pool_block: bool = False,
+                 connect_timeout: float = 5.0, read_timeout: float = 30.0):
+        self.name = name
+        self.pool_size = max(1, int(pool_size))
+        self.pool_block = pool_block
+        self.connect_timeout = float(connect_timeout)
+        self.read_timeout = float(read_timeout)
+
+        self._lock = threading.Lock()
+        self.session = self._build_session()
+        # One aiohttp session per event loop (sessions cannot be shared across loops)
+        self._async_sessions: Dict[asyncio.AbstractEventLoop, Any] = {}
+
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.saturated = 0
+
+    def _build_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = CancellableHTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            pool_block=self.pool_block
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Connection': 'keep-alive'})
+        return session
+
+    def reset(self) -> None:
+        """Drop every pooled connection (e.g. in a freshly forked worker)"""
+        with self._lock:
+            old_session, self.session = self.session, self._build_session()
+            self._async_sessions = {}
+            self.in_flight = 0
+        old_session.close()
+
+    def _get_async_session(self) -> Any:
+        """aiohttp session for the running event loop, created on first use"""
+        import aiohttp
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._async_sessions:
+                # Same sizing as the requests pool: capped only when callers should block
+                connector = aiohttp.TCPConnector(limit=self.pool_size if self.pool_block else 0)
+                self._async_sessions[loop] = aiohttp.ClientSession(connector=connector)
+            return self._async_sessions[loop]
+
+    async def aclose(self) -> None:
+        """Close the running loop's aiohttp session (on shutdown of the async server)"""
+        with self._lock:
+            session = self._async_sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    async def _post_async(self, url: str, timeout: Tuple[float, float], **kwargs: Any) -> requests.Response:
+        """The aiohttp version of session.post, shaped like requests (response and exceptions)"""
+        import aiohttp
+        connect_timeout, read_timeout = timeout
+        client_timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        try:
+            async with self._get_async_session().post(url, timeout=client_timeout, **kwargs) as reply:
+                body = await reply.read()
+        except getattr(aiohttp, 'ConnectionTimeoutError', ()) as error:
+            raise requests.exceptions.ConnectTimeout(f'{url}: {str(error)}') from error
+        except asyncio.TimeoutError as error:
+            raise requests.exceptions.ReadTimeout(f'{url}: read timed out after {read_timeout}s') from error
+        except aiohttp.ClientConnectionError as error:
+            raise requests.exceptions.ConnectionError(f'{url}: {str(error)}') from error
+        except aiohttp.ClientError as error:
+            raise requests.exceptions.RequestException(f'{url}: {str(error)}') from error
+
+        response = requests.Response()
+        response.status_code = reply.status
+        response.reason = reply.reason
+        response.url = str(reply.url)
+        response.headers = CaseInsensitiveDict(reply.headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = body
+        response._content_consumed = True
+        return response
+
+    def resolve_timeout(self, timeout: Union[None, float, Tuple[float, float]]) -> Tuple[float, float]:
+        """Turn None / a read timeout / a (connect, read) pair into a (connect, read) pair"""
+        if timeout is None:
+            return (self.connect_timeout, self.read_timeout)
+        if isinstance(timeout, tuple):
+            return timeout
+        return (self.connect_timeout, float(timeout))
+
+    def post(self, url: str, timeout: Union[None, float, Tuple[float, float]] = None,
+             **kwargs: Any) -> requests.Response:
+        """
+        POST through the shared pool.
+
+        Args:
+            url: Target URL
+            timeout: None for the pool defaults, a number for the read timeout,
+                or an explicit (connect, read) tuple
+            **kwargs: Passed straight to requests.Session.post
+        """
+        with self._lock:
+            self.requests += 1
+            if self.in_flight >= self.pool_size:
+                self.saturated += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            session = self.session
+
+        try:
+            if in_async_bridge():
+                return await_only(self._post_async(url, self.resolve_timeout(timeout), **kwargs))
+            return session.post(url, timeout=self.resolve_timeout(timeout), **kwargs)
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight = max(0, self.in_flight - 1)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool saturation stats for health/metrics endpoints"""
+        with self._lock:
+            return {
+                'provider': self.name,
+                'pool_size': self.pool_size,
+                'pool_block': self.pool_block,
+                'connect_timeout': self.connect_timeout,
+                'read_timeout': self.read_timeout,
+                'requests': self.requests,
+                'errors': self.errors,
+                'in_flight': self.in_flight,
+                'peak_in_flight': self.peak_in_flight,
+                'utilization': round(self.in_flight / self.pool_size, 3),
+                'saturated_requests': self.saturated
+            }
+
+
+_pools: Dict[str, PooledSession] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name: str) -> PooledSession:
+    """Return the process-wide pool for a provider, creating it on first use"""
+    pool: Optional[PooledSession] = _pools.get(name)
+    if pool is not None:
+        return pool
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = PooledSession(
+                name,
+                pool_size=int(_provider_setting(name, 'POOL_SIZE', '20')),
+                pool_block=_provider_setting(name, 'POOL_BLOCK', 'false').lower() == 'true',
+                connect_timeout=float(_provider_setting(name, 'CONNECT_TIMEOUT', '5')),
+                read_timeout=float(_provider_setting(name, 'READ_TIMEOUT', '30'))
+            )
+        return _pools[name]
+
+
+def reset_pools() -> None:
+    """Drop pooled connections of every provider"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.reset()
+
+
+async def close_async_sessions() -> None:
+    """Close the aiohttp sessions of every provider"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        await pool.aclose()
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Stats of every pool created in this process"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.name: pool.stats() for pool in pools}
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+ICAN Local Transaction Parser
+=============================
+
+Deterministic first-stage parser for the NLP processors. Most entries are
+simple "<item> <amount>" phrases ("boda 5000", "lunch 15000 at cafe
+javas") that do not need an LLM. parse_locally() returns a transaction
+plus a confidence score in [0, 1]; only inputs scoring below the
+configured threshold are escalated to the provider.
+
+The same parser doubles as the fallback when the provider is unavailable.
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import re
+import threading
+from typing import Any, Dict, List, Tuple
+
+# "50k", "2.5M", "15,000", "1.2 million", "3bn", "5000 ugx"
+AMOUNT_RE = re.compile(
+    r'(?<![\w.])(\d{1,3}(?:,\d{3})+|\d+(?:\.\d+)?)\s*'
+    r'(k|m|b|bn|thousand|million|billion)?(?![a-z])',
+    re.IGNORECASE
+)
+CURRENCY_RE = re.compile(r'\b(?:ugx|ushs?|shs?|shillings?)\b|/=', re.IGNORECASE)
+MULTIPLIERS = {
+    'k': 1_000, 'thousand': 1_000,
+    'm': 1_000_000, 'million': 1_000_000,
+    'b': 1_000_000_000, 'bn': 1_000_000_000, 'billion': 1_000_000_000
+}
+
+TYPE_KEYWORDS = {
+    'TITHING': ('tithe', 'offering', 'church', 'donation', 'seed'),
+    'LOAN': ('loan', 'borrowed', 'borrow', 'credit', 'advance', 'lent'),
+    'INCOME': ('salary', 'earned', 'received', 'income', 'profit', 'sold', 'sales', 'wage', 'paid me', 'commission'),
+    'EXPENSE': ('bought', 'paid', 'spent', 'cost', 'expense', 'bill', 'buy', 'purchase', 'fees')
+}
+
+# Checked in order; first match wins
+CATEGORY_KEYWORDS = [
+    ('Transport', ('boda', 'taxi', 'transport', 'fuel', 'petrol', 'uber', 'bolt', 'bus', 'fare', 'safeboda')),
+    ('Food', ('lunch', 'breakfast', 'dinner', 'supper', 'food', 'groceries', 'grocery', 'posho', 'matooke',
+              'rolex', 'cafe', 'restaurant', 'eat', 'meal', 'snack', 'market')),
+    ('Utilities', ('umeme', 'yaka', 'electricity', 'water', 'airtime', 'data', 'internet', 'wifi', 'power')),
+    ('Rent', ('rent', 'landlord', 'house')),
+    ('Health', ('hospital', 'clinic', 'medicine', 'pharmacy', 'doctor', 'drugs')),
+    ('Education', ('school', 'tuition', 'fees', 'books', 'uniform')),
+    ('Salary', ('salary', 'wage', 'payroll')),
+    ('Church', ('tithe', 'offering', 'church')),
+    ('Business', ('stock', 'business', 'supplier', 'inventory', 'shop')),
+    ('Shopping', ('shoes', 'clothes', 'shirt', 'dress', 'phone', 'shopping')),
+    ('Entertainment', ('movie', 'party', 'drinks', 'beer', 'club'))
+]
+
+DEFAULT_CATEGORIES = {
+    'TITHING': 'Religious Giving',
+    'LOAN': 'Financial Loan',
+    'INCOME': 'Income Source',
+    'EXPENSE': 'General Expense'
+}
+
+_WORD_RE = re.compile(r"[a-z']+")
+
+
+def extract_amounts(text: str) -> List[float]:
+    """Every amount mentioned in the text, with k/M/bn style suffixes applied"""
+    amounts = []
+    for number, suffix in AMOUNT_RE.findall(text):
+        value = float(number.replace(',', ''))
+        if suffix:
+            value *= MULTIPLIERS[suffix.lower()]
+        if value > 0:
+            amounts.append(value)
+    return amounts
+
+
+def _has_keyword(text_lower: str, words: set, keyword: str) -> bool:
+    return keyword in text_lower if ' ' in keyword else keyword in words
+
+
+def clean_description(text: str) -> str:
+    """Drop amounts and currency markers, collapse whitespace, capitalise"""
+    description = CURRENCY_RE.sub(' ', AMOUNT_RE.sub(' ', text))
+    description = ' '.join(description.split()).strip(' ,.-')
+    if not description:
+        return 'Manual Transaction Entry'
+    return (description[0].upper() + description[1:])[:100]
+
+
+def parse_locally(user_text: str) -> Tuple[Dict[str, Any], float]:
+    """
+    Parse a transaction without calling an LLM.
+
+    Args:
+        user_text: Raw user input
+
+    Returns:
+        Tuple of (transaction with amount_ugx/type/category/description,
+        confidence between 0 and 1). amount_ugx is 0 when no amount was found.
+    """
+    text_lower = user_text.lower()
+    words = set(_WORD_RE.findall(text_lower))
+    amounts = extract_amounts(user_text)
+
+    matched_types = [tx_type for tx_type, keywords in TYPE_KEYWORDS.items()
+                     if any(_has_keyword(text_lower, words, keyword) for keyword in keywords)]
+    trans_type = matched_types[0] if matched_types else 'EXPENSE'
+
+    category = None
+    for name, keywords in CATEGORY_KEYWORDS:
+        if any(_has_keyword(text_lower, words, keyword) for keyword in keywords):
+            category = name
+            break
+
+    # --- Confidence scoring
+    confidence = 0.0
+    if len(amounts) == 1:
+        confidence += 0.5
+    elif amounts:
+        confidence += 0.2  # several numbers: which one is the transaction?
+    if category:
+        confidence += 0.3
+    if matched_types:
+        confidence += 0.1
+    if len(matched_types) > 1 and trans_type != 'TITHING':
+        confidence -= 0.3  # e.g. "received loan to pay salary"
+    if len(user_text.split()) <= 6:
+        confidence += 0.15  # the common "<item> <amount>" shape
+    if not amounts:
+        confidence = 0.0
+
+    transaction = {
+        'amount_ugx': amounts[0] if len(amounts) == 1 else max(amounts, default=0),
+        'type': trans_type,
+        'category': category or DEFAULT_CATEGORIES[trans_type],
+        'description': clean_description(user_text)
+    }
+    return transaction, round(max(0.0, min(1.0, confidence)), 2)
+
+
+class CascadeStats:
+    """Which tier answered each parse (cache / local / llm / speculative / degraded / fallback) and how long it took"""
+
+    TIERS = ('cache', 'local', 'llm', 'speculative', 'degraded', 'fallback')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {tier: 0 for tier in self.TIERS}
+        self._seconds = {tier: 0.0 for tier in self.TIERS}
+        self._events: Dict[str, int] = {}
+
+    def record(self, tier: str, seconds: float) -> None:
+        with self._lock:
+            self._counts[tier] = self._counts.get(tier, 0) + 1
+            self._seconds[tier] = self._seconds.get(tier, 0.0) + seconds
+
+    def count(self, event: str) -> None:
+        """Bump a free-form counter, e.g. background cache fills after a speculative answer"""
+        with self._lock:
+            self._events[event] = self._events.get(event, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+            seconds = dict(self._seconds)
+            events = dict(self._events)
+        total = sum(counts.values())
+        avg_llm = seconds['llm'] / counts['llm'] if counts['llm'] else 0.0
+        return {
+            'total': total,
+            'tiers': {
+                tier: {
+                    'count': counts[tier],
+                    'share': round(counts[tier] / total, 4) if total else 0.0,
+                    'avg_latency_ms': round(1000 * seconds[tier] / counts[tier], 2) if counts[tier] else 0.0
+                } for tier in counts
+            },
+            'llm_calls_avoided': counts['local'],
+            # What the locally answered parses would have cost at the observed LLM latency
+            'estimated_llm_seconds_saved': round(counts['local'] * avg_llm, 2),
+            'events': events
+        }
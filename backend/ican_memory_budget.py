@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+ICAN Memory Budget
+==================
+
+A byte-budget semaphore for requests that carry whole documents. A base64
+document sent as JSON is held several times over while it is handled (the
+raw body, the parsed string, the provider payload and its serialization),
+so a handful of concurrent 20MB uploads can push a worker out of memory.
+
+Each document request reserves its decoded document size, estimated from
+Content-Length, before the body is read or parsed, and gives it back when
+the response is done. When the budget is used up the request waits in
+FIFO order (small documents do not overtake a large one forever), for at
+most DOCUMENT_BUDGET_WAIT_SECONDS and never past its deadline, and is then
+answered 503 with Retry-After. A document larger than the whole budget is
+admitted only when nothing else is in flight.
+
+The budget is per process. In-flight and peak in-flight bytes are exposed
+as gauges through stats().
+
+In the async serving mode the body has already been read by the event
+loop when the reservation is made, so the budget bounds the copies made
+while handling it, not the read itself.
+
+Configuration:
+    DOCUMENT_BUDGET_ENABLED         enable the budget (true)
+    DOCUMENT_BUDGET_MB              decoded document bytes in flight per process (256)
+    DOCUMENT_BUDGET_WAIT_SECONDS    longest wait for room in the budget (10)
+    DOCUMENT_BUDGET_MAX_WAITERS     requests allowed to wait (64)
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import os
+import math
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
+from typing import Any, Callable, Deque, Dict, Iterable, Optional, Tuple
+
+from ican_request_context import RequestCancelled, remaining_seconds, wait_for_result
+
+
+class BudgetExhausted(Exception):
+    """No room in the memory budget within the allowed wait"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Reservation:
+    """Bytes held in a MemoryBudget; release() once the document is no longer referenced"""
+
+    def __init__(self, budget: 'MemoryBudget', size: int):
+        self.budget = budget
+        self.size = size
+        self.started = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self.budget._release(self)
+
+
+class MemoryBudget:
+    """
+    Bytes of documents allowed in flight at once.
+
+    Args:
+        name: Budget name for error messages
+        capacity_bytes: Total bytes that may be reserved at once
+        max_wait_seconds: Longest wait for room
+        max_waiters: Requests allowed to wait at once
+        enabled: When False every reservation is granted at once
+    """
+
+    def __init__(self, name: str, capacity_bytes: Optional[int] = None, max_wait_seconds: Optional[float] = None,
+                 max_waiters: Optional[int] = None, enabled: Optional[bool] = None):
+        self.name = name
+        self.capacity = (capacity_bytes if capacity_bytes is not None
+                         else int(float(os.getenv('DOCUMENT_BUDGET_MB', '256')) * 1024 * 1024))
+        self.max_wait_seconds = (max_wait_seconds if max_wait_seconds is not None
+                                 else float(os.getenv('DOCUMENT_BUDGET_WAIT_SECONDS', '10')))
+        self.max_waiters = max_waiters if max_waiters is not None else int(os.getenv('DOCUMENT_BUDGET_MAX_WAITERS', '64'))
+        self.enabled = (enabled if enabled is not None
+                        else os.getenv('DOCUMENT_BUDGET_ENABLED', 'true').lower() == 'true')
+        self._lock = threading.Lock()
+        self._waiters: Deque[Tuple[int, Future]] = deque()
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.reservations = 0
+        self.granted = 0
+        self.waited = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.hold_seconds = 0.0
+        self.released = 0
+
+    def _fits(self, size: int) -> bool:
+        # An oversized document may go alone rather than never
+        return self.in_use + size <= self.capacity or self.in_use == 0
+
+    def _grant(self, size: int) -> None:
+        self.in_use += size
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        self.reservations += 1
+        self.granted += 1
+
+    def _grant_waiters(self) -> None:
+        """Hand freed bytes to the waiters at the head of the line, in order"""
+        while self._waiters and self._fits(self._waiters[0][0]):
+            size, future = self._waiters.popleft()
+            self._grant(size)
+            future.set_result(None)
+
+    def _retry_after(self) -> float:
+        """Typical time a reservation is held: a fair guess of when room frees up"""
+        return max(1.0, self.hold_seconds / self.released) if self.released else 1.0
+
+    def reserve(self, size: int, timeout: Optional[float] = None) -> Reservation:
+        """
+        Reserve size bytes, waiting up to timeout seconds (max_wait_seconds
+        by default) for room.
+
+        Raises:
+            BudgetExhausted: No room within the wait, or too many waiters
+            RequestCancelled: The client disconnected while waiting
+        """
+        size = max(0, int(size))
+        if not self.enabled:
+            return Reservation(self, 0)
+        timeout = self.max_wait_seconds if timeout is None else timeout
+        started = time.monotonic()
+        with self._lock:
+            if not self._waiters and self._fits(size):
+                self._grant(size)
+                return Reservation(self, size)
+            if timeout <= 0 or len(self._waiters) >= self.max_waiters:
+                self.rejected += 1
+                raise BudgetExhausted(f'{self.name}: {self.in_use} of {self.capacity} bytes in flight, '
+                                      f'{len(self._waiters)} waiting', self._retry_after())
+            waiter = (size, Future())
+            self._waiters.append(waiter)
+            self.waited += 1
+        try:
+            wait_for_result(waiter[1], timeout)
+        except FuturesTimeoutError:
+            pass
+        except RequestCancelled:
+            with self._lock:
+                if waiter[1].done():
+                    self.in_use -= size
+                else:
+                    self._waiters.remove(waiter)
+                self._grant_waiters()
+            raise
+        with self._lock:
+            self.wait_seconds += time.monotonic() - started
+            if waiter[1].done():
+                return Reservation(self, size)
+            # Gave up: a large head leaving may let the next ones in
+            self._waiters.remove(waiter)
+            self._grant_waiters()
+            self.rejected += 1
+            raise BudgetExhausted(f'{self.name}: no room for {size} bytes within {timeout:.1f}s', self._retry_after())
+
+    def _release(self, reservation: Reservation) -> None:
+        with self._lock:
+            self.in_use -= reservation.size
+            self.hold_seconds += time.monotonic() - reservation.started
+            self.released += 1
+            self._grant_waiters()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'capacity_bytes': self.capacity,
+                'in_flight_bytes': self.in_use,
+                'peak_in_flight_bytes': self.peak_in_use,
+                'waiting': len(self._waiters),
+                'granted': self.granted,
+                'waited': self.waited,
+                'rejected': self.rejected,
+                'wait_seconds_total': round(self.wait_seconds, 3),
+                'hold_seconds_mean': round(self.hold_seconds / self.released, 3) if self.released else 0.0
+            }
+
+
+def decoded_document_bytes(content_length: int, mimetype: str) -> int:
+    """Decoded size of the document in a body of content_length bytes (base64 when sent as JSON)"""
+    return content_length * 3 // 4 if mimetype == 'application/json' else content_length
+
+
+def init_memory_budget(app: Any, paths: Iterable[str], on_exhausted: Callable[[float], Any],
+                       on_cancelled: Callable[[], Any],
+                       estimate: Callable[[int, str], int] = decoded_document_bytes) -> MemoryBudget:
+    """
+    Make requests to the given paths of a Flask app reserve their document
+    size before their view runs (register after init_request_context, so
+    the wait respects the request's deadline and disconnects).
+
+    Args:
+        app: Flask application
+        paths: Paths whose requests carry documents
+        on_exhausted: Returns the app's 503 response for (retry_after_seconds);
+            Retry-After is added here
+        on_cancelled: Returns the app's response for a client that
+            disconnected while waiting
+        estimate: Bytes to reserve for a body of the given length and MIME type
+
+    Returns:
+        The budget, for stats
+    """
+    from flask import g, make_response, request
+
+    budget = MemoryBudget(app.name)
+    document_paths = set(paths)
+
+    @app.before_request
+    def _reserve_document_memory():
+        if request.method == 'OPTIONS' or request.path not in document_paths:
+            return None
+        # Bodies without a length can be as large as the app accepts
+        content_length = request.content_length
+        if content_length is None:
+            content_length = app.config.get('MAX_CONTENT_LENGTH') or 0
+        timeout = budget.max_wait_seconds
+        remaining = remaining_seconds()
+        if remaining is not None:
+            timeout = min(timeout, remaining)
+        try:
+            g.ican_memory_reservation = budget.reserve(estimate(content_length, request.mimetype), timeout)
+        except RequestCancelled:
+            return on_cancelled()
+        except BudgetExhausted as exhausted:
+            response = make_response(on_exhausted(exhausted.retry_after))
+            response.headers['Retry-After'] = str(max(1, math.ceil(exhausted.retry_after)))
+            return response
+        return None
+
+    @app.teardown_request
+    def _release_document_memory(error=None):
+        reservation = g.pop('ican_memory_reservation', None)
+        if reservation is not None:
+            reservation.release()
+
+    return budget
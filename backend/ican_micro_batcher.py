@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+ICAN Micro-Batcher
+==================
+
+Gathers concurrent single-item requests for a short window (or until a
+batch is full), hands them to one batch function, and scatters the
+per-item results back to the waiting callers.
+
+Used by the NLP processors to pack many parse_transaction calls into a
+single LLM prompt, so the system instruction and the provider round trip
+are paid once per batch instead of once per transaction. Items are only
+batched with others of the same request class and tenant, and each batch
+runs in a detached context of those (no deadline, never cancelled: the
+callers wait with their own), so its provider call lands in the right
+governor lane and tenant queue.
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+from ican_request_context import (RequestContext, current_request_class, current_tenant, detached_context,
+                                  run_in_context)
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Collect submitted items into batches and process them together.
+
+    Args:
+        process_batch: Called with a list of items; must return a list of the
+            same length. An Exception instance in the result list fails only
+            that item's future.
+        max_batch_size: Dispatch as soon as this many items are waiting
+        max_wait_ms: Dispatch after this long even if the batch is not full
+        max_concurrent_batches: Batches allowed in flight at the same time
+        name: Used for thread names and log lines
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 16, max_wait_ms: float = 50,
+                 max_concurrent_batches: int = 4, name: str = 'micro-batcher'):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_concurrent_batches = max(1, int(max_concurrent_batches))
+        self.name = name
+
+        self._queue: 'queue.Queue' = queue.Queue()
+        self._lock = threading.Lock()
+        self._owner_pid = None
+        self._executor = None
+
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+
+    def _ensure_started(self) -> None:
+        """Start the collector thread lazily (and again in a forked worker)"""
+        if self._owner_pid == os.getpid():
+            return
+        with self._lock:
+            if self._owner_pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrent_batches,
+                thread_name_prefix=f'{self.name}-dispatch'
+            )
+            collector = threading.Thread(target=self._collect_loop, name=f'{self.name}-collector', daemon=True)
+            collector.start()
+            self._owner_pid = os.getpid()
+
+    def submit(self, item: Any) -> Future:
+        """Queue one item; the returned future resolves to that item's result"""
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((item, future, (current_request_class(), current_tenant()), detached_context()))
+        return future
+
+    def _collect_loop(self) -> None:
+        # Open batches by (request class, tenant): window end, context and items
+        open_batches: Dict[Tuple[str, str], Tuple[float, RequestContext, List[Any]]] = {}
+        while True:
+            timeout = None
+            if open_batches:
+                timeout = max(0.0, min(ends for ends, _, _ in open_batches.values()) - time.monotonic())
+            try:
+                item, future, key, context = self._queue.get(timeout=timeout)
+                if key not in open_batches:
+                    open_batches[key] = (time.monotonic() + self.max_wait, context, [])
+                open_batches[key][2].append((item, future))
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            for key, (window_ends, context, batch) in list(open_batches.items()):
+                if len(batch) >= self.max_batch_size or window_ends <= now:
+                    del open_batches[key]
+                    self._executor.submit(run_in_context, context, self._dispatch, batch)
+
+    def _dispatch(self, batch: List[Any]) -> None:
+        items = [item for item, _ in batch]
+        futures = [future for _, future in batch]
+
+        with self._lock:
+            self.batches += 1
+            self.items += len(items)
+            self.largest_batch = max(self.largest_batch, len(items))
+
+        try:
+            results = self.process_batch(items)
+            if len(results) != len(items):
+                raise ValueError(f'Batch returned {len(results)} results for {len(items)} items')
+        except Exception as e:
+            logger.warning(f"{self.name}: batch of {len(items)} failed: {str(e)}")
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        for future, result in zip(futures, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for the metrics endpoint"""
+        with self._lock:
+            return {
+                'enabled': True,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': round(self.max_wait * 1000, 1),
+                'batches': self.batches,
+                'items': self.items,
+                'avg_batch_size': round(self.items / self.batches, 2) if self.batches else 0.0,
+                'largest_batch': self.largest_batch,
+                'pending': self._queue.qsize()
+            }
@@ -11,16 +11,33 @@ Version: 1.0.0
 """
 
 import os
-import json
 import time
-import random
 import logging
-import requests
-from typing import Dict, Any, Optional
+import threading
+from contextvars import copy_context
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from typing import Dict, Any, Callable, Optional, Tuple
 from datetime import datetime
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 
+from ican_admission import init_admission_control
+from ican_async_server import run_async, server_mode
+from ican_http_pool import pool_stats
+from ican_local_parser import CascadeStats, parse_locally
+from ican_nlp_providers import (PROVIDER_CACHE_KEYS, UnusableAnswer, gemini_client, gemini_micro_batcher,
+                                openai_client, provider_timeout_info, request_gemini_transaction,
+                                request_openai_transaction)
+from ican_overload import OverloadController
+from ican_provider_router import ProviderRouter
+from ican_request_context import (DeadlineExceeded, RequestCancelled, deadline_stats, disconnect_watcher,
+                                  default_request_class, detached_context, ensure_time_left,
+                                  init_request_context, mark_deadline_exceeded, remaining_seconds,
+                                  run_in_context, wait_for_result)
+from ican_result_cache import TTLCache
+from ican_single_flight import SingleFlight
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -33,144 +50,106 @@ app = Flask(__name__)
 CORS(app)  # Enable Cross-Origin Resource Sharing
 
 # Configuration
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', 'your_gemini_api_key_here')
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent"
-
-# 🎯 MANDATORY STRUCTURED OUTPUT SCHEMA
-SINGLE_TRANSACTION_SCHEMA = {
-    "type": "OBJECT",
-    "description": "A single financial transaction parsed from natural language.",
-    "properties": {
-        "amount_ugx": {
-            "type": "NUMBER",
-            "description": "The exact numerical value of the transaction. Must be a positive number."
-        },
-        "type": {
-            "type": "STRING",
-            "enum": ["INCOME", "EXPENSE", "LOAN", "TITHING"],
-            "description": "The financial classification based on the nature of the transaction."
-        },
-        "category": {
-            "type": "STRING",
-            "description": "The inferred sub-category (e.g., 'Groceries', 'Salary', 'Rent')."
-        },
-        "description": {
-            "type": "STRING",
-            "description": "A concise, clean description of the transaction as it should appear in the log."
-        }
-    },
-    "required": ["amount_ugx", "type", "category", "description"]
-}
-
-# 🧠 AI SYSTEM INSTRUCTION - Precision Data Analyst Persona
-SYSTEM_INSTRUCTION = """
-You are a PRECISION DATA ANALYST specializing in financial transaction processing for Uganda's economic context.
-
-CORE MISSION: Transform ambiguous human language into concrete, structured financial data with mathematical precision.
-
-CRITICAL GUIDELINES:
-
-1. AMOUNT EXTRACTION (Priority #1):
-   - Extract ALL numerical values (including abbreviated forms)
-   - Convert: k/K = 1,000 | M = 1,000,000 | B = 1,000,000,000
-   - Examples: "50k" = 50000, "2.5M" = 2500000, "800" = 800
-   - If multiple amounts, choose the PRIMARY transaction amount
-   - NEVER return 0 or negative amounts
-
-2. TYPE CLASSIFICATION (Priority #2):
-   - INCOME: Salary, business revenue, gifts received, profits, sales
-   - EXPENSE: Purchases, bills, food, transport, services, shopping
-   - LOAN: Money borrowed, credit, advance payments, loans taken
-   - TITHING: Church offerings, religious donations, spiritual giving
-
-3. CATEGORY INFERENCE (Uganda Context):
-   - Use local terminology: "boda" (motorcycle transport), "posho" (food staple)
-   - Common categories: Transport, Food, Utilities, Salary, Business, Church
-   - Be specific but concise: "Grocery Shopping" vs just "Food"
-
-4. DESCRIPTION CLEANING:
-   - Create professional, clean descriptions
-   - Remove redundant words, slang, or unclear terms
-   - Keep essential context and location if relevant
-
-5. EDGE CASES:
-   - Ambiguous text: Make educated assumptions based on context
-   - Multiple transactions: Focus on the MAIN transaction
-   - Unclear amounts: Use reasonable estimation based on context
-
-RESPONSE FORMAT: Return ONLY the structured JSON object matching the schema. No additional text or explanations.
-"""
+ADMIN_API_TOKEN = os.getenv('ADMIN_API_TOKEN', '')
+
+# Batch parsing limits (/api/ai/parse_transactions)
+BATCH_MAX_ITEMS = int(os.getenv('NLP_BATCH_MAX_ITEMS', '500'))
+BATCH_MAX_WORKERS = int(os.getenv('NLP_BATCH_MAX_WORKERS', '8'))
+
+# Shared pool so concurrent batch requests cannot exceed BATCH_MAX_WORKERS provider calls
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix='nlp-batch')
+
+# ⚡ RESULT CACHE - keyed on normalized text + the model and prompt version that answered
+parse_cache = TTLCache(
+    max_entries=int(os.getenv('PARSE_CACHE_MAX_ENTRIES', '5000')),
+    ttl_seconds=float(os.getenv('PARSE_CACHE_TTL_SECONDS', '86400'))
+)
+
+# Identical texts already being parsed share one provider call
+inflight_parses = SingleFlight()
 
-def exponential_backoff_retry(func, max_retries: int = 3, base_delay: float = 1.0) -> Any:
+# 🧮 LOCAL-FIRST CASCADE - inputs the local parser scores at or above this skip the LLM
+LOCAL_PARSE_THRESHOLD = float(os.getenv('LOCAL_PARSE_CONFIDENCE_THRESHOLD', '0.85'))
+cascade_stats = CascadeStats()
+
+# 🏁 SPECULATIVE MODE - serve the local parse if Gemini misses the latency SLO
+PARSE_MODE = os.getenv('NLP_PARSE_MODE', 'accurate').lower()  # accurate | speculative
+SPECULATIVE_SLO_MS = float(os.getenv('NLP_SPECULATIVE_SLO_MS', '800'))
+SPECULATIVE_FILL_CACHE = os.getenv('NLP_SPECULATIVE_FILL_CACHE', 'true').lower() == 'true'
+speculative_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('NLP_SPECULATIVE_MAX_WORKERS', '16')),
+    thread_name_prefix='nlp-speculative'
+)
+
+# 🚦 LOAD SHEDDING - under overload single parses get the local parse instead of queueing (OVERLOAD_* settings)
+overload = OverloadController('nlp-gemini')
+
+micro_batcher = gemini_micro_batcher
+
+def describe_provider_timeout(user_text: str) -> Dict[str, Any]:
+    """The timeout Gemini calls for this text currently get, for debug metadata"""
+    return provider_timeout_info('gemini', user_text)
+
+def request_validated_transaction(provider: str, request_fn: Callable[[str], Any],
+                                  user_text: str) -> Dict[str, Any]:
     """
-    Execute a function with exponential backoff retry mechanism.
-    
-    Args:
-        func: Function to execute
-        max_retries: Maximum number of retry attempts
-        base_delay: Base delay in seconds
-    
-    Returns:
-        Function result or raises last exception
+    Ask one provider and validate its answer inside the routed call. A
+    missing or invalid transaction (OpenAI may answer TRANSFER or leave the
+    amount out) then counts as that provider failing, and the router fails
+    over instead of the caller getting a 400.
     """
-    for attempt in range(max_retries + 1):
-        try:
-            return func()
-        except Exception as e:
-            if attempt == max_retries:
-                logger.error(f"Function failed after {max_retries + 1} attempts: {str(e)}")
-                raise e
-            
-            delay = base_delay * (2 ** attempt) + random.uniform(0, 1)
-            logger.warning(f"Attempt {attempt + 1} failed: {str(e)}. Retrying in {delay:.2f}s...")
-            time.sleep(delay)
-
-def call_gemini_api(user_text: str) -> Dict[str, Any]:
+    try:
+        transaction = request_fn(user_text)
+        if not transaction:
+            raise ValueError('no transaction in the answer')
+        return validate_transaction(transaction)
+    except ValueError as error:
+        raise UnusableAnswer(f"{provider}: {str(error)}") from error
+
+# 🔀 PROVIDER ROUTING - Gemini always; OpenAI joins when its key is configured
+ROUTER_PROVIDERS = [
+    provider.strip() for provider in
+    os.getenv('NLP_ROUTER_PROVIDERS', 'gemini,openai' if os.getenv('OPENAI_API_KEY') else 'gemini').split(',')
+    if provider.strip()
+]
+_provider_router: Optional[ProviderRouter] = None
+_router_lock = threading.Lock()
+
+def get_provider_router() -> ProviderRouter:
+    """Build the router on first use"""
+    global _provider_router
+    if _provider_router is None:
+        with _router_lock:
+            if _provider_router is None:
+                router = ProviderRouter('nlp-gemini')
+                for provider in ROUTER_PROVIDERS:
+                    if provider == 'gemini':
+                        router.register('gemini', partial(request_validated_transaction, 'gemini',
+                                                          request_gemini_transaction), gemini_client)
+                    elif provider == 'openai':
+                        router.register('openai', partial(request_validated_transaction, 'openai',
+                                                          request_openai_transaction), openai_client)
+                    else:
+                        logger.warning(f"Unknown provider in NLP_ROUTER_PROVIDERS: {provider}")
+                _provider_router = router
+    return _provider_router
+
+def request_ai_transaction(user_text: str) -> Tuple[str, Dict[str, Any]]:
     """
-    Call Gemini API with structured output for transaction parsing.
-    
-    Args:
-        user_text: Raw user input text
-    
-    Returns:
-        Parsed transaction object
+    Ask the healthiest configured provider for one transaction, failing over
+    to the others. Returns (provider that answered, transaction).
     """
-    headers = {
-        'Content-Type': 'application/json',
-        'x-goog-api-key': GEMINI_API_KEY
-    }
-    
-    payload = {
-        "contents": [{
-            "parts": [{
-                "text": f"Parse this financial transaction: '{user_text}'"
-            }]
-        }],
-        "systemInstruction": {
-            "parts": [{
-                "text": SYSTEM_INSTRUCTION
-            }]
-        },
-        "generationConfig": {
-            "responseMimeType": "application/json",
-            "responseSchema": SINGLE_TRANSACTION_SCHEMA,
-            "temperature": 0.1,  # Low temperature for consistent parsing
-            "maxOutputTokens": 1024,
-            "candidateCount": 1
-        }
-    }
-    
-    def make_request():
-        response = requests.post(
-            GEMINI_API_URL,
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-        response.raise_for_status()
-        return response.json()
-    
-    return exponential_backoff_retry(make_request)
+    return get_provider_router().route_named(user_text)
+
+def cache_key(user_text: str, provider: str) -> Tuple[str, str, str]:
+    """Cache key of the answer provider gives for user_text (its model and prompt version)"""
+    model, version = PROVIDER_CACHE_KEYS[provider]
+    return parse_cache.make_key(user_text, model, version)
+
+def cached_transaction(user_text: str) -> Optional[Dict[str, Any]]:
+    """A cached answer from any routed provider, Gemini's own first"""
+    providers = ['gemini'] + [p for p in ROUTER_PROVIDERS if p != 'gemini' and p in PROVIDER_CACHE_KEYS]
+    return parse_cache.get_first(cache_key(user_text, provider) for provider in providers)
 
 def validate_transaction(transaction: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -219,45 +198,238 @@ def create_fallback_transaction(user_text: str) -> Dict[str, Any]:
     Returns:
         Basic transaction object
     """
-    # Try to extract numbers from text
-    import re
-    numbers = re.findall(r'[\d,]+(?:\.\d+)?', user_text.replace(',', ''))
-    amount = 0
+    transaction, _ = parse_locally(user_text)
+    transaction['amount_ugx'] = max(transaction['amount_ugx'], 1000)  # Minimum 1000 UGX
+    return transaction
+
+def run_llm_tier(user_text: str, flight_key: Tuple[str, str, str], fill_cache: bool = True) -> Dict[str, Any]:
+    """Ask the LLM (sharing any identical call in flight) and cache the validated answer"""
+    with overload.track_call():
+        (provider, transaction), _ = inflight_parses.do(flight_key, lambda: request_ai_transaction(user_text),
+                                                        timeout=remaining_seconds())
+    logger.info(f"AI parsed successfully: {transaction}")
+    ensure_time_left('caching')
+    # Callers sharing the call each get their own copy to stamp
+    validated_transaction = dict(transaction)
+    if fill_cache:
+        # Stored under the model that actually answered, not the home model
+        parse_cache.set(cache_key(user_text, provider), dict(validated_transaction))
+    return validated_transaction
+
+def finish_speculative_call(future) -> None:
+    """Done-callback for LLM calls that lost the race; their answer now sits in the cache"""
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        logger.warning(f"Background AI parse failed: {str(error)}")
+    elif future.result() is not None and SPECULATIVE_FILL_CACHE:
+        cascade_stats.count('background_cache_fills')
+
+def parse_transaction_text(user_text: str, mode: Optional[str] = None,
+                           allow_degraded: bool = False) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Parse one piece of text through the tiered cascade:
+    result cache → local parser (if confident enough) → Gemini → regex fallback.
     
-    if numbers:
-        try:
-            # Take the first/largest number found
-            amount = max([float(num) for num in numbers])
-        except:
-            amount = 1000  # Default fallback amount
-    
-    # Simple type detection
-    expense_keywords = ['bought', 'paid', 'spent', 'cost', 'expense', 'bill']
-    income_keywords = ['salary', 'earned', 'received', 'income', 'profit']
-    loan_keywords = ['loan', 'borrowed', 'credit', 'advance']
-    tithe_keywords = ['tithe', 'offering', 'church', 'donation']
-    
-    text_lower = user_text.lower()
-    
-    if any(keyword in text_lower for keyword in tithe_keywords):
-        trans_type = 'TITHING'
-        category = 'Religious Giving'
-    elif any(keyword in text_lower for keyword in loan_keywords):
-        trans_type = 'LOAN'
-        category = 'Financial Loan'
-    elif any(keyword in text_lower for keyword in income_keywords):
-        trans_type = 'INCOME'
-        category = 'Income Source'
-    else:
-        trans_type = 'EXPENSE'
-        category = 'General Expense'
+    In speculative mode Gemini is raced against SPECULATIVE_SLO_MS; if it has
+    not answered in time the local parse is returned and the Gemini call
+    finishes in the background to fill the cache.
     
-    return {
-        'amount_ugx': max(amount, 1000),  # Minimum 1000 UGX
-        'type': trans_type,
-        'category': category,
-        'description': user_text[:80] if user_text else 'Manual Transaction Entry'
+    Args:
+        user_text: Stripped, non-empty user input
+        mode: 'accurate' or 'speculative' (defaults to NLP_PARSE_MODE)
+        allow_degraded: Answer with the fallback parse instead of calling
+            Gemini while the overload controller is shedding
+    
+    Returns:
+        Tuple of (validated transaction, response metadata such as ai_confidence and tier)
+    
+    Raises:
+        ValueError: If the resulting transaction fails validation
+    """
+    start_time = time.time()
+    speculative = (mode or PARSE_MODE) == 'speculative'
+    
+    flight_key = cache_key(user_text, 'gemini')
+    cached = cached_transaction(user_text)
+    if cached is not None:
+        validated_transaction = dict(cached)
+        validated_transaction['parsed_at'] = datetime.utcnow().isoformat()
+        validated_transaction['original_text'] = user_text
+        cascade_stats.record('cache', time.time() - start_time)
+        return validated_transaction, {'ai_confidence': 'high', 'cache_hit': True, 'tier': 'cache'}
+    
+    # Local tier: simple "<item> <amount>" phrases never need the LLM
+    local_transaction, local_confidence = parse_locally(user_text)
+    if local_confidence >= LOCAL_PARSE_THRESHOLD:
+        validated_transaction = validate_transaction(local_transaction)
+        validated_transaction['parsed_at'] = datetime.utcnow().isoformat()
+        validated_transaction['original_text'] = user_text
+        cascade_stats.record('local', time.time() - start_time)
+        return validated_transaction, {
+            'ai_confidence': 'local',
+            'cache_hit': False,
+            'tier': 'local',
+            'local_confidence': local_confidence
+        }
+    
+    # Overloaded: a fast heuristic answer now beats a timeout later
+    if allow_degraded and overload.shedding():
+        validated_transaction = validate_transaction(create_fallback_transaction(user_text))
+        validated_transaction['parsed_at'] = datetime.utcnow().isoformat()
+        validated_transaction['original_text'] = user_text
+        cascade_stats.record('degraded', time.time() - start_time)
+        return validated_transaction, {
+            'ai_confidence': 'degraded',
+            'cache_hit': False,
+            'tier': 'degraded',
+            'local_confidence': local_confidence
+        }
+    
+    validated_transaction = None
+    ai_confidence = 'low'
+    
+    try:
+        # Call Gemini AI
+        if speculative:
+            wait_seconds = SPECULATIVE_SLO_MS / 1000
+            if remaining_seconds() is not None:
+                wait_seconds = min(wait_seconds, remaining_seconds())
+            # The call may outlive this request, but keeps its provider lane and tenant
+            future = speculative_executor.submit(run_in_context, detached_context(), run_llm_tier,
+                                                 user_text, flight_key, SPECULATIVE_FILL_CACHE)
+            try:
+                validated_transaction = wait_for_result(future, wait_seconds)
+            except FuturesTimeoutError:
+                future.add_done_callback(finish_speculative_call)
+                ai_confidence = 'speculative'
+                logger.info(f"Gemini missed the {SPECULATIVE_SLO_MS:.0f}ms SLO, serving the local parse")
+        else:
+            validated_transaction = run_llm_tier(user_text, flight_key)
+        if validated_transaction:
+            ai_confidence = 'high'
+        
+    except (ValueError, RequestCancelled):
+        raise
+    except Exception as ai_error:
+        logger.warning(f"AI parsing failed: {str(ai_error)}")
+        ai_confidence = 'fallback'
+    
+    # Use fallback if AI failed or was too slow
+    if not validated_transaction:
+        validated_transaction = validate_transaction(create_fallback_transaction(user_text))
+        logger.info(f"Using fallback transaction: {validated_transaction}")
+    
+    # Add metadata
+    validated_transaction['parsed_at'] = datetime.utcnow().isoformat()
+    validated_transaction['original_text'] = user_text
+    
+    tier = {'high': 'llm', 'speculative': 'speculative'}.get(ai_confidence, 'fallback')
+    cascade_stats.record(tier, time.time() - start_time)
+    meta = {
+        'ai_confidence': ai_confidence,
+        'cache_hit': False,
+        'tier': tier,
+        'local_confidence': local_confidence
     }
+    if speculative:
+        meta['slo_ms'] = SPECULATIVE_SLO_MS
+    return validated_transaction, meta
+
+def deadline_exceeded_response():
+    """504 for requests whose caller-supplied deadline has passed"""
+    mark_deadline_exceeded()
+    return jsonify({
+        'success': False,
+        'error': 'Request deadline exceeded',
+        'code': 'DEADLINE_EXCEEDED'
+    }), 504
+
+def client_closed_response():
+    """499 for requests whose client disconnected; nobody reads it, but the log shows why"""
+    return jsonify({
+        'success': False,
+        'error': 'Client closed the request',
+        'code': 'CLIENT_CLOSED_REQUEST'
+    }), 499
+
+def admission_rejected_response(status: int, reason: str, retry_after: float):
+    """429 for clients over their rate limit, 413 for oversized bodies (sent before the body is read)"""
+    return jsonify({
+        'success': False,
+        'error': 'Rate limit exceeded, retry later' if status == 429 else 'Request body too large',
+        'code': reason
+    }), status
+
+# Per-API-key / per-IP rate limits and the body-size cap (NLP_MAX_BODY_KB) come first,
+# so rejected requests never parse JSON
+NLP_MAX_BODY_BYTES = int(float(os.getenv('NLP_MAX_BODY_KB', '1024')) * 1024)
+admission = init_admission_control(app, NLP_MAX_BODY_BYTES, admission_rejected_response)
+
+# X-Request-Timeout-Ms / X-Request-Deadline from the gateway bound every provider call;
+# a client disconnect cancels them, and X-Request-Class picks their provider lane
+init_request_context(app, deadline_exceeded_response)
+
+def parse_batch_item(index: int, text: Any) -> Dict[str, Any]:
+    """
+    Parse a single entry of a batch request. Never raises, so one bad
+    line cannot fail the whole batch.
+    """
+    start_time = time.time()
+    
+    if not isinstance(text, str) or not text.strip():
+        return {
+            'index': index,
+            'success': False,
+            'error': 'Empty text provided',
+            'code': 'EMPTY_TEXT'
+        }
+    
+    user_text = text.strip()
+    try:
+        transaction, meta = parse_transaction_text(user_text)
+        ensure_time_left('responding')
+        return {
+            'index': index,
+            'success': True,
+            'transaction': transaction,
+            **meta,
+            # Only a failed or shed LLM call; cache, local and speculative answers are by design
+            'fallback': meta['tier'] in ('fallback', 'degraded'),
+            'processing_time': round(time.time() - start_time, 3)
+        }
+    except DeadlineExceeded:
+        mark_deadline_exceeded()
+        return {
+            'index': index,
+            'success': False,
+            'error': 'Request deadline exceeded',
+            'code': 'DEADLINE_EXCEEDED'
+        }
+    except RequestCancelled:
+        return {
+            'index': index,
+            'success': False,
+            'error': 'Client closed the request',
+            'code': 'CLIENT_CLOSED_REQUEST'
+        }
+    except ValueError as ve:
+        logger.error(f"Validation error in batch item {index}: {str(ve)}")
+        return {
+            'index': index,
+            'success': False,
+            'error': f'Transaction validation failed: {str(ve)}',
+            'code': 'VALIDATION_ERROR'
+        }
+    except Exception as e:
+        logger.error(f"Unexpected error in batch item {index}: {str(e)}")
+        return {
+            'index': index,
+            'success': False,
+            'error': 'Internal server error occurred',
+            'code': 'INTERNAL_ERROR'
+        }
 
 @app.route('/api/ai/parse_transaction', methods=['POST'])
 def parse_transaction():
@@ -266,7 +438,8 @@ def parse_transaction():
     
     Expected Input:
     {
-        "text": "bought groceries worth 45000 at nakumatt"
+        "text": "bought groceries worth 45000 at nakumatt",
+        "mode": "speculative"  // optional: "accurate" (default) or "speculative"
     }
     
     Returns:
@@ -302,53 +475,40 @@ def parse_transaction():
                 'code': 'EMPTY_TEXT'
             }), 400
         
-        logger.info(f"Processing transaction text: {user_text}")
-        
-        # Try AI processing first
-        transaction = None
-        ai_confidence = 'low'
-        
-        try:
-            # Call Gemini AI
-            response = call_gemini_api(user_text)
-            
-            # Extract transaction from response
-            if 'candidates' in response and response['candidates']:
-                content = response['candidates'][0].get('content', {})
-                parts = content.get('parts', [])
-                if parts and 'text' in parts[0]:
-                    transaction_text = parts[0]['text']
-                    transaction = json.loads(transaction_text)
-                    ai_confidence = 'high'
-                    logger.info(f"AI parsed successfully: {transaction}")
-            
-        except Exception as ai_error:
-            logger.warning(f"AI parsing failed: {str(ai_error)}")
-            ai_confidence = 'fallback'
+        mode = data.get('mode')
+        if mode is not None and mode not in ('accurate', 'speculative'):
+            return jsonify({
+                'success': False,
+                'error': 'mode must be "accurate" or "speculative"',
+                'code': 'INVALID_MODE'
+            }), 400
         
-        # Use fallback if AI failed
-        if not transaction:
-            transaction = create_fallback_transaction(user_text)
-            logger.info(f"Using fallback transaction: {transaction}")
+        logger.info(f"Processing transaction text: {user_text}")
         
-        # Validate and sanitize
-        validated_transaction = validate_transaction(transaction)
+        validated_transaction, meta = parse_transaction_text(user_text, mode, allow_degraded=True)
+        ensure_time_left('responding')
+        if data.get('debug'):
+            meta['debug'] = {'provider_timeout': describe_provider_timeout(user_text)}
         
         # Calculate processing time
         processing_time = round(time.time() - start_time, 3)
         
-        # Add metadata
-        validated_transaction['parsed_at'] = datetime.utcnow().isoformat()
-        validated_transaction['original_text'] = user_text
-        
         return jsonify({
             'success': True,
             'transaction': validated_transaction,
             'processing_time': processing_time,
-            'ai_confidence': ai_confidence,
+            **meta,
             'api_version': '1.0.0'
         })
         
+    except DeadlineExceeded as de:
+        logger.warning(f"Deadline exceeded: {str(de)}")
+        return deadline_exceeded_response()
+        
+    except RequestCancelled as rc:
+        logger.info(f"Request cancelled: {str(rc)}")
+        return client_closed_response()
+        
     except ValueError as ve:
         logger.error(f"Validation error: {str(ve)}")
         return jsonify({
@@ -365,6 +525,82 @@ def parse_transaction():
             'code': 'INTERNAL_ERROR'
         }), 500
 
+@app.route('/api/ai/parse_transactions', methods=['POST'])
+def parse_transactions():
+    """
+    📚 BATCH ENDPOINT: Parse many natural language entries in one request
+    
+    Texts are parsed concurrently on a bounded worker pool. Results are
+    returned in input order and each item carries its own status. The
+    batch's Gemini calls queue as bulk work behind interactive parses
+    (send X-Request-Class to choose another class).
+    
+    Expected Input:
+    {
+        "texts": ["boda 5000", "salary 2.5M", "lunch 15000 at cafe javas"]
+    }
+    
+    Returns:
+    {
+        "success": true,
+        "results": [
+            {"index": 0, "success": true, "transaction": {...},
+             "ai_confidence": "high", "fallback": false, "processing_time": 0.91},
+            ...
+        ],
+        "total": 3,
+        "succeeded": 3,
+        "failed": 0,
+        "processing_time": 1.42
+    }
+    """
+    start_time = time.time()
+    
+    data = request.get_json(silent=True)
+    # A JSON array or string body is as unusable as a missing one
+    if not isinstance(data, dict) or not isinstance(data.get('texts'), list):
+        return jsonify({
+            'success': False,
+            'error': 'Missing required field: texts (array of strings)',
+            'code': 'MISSING_TEXTS'
+        }), 400
+    
+    texts = data['texts']
+    if not texts:
+        return jsonify({
+            'success': False,
+            'error': 'Empty texts array provided',
+            'code': 'EMPTY_TEXTS'
+        }), 400
+    
+    if len(texts) > BATCH_MAX_ITEMS:
+        return jsonify({
+            'success': False,
+            'error': f'Too many texts: {len(texts)} (maximum {BATCH_MAX_ITEMS})',
+            'code': 'BATCH_TOO_LARGE'
+        }), 413
+    
+    logger.info(f"Processing transaction batch of {len(texts)} texts")
+    
+    # Imports and backfills must not delay interactive parses (X-Request-Class overrides)
+    default_request_class('bulk')
+    
+    # One context copy per item carries the request deadline onto the worker threads
+    futures = [batch_executor.submit(copy_context().run, parse_batch_item, index, text)
+               for index, text in enumerate(texts)]
+    results = [wait_for_result(future) for future in futures]
+    succeeded = sum(1 for r in results if r['success'])
+    
+    return jsonify({
+        'success': True,
+        'results': results,
+        'total': len(results),
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'processing_time': round(time.time() - start_time, 3),
+        'api_version': '1.0.0'
+    })
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint for monitoring"""
@@ -372,9 +608,49 @@ def health_check():
         'status': 'healthy',
         'service': 'ICAN NLP Transaction Processor',
         'version': '1.0.0',
+        'circuit_breaker': gemini_client.breaker.stats(),
+        'overload': overload.stats(),
+        'timestamp': datetime.utcnow().isoformat()
+    })
+
+@app.route('/api/ai/metrics', methods=['GET'])
+def metrics():
+    """Runtime counters for the parsing pipeline"""
+    return jsonify({
+        'service': 'ICAN NLP Transaction Processor',
+        'cascade': {'local_threshold': LOCAL_PARSE_THRESHOLD, **cascade_stats.stats()},
+        'speculative': {'default_mode': PARSE_MODE, 'slo_ms': SPECULATIVE_SLO_MS, 'fill_cache': SPECULATIVE_FILL_CACHE},
+        'cache': parse_cache.stats(),
+        'single_flight': inflight_parses.stats(),
+        'provider': gemini_client.stats(),
+        'routing': get_provider_router().stats(),
+        'connection_pools': pool_stats(),
+        'admission': admission.stats(),
+        'deadlines': deadline_stats.stats(),
+        'cancellations': disconnect_watcher.stats(),
+        'overload': overload.stats(),
+        'micro_batching': micro_batcher.stats() if micro_batcher else {'enabled': False},
         'timestamp': datetime.utcnow().isoformat()
     })
 
+@app.route('/api/admin/cache/flush', methods=['POST'])
+def flush_cache():
+    """Admin endpoint: drop every cached parse result (requires X-Admin-Token)"""
+    if not ADMIN_API_TOKEN or request.headers.get('X-Admin-Token') != ADMIN_API_TOKEN:
+        return jsonify({
+            'success': False,
+            'error': 'Admin token missing or invalid',
+            'code': 'FORBIDDEN'
+        }), 403
+    
+    removed = parse_cache.clear()
+    logger.info(f"Parse cache flushed: {removed} entries removed")
+    return jsonify({
+        'success': True,
+        'removed': removed,
+        'cache': parse_cache.stats()
+    })
+
 @app.route('/api/test', methods=['POST'])
 def test_parsing():
     """Test endpoint with sample transactions"""
@@ -416,14 +692,21 @@ def test_parsing():
 
 if __name__ == '__main__':
     print("🚀 ICAN NLP Transaction Processor Starting...")
-    print(f"📡 API Endpoint: http://localhost:5000/api/ai/parse_transaction")
-    print(f"🏥 Health Check: http://localhost:5000/api/health")
-    print(f"🧪 Test Endpoint: http://localhost:5000/api/test")
-    
-    # Run the Flask app
-    app.run(
-        host='0.0.0.0',
-        port=5000,
-        debug=True,
-        threaded=True
-    )
\ No newline at end of file
+    port = int(os.getenv('NLP_PORT', '5000'))
+    print(f"📡 API Endpoint: http://localhost:{port}/api/ai/parse_transaction")
+    print(f"📚 Batch Endpoint: http://localhost:{port}/api/ai/parse_transactions")
+    print(f"🏥 Health Check: http://localhost:{port}/api/health")
+    print(f"📈 Metrics: http://localhost:{port}/api/ai/metrics")
+    print(f"🧪 Test Endpoint: http://localhost:{port}/api/test")
+    print(f"🏭 Production: python ican_serve.py nlp")
+    
+    # Run the Flask app (ICAN_SERVER_MODE=async serves it from an event loop)
+    if server_mode() == 'async':
+        run_async(app, host='0.0.0.0', port=port)
+    else:
+        app.run(
+            host='0.0.0.0',
+            port=port,
+            debug=os.getenv('FLASK_DEBUG', 'false').lower() == 'true',
+            threaded=True
+        )
\ No newline at end of file
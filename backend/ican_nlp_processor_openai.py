@@ -12,15 +12,32 @@ Version: 2.0.0
 """
 
 import os
-import json
 import time
 import logging
-import requests
-from typing import Dict, Any, Optional
+import threading
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from typing import Dict, Any, Callable, Optional, Tuple
 from datetime import datetime
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from functools import wraps
+from functools import partial, wraps
+
+from ican_admission import init_admission_control
+from ican_async_server import run_async, server_mode
+from ican_http_pool import pool_stats
+from ican_local_parser import CascadeStats, parse_locally
+from ican_nlp_providers import (OPENAI_API_KEY, OPENAI_MODEL, OPENAI_TRANSACTION_TYPES, PROVIDER_CACHE_KEYS,
+                                UnusableAnswer, gemini_client, normalize_openai_transaction, openai_client, openai_micro_batcher,
+                                provider_timeout_info, request_gemini_transaction, request_openai_transaction)
+from ican_overload import OverloadController
+from ican_provider_router import ProviderRouter
+from ican_request_context import (DeadlineExceeded, RequestCancelled, deadline_stats, disconnect_watcher,
+                                  default_request_class, detached_context, ensure_time_left,
+                                  init_request_context, mark_deadline_exceeded, remaining_seconds,
+                                  run_in_context, wait_for_result)
+from ican_result_cache import TTLCache
+from ican_single_flight import SingleFlight
 
 # Configure logging
 logging.basicConfig(
@@ -36,217 +53,196 @@ CORS(app)
 # ========================================
 # 🔧 OPENAI CONFIGURATION
 # ========================================
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', 'sk-proj-')
-OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
-OPENAI_MODEL = "gpt-3.5-turbo"  # or "gpt-4" for higher accuracy
+ADMIN_API_TOKEN = os.getenv('ADMIN_API_TOKEN', '')
 
 if not OPENAI_API_KEY or OPENAI_API_KEY == 'sk-proj-':
     logger.warning('⚠️ OpenAI API key not configured!')
 
+# Batch parsing limits (/api/ai/parse_transactions)
+BATCH_MAX_ITEMS = int(os.getenv('NLP_BATCH_MAX_ITEMS', '500'))
+BATCH_MAX_WORKERS = int(os.getenv('NLP_BATCH_MAX_WORKERS', '8'))
+
+# Shared pool so concurrent batch requests cannot exceed BATCH_MAX_WORKERS provider calls
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix='nlp-batch')
+
 # ========================================
-# 🎯 SYSTEM PROMPT FOR TRANSACTION PARSING
+# ⚡ RESULT CACHE
 # ========================================
-SYSTEM_INSTRUCTION = """You are a financial transaction parser specialized in East African finance (Uganda, Kenya, Tanzania).
-Your job is to parse natural language financial entries and return ONLY valid JSON.
-
-RULES:
-1. ALWAYS return ONLY a JSON object, never include explanations or extra text
-2. Default currency is UGX (Uganda Shilling)
-3. Be specific with categories - use local terminology
-4. Transaction types: INCOME, EXPENSE, TRANSFER, LOAN, INVESTMENT, SAVING, TITHING
-5. Categories: Salary, Business, Food, Transport, Utilities, Shopping, Rent, Health, Education, Entertainment, Gifts, Charity, etc.
-
-RESPONSE FORMAT - Return ONLY this JSON structure:
-{
-  "type": "INCOME|EXPENSE|TRANSFER|LOAN|INVESTMENT|SAVING|TITHING",
-  "amount_ugx": number,
-  "amount_usd": number,
-  "currency": "UGX|USD|KES|etc",
-  "category": "string",
-  "description": "string",
-  "date": "YYYY-MM-DD"
-}
-
-Examples:
-- "bought groceries 50k" → {"type":"EXPENSE","amount_ugx":50000,"category":"Food","description":"Groceries shopping"}
-- "salary 2.5M" → {"type":"INCOME","amount_ugx":2500000,"category":"Salary"}
-- "borrowed 1.2M for business" → {"type":"LOAN","amount_ugx":1200000,"category":"Business"}
-"""
+# Keyed on normalized text + the model and prompt version that answered
+parse_cache = TTLCache(
+    max_entries=int(os.getenv('PARSE_CACHE_MAX_ENTRIES', '5000')),
+    ttl_seconds=float(os.getenv('PARSE_CACHE_TTL_SECONDS', '86400'))
+)
+
+# Identical texts already being parsed share one provider call
+inflight_parses = SingleFlight()
 
 # ========================================
-# 🛡️ RESILIENCE & RETRY MECHANISMS
+# 🧮 LOCAL-FIRST CASCADE
 # ========================================
+# Inputs the local parser scores at or above this threshold skip the LLM
+LOCAL_PARSE_THRESHOLD = float(os.getenv('LOCAL_PARSE_CONFIDENCE_THRESHOLD', '0.85'))
+cascade_stats = CascadeStats()
 
-def exponential_backoff_retry(func, max_retries: int = 3, base_delay: float = 1.0) -> Any:
-    """Exponential backoff retry decorator"""
-    def wrapper(*args, **kwargs):
-        delay = base_delay
-        last_error = None
-        
-        for attempt in range(max_retries):
-            try:
-                return func(*args, **kwargs)
-            except Exception as e:
-                last_error = e
-                if attempt < max_retries - 1:
-                    logger.warning(f"Attempt {attempt + 1} failed: {str(e)}, retrying in {delay}s...")
-                    time.sleep(delay)
-                    delay *= 2
-                else:
-                    logger.error(f"All {max_retries} attempts failed")
-        
-        raise last_error
-    return wrapper()
+# ========================================
+# 🏁 SPECULATIVE MODE
+# ========================================
+# Serve the local parse when OpenAI has not answered within the latency SLO
+PARSE_MODE = os.getenv('NLP_PARSE_MODE', 'accurate').lower()  # accurate | speculative
+SPECULATIVE_SLO_MS = float(os.getenv('NLP_SPECULATIVE_SLO_MS', '800'))
+SPECULATIVE_FILL_CACHE = os.getenv('NLP_SPECULATIVE_FILL_CACHE', 'true').lower() == 'true'
+speculative_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('NLP_SPECULATIVE_MAX_WORKERS', '16')),
+    thread_name_prefix='nlp-speculative'
+)
 
 # ========================================
-# 🤖 OPENAI API INTEGRATION
+# 🚦 LOAD SHEDDING
 # ========================================
+# Under overload single parses get the local parse instead of queueing (OVERLOAD_* settings)
+overload = OverloadController('nlp-openai')
+
+micro_batcher = openai_micro_batcher
+
+def describe_provider_timeout(user_text: str) -> Dict[str, Any]:
+    """The timeout OpenAI calls for this text currently get, for debug metadata"""
+    return provider_timeout_info('openai', user_text)
+
+def request_gemini_as_openai(user_text: str) -> Dict[str, Any]:
+    """Ask Gemini and shape the answer like an OpenAI one"""
+    transaction = request_gemini_transaction(user_text)
+    if not isinstance(transaction, dict):
+        raise ValueError('Gemini returned no transaction')
+    return normalize_openai_transaction(dict(transaction))
 
-def call_openai_api(user_text: str) -> Dict[str, Any]:
+def request_checked_transaction(provider: str, request_fn: Callable[[str], Any], user_text: str) -> Dict[str, Any]:
     """
-    Call OpenAI API with JSON mode for structured output.
-    
-    Args:
-        user_text: Raw user input text
-    
-    Returns:
-        Parsed transaction object
+    Ask one provider and check its answer inside the routed call: an answer
+    without a positive amount (normalize_openai_transaction turns a missing
+    one into 0) or with an unknown type fails over like a provider error.
     """
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {OPENAI_API_KEY}'
-    }
-    
-    payload = {
-        "model": OPENAI_MODEL,
-        "messages": [
-            {
-                "role": "system",
-                "content": SYSTEM_INSTRUCTION
-            },
-            {
-                "role": "user",
-                "content": f"Parse this financial transaction: '{user_text}'"
-            }
-        ],
-        "temperature": 0.1,  # Low temperature for consistent parsing
-        "max_tokens": 500,
-        "response_format": { "type": "json_object" }  # Forces JSON output
-    }
-    
-    def make_request():
-        logger.info(f"🚀 Calling OpenAI API with model: {OPENAI_MODEL}")
-        response = requests.post(
-            OPENAI_API_URL,
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-        response.raise_for_status()
-        return response.json()
-    
-    return exponential_backoff_retry(make_request, max_retries=3)
+    try:
+        transaction = request_fn(user_text)
+    except ValueError as error:
+        raise UnusableAnswer(f"{provider}: {str(error)}") from error
+    amount = transaction.get('amount_ugx')
+    if not isinstance(amount, (int, float)) or amount <= 0:
+        raise UnusableAnswer(f"{provider}: invalid amount {amount}")
+    if str(transaction.get('type', '')).upper() not in OPENAI_TRANSACTION_TYPES:
+        raise UnusableAnswer(f"{provider}: invalid transaction type {transaction.get('type')}")
+    return transaction
 
 # ========================================
-# 📊 RESPONSE PROCESSING
+# 🔀 PROVIDER ROUTING
 # ========================================
+# OpenAI always; Gemini joins when its key is configured
+ROUTER_PROVIDERS = [
+    provider.strip() for provider in
+    os.getenv('NLP_ROUTER_PROVIDERS', 'openai,gemini' if os.getenv('GEMINI_API_KEY') else 'openai').split(',')
+    if provider.strip()
+]
+_provider_router: Optional[ProviderRouter] = None
+_router_lock = threading.Lock()
 
-def process_openai_response(response: Dict) -> Dict[str, Any]:
-    """Extract and validate transaction from OpenAI response"""
-    try:
-        if 'choices' not in response or not response['choices']:
-            raise ValueError('No choices in OpenAI response')
-        
-        message = response['choices'][0].get('message', {})
-        content = message.get('content', '')
-        
-        if not content:
-            raise ValueError('Empty content in OpenAI response')
-        
-        # Parse JSON from response
-        transaction = json.loads(content)
-        
-        # Validate required fields
-        required_fields = ['type', 'amount_ugx', 'category', 'description']
-        for field in required_fields:
-            if field not in transaction:
-                transaction[field] = 'Unknown'
-        
-        # Ensure amount is numeric
-        if not isinstance(transaction.get('amount_ugx'), (int, float)):
-            transaction['amount_ugx'] = 0
-        
-        # Set defaults
-        if 'currency' not in transaction:
-            transaction['currency'] = 'UGX'
-        if 'date' not in transaction:
-            transaction['date'] = datetime.now().strftime('%Y-%m-%d')
-        if 'amount_usd' not in transaction:
-            transaction['amount_usd'] = transaction['amount_ugx'] / 3600
-        
-        logger.info(f"✅ Transaction parsed: {transaction}")
-        return transaction
-    
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON parsing error: {e}")
-        raise ValueError(f'Invalid JSON in response: {str(e)}')
-    except Exception as e:
-        logger.error(f"Response processing error: {e}")
-        raise
+def get_provider_router() -> ProviderRouter:
+    """Build the router on first use"""
+    global _provider_router
+    if _provider_router is None:
+        with _router_lock:
+            if _provider_router is None:
+                router = ProviderRouter('nlp-openai')
+                for provider in ROUTER_PROVIDERS:
+                    if provider == 'openai':
+                        router.register('openai', partial(request_checked_transaction, 'openai',
+                                                          request_openai_transaction), openai_client)
+                    elif provider == 'gemini':
+                        router.register('gemini', partial(request_checked_transaction, 'gemini',
+                                                          request_gemini_as_openai), gemini_client)
+                    else:
+                        logger.warning(f"Unknown provider in NLP_ROUTER_PROVIDERS: {provider}")
+                _provider_router = router
+    return _provider_router
+
+def request_ai_transaction(user_text: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Ask the healthiest configured provider for one transaction, failing over
+    to the others. Returns (provider that answered, transaction).
+    """
+    return get_provider_router().route_named(user_text)
+
+def cache_key(user_text: str, provider: str) -> Tuple[str, str, str]:
+    """Cache key of the answer provider gives for user_text (its model and prompt version)"""
+    model, version = PROVIDER_CACHE_KEYS[provider]
+    return parse_cache.make_key(user_text, model, version)
+
+def cached_transaction(user_text: str) -> Optional[Dict[str, Any]]:
+    """A cached answer from any routed provider, OpenAI's own first"""
+    providers = ['openai'] + [p for p in ROUTER_PROVIDERS if p != 'openai' and p in PROVIDER_CACHE_KEYS]
+    return parse_cache.get_first(cache_key(user_text, provider) for provider in providers)
 
 # ========================================
 # 🔍 FALLBACK PARSING (When AI fails)
 # ========================================
 
-def parse_transaction_fallback(user_text: str) -> Dict[str, Any]:
-    """Simple regex-based fallback when AI fails"""
-    import re
-    
-    text = user_text.lower()
-    
-    # Try to extract amount
-    amount_match = re.search(r'(\d+)\s*[mkKM]?', text)
-    amount = int(amount_match.group(1)) if amount_match else 0
-    
-    # Multiply by thousands if M/k is present
-    if 'k' in text:
-        amount *= 1000
-    elif 'm' in text:
-        amount *= 1000000
-    
-    # Determine type
-    tx_type = 'EXPENSE'
-    if any(word in text for word in ['salary', 'income', 'earned', 'received']):
-        tx_type = 'INCOME'
-    elif any(word in text for word in ['borrowed', 'loan', 'lent']):
-        tx_type = 'LOAN'
-    elif any(word in text for word in ['tithe', 'church', 'offering', 'donation']):
-        tx_type = 'TITHING'
-    
-    # Determine category
-    category = 'Other'
-    if 'food' in text or 'eat' in text or 'cafe' in text:
-        category = 'Food'
-    elif 'transport' in text or 'boda' in text:
-        category = 'Transport'
-    elif 'salary' in text:
-        category = 'Salary'
+def build_local_transaction(user_text: str, source: str) -> Tuple[Dict[str, Any], float]:
+    """Run the deterministic local parser and shape its result like an OpenAI transaction"""
+    local, confidence = parse_locally(user_text)
+    amount = local['amount_ugx']
     
     return {
-        'type': tx_type,
+        'type': local['type'],
         'amount_ugx': amount,
         'amount_usd': amount / 3600,
         'currency': 'UGX',
-        'category': category,
+        'category': local['category'],
         'description': user_text,
         'date': datetime.now().strftime('%Y-%m-%d'),
-        'source': 'FALLBACK_PARSER'
-    }
+        'source': source
+    }, confidence
+
+def parse_transaction_fallback(user_text: str) -> Dict[str, Any]:
+    """Local-parser fallback when AI fails"""
+    transaction, _ = build_local_transaction(user_text, 'FALLBACK_PARSER')
+    return transaction
 
 # ========================================
 # 🎯 MAIN API ENDPOINTS
 # ========================================
 
+def deadline_exceeded_response():
+    """504 for requests whose caller-supplied deadline has passed"""
+    mark_deadline_exceeded()
+    return jsonify({
+        'success': False,
+        'error': 'Request deadline exceeded',
+        'code': 'DEADLINE_EXCEEDED'
+    }), 504
+
+def client_closed_response():
+    """499 for requests whose client disconnected; nobody reads it, but the log shows why"""
+    return jsonify({
+        'success': False,
+        'error': 'Client closed the request',
+        'code': 'CLIENT_CLOSED_REQUEST'
+    }), 499
+
+def admission_rejected_response(status: int, reason: str, retry_after: float):
+    """429 for clients over their rate limit, 413 for oversized bodies (sent before the body is read)"""
+    return jsonify({
+        'success': False,
+        'error': 'Rate limit exceeded, retry later' if status == 429 else 'Request body too large',
+        'code': reason
+    }), status
+
+# Per-API-key / per-IP rate limits and the body-size cap (NLP_MAX_BODY_KB) come first,
+# so rejected requests never parse JSON
+NLP_MAX_BODY_BYTES = int(float(os.getenv('NLP_MAX_BODY_KB', '1024')) * 1024)
+admission = init_admission_control(app, NLP_MAX_BODY_BYTES, admission_rejected_response)
+
+# X-Request-Timeout-Ms / X-Request-Deadline from the gateway bound every provider call;
+# a client disconnect cancels them, and X-Request-Class picks their provider lane
+init_request_context(app, deadline_exceeded_response)
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -256,9 +252,165 @@ def health_check():
         'version': '2.0.0',
         'ai_provider': 'OpenAI',
         'model': OPENAI_MODEL,
+        'circuit_breaker': openai_client.breaker.stats(),
+        'overload': overload.stats(),
         'timestamp': datetime.now().isoformat()
     })
 
+def run_llm_tier(user_text: str, flight_key: Tuple[str, str, str], fill_cache: bool = True) -> Dict[str, Any]:
+    """Ask OpenAI (sharing any identical call in flight) and cache the answer"""
+    with overload.track_call():
+        (provider, transaction), shared = inflight_parses.do(flight_key, lambda: request_ai_transaction(user_text),
+                                                             timeout=remaining_seconds())
+    if shared:
+        transaction = dict(transaction)
+    logger.info(f"AI parsed successfully: {transaction}")
+    ensure_time_left('caching')
+    
+    # The date is re-stamped on every hit, so it is not part of the cached value;
+    # the entry is stored under the model that actually answered, not the home model
+    if fill_cache:
+        parse_cache.set(cache_key(user_text, provider), {k: v for k, v in transaction.items() if k != 'date'})
+    return transaction
+
+def finish_speculative_call(future) -> None:
+    """Done-callback for LLM calls that lost the race; their answer now sits in the cache"""
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        logger.warning(f"Background AI parse failed: {str(error)}")
+    elif SPECULATIVE_FILL_CACHE:
+        cascade_stats.count('background_cache_fills')
+
+def parse_transaction_text(user_text: str, mode: Optional[str] = None,
+                           allow_degraded: bool = False) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Parse one text through the cascade: result cache, local parser (when
+    confident enough), OpenAI, then the fallback parser.
+    
+    In speculative mode (mode argument or NLP_PARSE_MODE) OpenAI gets
+    SPECULATIVE_SLO_MS to answer; after that the local parse is returned and
+    the OpenAI call finishes in the background to fill the cache.
+    
+    With allow_degraded, the local parse is returned without calling OpenAI
+    while the overload controller is shedding (ai_confidence "degraded").
+    
+    Returns a (transaction, response metadata) tuple.
+    """
+    start_time = time.time()
+    speculative = (mode or PARSE_MODE) == 'speculative'
+    
+    flight_key = cache_key(user_text, 'openai')
+    cached = cached_transaction(user_text)
+    if cached is not None:
+        transaction = dict(cached)
+        transaction['date'] = datetime.now().strftime('%Y-%m-%d')
+        cascade_stats.record('cache', time.time() - start_time)
+        return transaction, {'ai_confidence': 'high', 'cache_hit': True, 'tier': 'cache'}
+    
+    # Local tier: simple "<item> <amount>" phrases never need the LLM
+    local_transaction, local_confidence = build_local_transaction(user_text, 'LOCAL_PARSER')
+    if local_confidence >= LOCAL_PARSE_THRESHOLD:
+        cascade_stats.record('local', time.time() - start_time)
+        return local_transaction, {
+            'ai_confidence': 'local',
+            'cache_hit': False,
+            'tier': 'local',
+            'local_confidence': local_confidence
+        }
+    
+    meta = {'cache_hit': False, 'local_confidence': local_confidence}
+    
+    # Overloaded: a fast heuristic answer now beats a timeout later
+    if allow_degraded and overload.shedding():
+        cascade_stats.record('degraded', time.time() - start_time)
+        transaction = dict(local_transaction, source='DEGRADED_PARSER')
+        return transaction, {'ai_confidence': 'degraded', 'tier': 'degraded', **meta}
+    
+    if speculative:
+        meta['slo_ms'] = SPECULATIVE_SLO_MS
+    
+    try:
+        # Call OpenAI API
+        if speculative:
+            wait_seconds = SPECULATIVE_SLO_MS / 1000
+            if remaining_seconds() is not None:
+                wait_seconds = min(wait_seconds, remaining_seconds())
+            # The call may outlive this request, but keeps its provider lane and tenant
+            future = speculative_executor.submit(run_in_context, detached_context(), run_llm_tier,
+                                                 user_text, flight_key, SPECULATIVE_FILL_CACHE)
+            try:
+                transaction = wait_for_result(future, wait_seconds)
+            except FuturesTimeoutError:
+                future.add_done_callback(finish_speculative_call)
+                logger.info(f"OpenAI missed the {SPECULATIVE_SLO_MS:.0f}ms SLO, serving the local parse")
+                transaction = dict(local_transaction, source='SPECULATIVE_PARSER')
+                cascade_stats.record('speculative', time.time() - start_time)
+                return transaction, {'ai_confidence': 'speculative', 'tier': 'speculative', **meta}
+        else:
+            transaction = run_llm_tier(user_text, flight_key)
+        
+        cascade_stats.record('llm', time.time() - start_time)
+        return transaction, {'ai_confidence': 'high', 'tier': 'llm', **meta}
+        
+    except RequestCancelled:
+        raise
+    except Exception as ai_error:
+        logger.warning(f"AI parsing failed: {str(ai_error)}")
+        # Fall back to the local parse we already have
+        transaction = dict(local_transaction, source='FALLBACK_PARSER')
+        logger.info(f"Fallback parser result: {transaction}")
+        cascade_stats.record('fallback', time.time() - start_time)
+        return transaction, {'ai_confidence': 'fallback', 'tier': 'fallback', **meta}
+
+def parse_batch_item(index: int, text: Any) -> Dict[str, Any]:
+    """Parse one entry of a batch request; never raises so one bad line cannot fail the batch"""
+    start_time = time.time()
+    
+    if not isinstance(text, str) or not text.strip():
+        return {
+            'index': index,
+            'success': False,
+            'error': 'Empty text provided',
+            'code': 'EMPTY_TEXT'
+        }
+    
+    try:
+        transaction, meta = parse_transaction_text(text.strip())
+        ensure_time_left('responding')
+        return {
+            'index': index,
+            'success': True,
+            'transaction': transaction,
+            **meta,
+            # Only a failed or shed LLM call; cache, local and speculative answers are by design
+            'fallback': meta['tier'] in ('fallback', 'degraded'),
+            'processing_time': f"{time.time() - start_time:.2f}s"
+        }
+    except DeadlineExceeded:
+        mark_deadline_exceeded()
+        return {
+            'index': index,
+            'success': False,
+            'error': 'Request deadline exceeded',
+            'code': 'DEADLINE_EXCEEDED'
+        }
+    except RequestCancelled:
+        return {
+            'index': index,
+            'success': False,
+            'error': 'Client closed the request',
+            'code': 'CLIENT_CLOSED_REQUEST'
+        }
+    except Exception as error:
+        logger.error(f"❌ Error in batch item {index}: {str(error)}")
+        return {
+            'index': index,
+            'success': False,
+            'error': str(error),
+            'code': 'PROCESSING_ERROR'
+        }
+
 @app.route('/api/ai/parse_transaction', methods=['POST'])
 def parse_transaction():
     """Parse natural language transaction to structured JSON"""
@@ -273,37 +425,40 @@ def parse_transaction():
                 'code': 'EMPTY_TEXT'
             }), 400
         
+        mode = data.get('mode')
+        if mode is not None and mode not in ('accurate', 'speculative'):
+            return jsonify({
+                'success': False,
+                'error': 'mode must be "accurate" or "speculative"',
+                'code': 'INVALID_MODE'
+            }), 400
+        
         logger.info(f"Processing transaction text: {user_text}")
         start_time = time.time()
         
-        # Try OpenAI processing first
-        transaction = None
-        ai_confidence = 'low'
-        
-        try:
-            # Call OpenAI API
-            response = call_openai_api(user_text)
-            transaction = process_openai_response(response)
-            ai_confidence = 'high'
-            logger.info(f"AI parsed successfully: {transaction}")
-            
-        except Exception as ai_error:
-            logger.warning(f"AI parsing failed: {str(ai_error)}")
-            # Fall back to simple parsing
-            transaction = parse_transaction_fallback(user_text)
-            ai_confidence = 'fallback'
-            logger.info(f"Fallback parser result: {transaction}")
+        transaction, meta = parse_transaction_text(user_text, mode, allow_degraded=True)
+        ensure_time_left('responding')
+        if data.get('debug'):
+            meta['debug'] = {'provider_timeout': describe_provider_timeout(user_text)}
         
         processing_time = time.time() - start_time
         
         return jsonify({
             'success': True,
             'transaction': transaction,
-            'ai_confidence': ai_confidence,
+            **meta,
             'processing_time': f"{processing_time:.2f}s",
             'timestamp': datetime.now().isoformat()
         })
     
+    except DeadlineExceeded as error:
+        logger.warning(f"⏰ Deadline exceeded: {str(error)}")
+        return deadline_exceeded_response()
+    
+    except RequestCancelled as error:
+        logger.info(f"🔌 Request cancelled: {str(error)}")
+        return client_closed_response()
+    
     except Exception as error:
         logger.error(f"❌ Error in parse_transaction: {str(error)}")
         return jsonify({
@@ -312,6 +467,88 @@ def parse_transaction():
             'code': 'PROCESSING_ERROR'
         }), 500
 
+@app.route('/api/ai/parse_transactions', methods=['POST'])
+def parse_transactions():
+    """Parse an array of texts concurrently; results come back in input order"""
+    start_time = time.time()
+    
+    data = request.get_json(silent=True)
+    # A JSON array or string body is as unusable as a missing one
+    texts = data.get('texts') if isinstance(data, dict) else None
+    
+    if not isinstance(texts, list) or not texts:
+        return jsonify({
+            'success': False,
+            'error': 'Field "texts" must be a non-empty array',
+            'code': 'MISSING_TEXTS'
+        }), 400
+    
+    if len(texts) > BATCH_MAX_ITEMS:
+        return jsonify({
+            'success': False,
+            'error': f'Too many texts: {len(texts)} (maximum {BATCH_MAX_ITEMS})',
+            'code': 'BATCH_TOO_LARGE'
+        }), 413
+    
+    logger.info(f"Processing transaction batch of {len(texts)} texts")
+    
+    # Imports and backfills must not delay interactive parses (X-Request-Class overrides)
+    default_request_class('bulk')
+    
+    # One context copy per item carries the request deadline onto the worker threads
+    futures = [batch_executor.submit(copy_context().run, parse_batch_item, index, text)
+               for index, text in enumerate(texts)]
+    results = [wait_for_result(future) for future in futures]
+    succeeded = sum(1 for r in results if r['success'])
+    
+    return jsonify({
+        'success': True,
+        'results': results,
+        'total': len(results),
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'processing_time': f"{time.time() - start_time:.2f}s",
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/api/ai/metrics', methods=['GET'])
+def metrics():
+    """Runtime counters for the parsing pipeline"""
+    return jsonify({
+        'service': 'ICAN NLP Transaction Processor',
+        'cascade': {'local_threshold': LOCAL_PARSE_THRESHOLD, **cascade_stats.stats()},
+        'speculative': {'default_mode': PARSE_MODE, 'slo_ms': SPECULATIVE_SLO_MS, 'fill_cache': SPECULATIVE_FILL_CACHE},
+        'cache': parse_cache.stats(),
+        'single_flight': inflight_parses.stats(),
+        'provider': openai_client.stats(),
+        'routing': get_provider_router().stats(),
+        'connection_pools': pool_stats(),
+        'admission': admission.stats(),
+        'deadlines': deadline_stats.stats(),
+        'cancellations': disconnect_watcher.stats(),
+        'overload': overload.stats(),
+        'micro_batching': micro_batcher.stats() if micro_batcher else {'enabled': False},
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/api/admin/cache/flush', methods=['POST'])
+def flush_cache():
+    """Admin endpoint: drop every cached parse result (requires X-Admin-Token)"""
+    if not ADMIN_API_TOKEN or request.headers.get('X-Admin-Token') != ADMIN_API_TOKEN:
+        return jsonify({
+            'success': False,
+            'error': 'Admin token missing or invalid',
+            'code': 'FORBIDDEN'
+        }), 403
+    
+    removed = parse_cache.clear()
+    logger.info(f"🧹 Parse cache flushed: {removed} entries removed")
+    return jsonify({
+        'success': True,
+        'removed': removed,
+        'cache': parse_cache.stats()
+    })
+
 @app.route('/api/test', methods=['POST'])
 def test_parsing():
     """Test endpoint with sample transactions"""
@@ -361,16 +598,24 @@ if __name__ == '__main__':
     logger.info('🚀 ICAN NLP Transaction Processor (OpenAI Edition)')
     logger.info(f'📡 API Provider: OpenAI')
     logger.info(f'🤖 Model: {OPENAI_MODEL}')
-    logger.info(f'🌐 Running on: http://localhost:5000')
+    port = int(os.getenv('NLP_PORT', '5000'))
+    logger.info(f'🌐 Running on: http://localhost:{port}')
     logger.info(f'📝 Endpoints:')
     logger.info(f'   - Health: GET /api/health')
     logger.info(f'   - Parse: POST /api/ai/parse_transaction')
+    logger.info(f'   - Batch Parse: POST /api/ai/parse_transactions')
+    logger.info(f'   - Metrics: GET /api/ai/metrics')
+    logger.info(f'   - Flush Cache: POST /api/admin/cache/flush')
     logger.info(f'   - Test: POST /api/test')
+    logger.info(f'🏭 Production: python ican_serve.py nlp-openai')
     logger.info('=' * 60)
     
-    app.run(
-        host='0.0.0.0',
-        port=5000,
-        debug=True,
-        use_reloader=False
-    )
+    if server_mode() == 'async':
+        run_async(app, host='0.0.0.0', port=port)
+    else:
+        app.run(
+            host='0.0.0.0',
+            port=port,
+            debug=os.getenv('FLASK_DEBUG', 'false').lower() == 'true',
+            use_reloader=False
+        )
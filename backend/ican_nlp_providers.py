@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+"""
+ICAN NLP Providers
+==================
+
+The Gemini and OpenAI transaction-parsing calls used by both NLP
+processors: API configuration, the resilient provider clients, prompts and
+schemas, single and micro-batched calls, and answer extraction.
+
+Each processor serves its own provider and routes to the other one for
+failover. Both import the calls from here rather than from each other, so
+a process holds one client (with its circuit breaker, governor and
+adaptive timeouts) and one micro-batcher per provider, and the router sees
+the same breaker as the calls it routes.
+
+Configuration:
+    GEMINI_API_KEY                  Gemini API key
+    OPENAI_API_KEY                  OpenAI API key
+    NLP_PROVIDER_DEADLINE_SECONDS   deadline per provider call, retries included (45)
+    NLP_PROVIDER_TIMEOUT_SECONDS    read timeout until latencies are observed (30)
+    NLP_HEDGING                     hedge attempts that outlive the p95 (true)
+    NLP_MICRO_BATCHING              pack concurrent parses into one call (false)
+    NLP_MICRO_BATCH_WINDOW_MS       how long a batch collects parses (50)
+    NLP_MICRO_BATCH_MAX_SIZE        parses per batch (16)
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import os
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from ican_micro_batcher import MicroBatcher
+from ican_provider_resilience import ProviderClient
+from ican_request_context import current_request_class, remaining_seconds, wait_for_result
+from ican_result_cache import prompt_version
+
+logger = logging.getLogger(__name__)
+
+class UnusableAnswer(Exception):
+    """
+    A provider answered, but not with a transaction the processor can use.
+    Raised inside the routed backend, so the router fails over to the next
+    provider; deliberately not a ValueError, so a caller whose providers all
+    answered badly gets the local fallback parse rather than a 400.
+    """
+
+# Read timeout used until enough latencies are observed; afterwards timeouts
+# follow the live p99 per endpoint and text size (ADAPTIVE_* settings)
+PROVIDER_COLD_TIMEOUT = float(os.getenv('NLP_PROVIDER_TIMEOUT_SECONDS', '30'))
+PROVIDER_DEADLINE = float(os.getenv('NLP_PROVIDER_DEADLINE_SECONDS', '45'))
+HEDGING_ENABLED = os.getenv('NLP_HEDGING', 'true').lower() == 'true'
+
+# Optional micro-batching: pack concurrent parse requests into one provider call
+MICRO_BATCHING_ENABLED = os.getenv('NLP_MICRO_BATCHING', 'false').lower() == 'true'
+MICRO_BATCH_WINDOW_MS = float(os.getenv('NLP_MICRO_BATCH_WINDOW_MS', '50'))
+MICRO_BATCH_MAX_SIZE = int(os.getenv('NLP_MICRO_BATCH_MAX_SIZE', '16'))
+
+# ========================================
+# 🌟 GEMINI
+# ========================================
+
+GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', 'your_gemini_api_key_here')
+GEMINI_MODEL = "gemini-1.5-flash-latest"
+GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent"
+
+# Resilient Gemini client: shared keep-alive pool, deadline, retry budget, jittered retries,
+# and p95 hedging (parse calls are idempotent, so a duplicate is harmless)
+gemini_client = ProviderClient('gemini', default_deadline=PROVIDER_DEADLINE, hedging=HEDGING_ENABLED)
+
+# 🎯 MANDATORY STRUCTURED OUTPUT SCHEMA
+SINGLE_TRANSACTION_SCHEMA = {
+    "type": "OBJECT",
+    "description": "A single financial transaction parsed from natural language.",
+    "properties": {
+        "amount_ugx": {
+            "type": "NUMBER",
+            "description": "The exact numerical value of the transaction. Must be a positive number."
+        },
+        "type": {
+            "type": "STRING",
+            "enum": ["INCOME", "EXPENSE", "LOAN", "TITHING"],
+            "description": "The financial classification based on the nature of the transaction."
+        },
+        "category": {
+            "type": "STRING",
+            "description": "The inferred sub-category (e.g., 'Groceries', 'Salary', 'Rent')."
+        },
+        "description": {
+            "type": "STRING",
+            "description": "A concise, clean description of the transaction as it should appear in the log."
+        }
+    },
+    "required": ["amount_ugx", "type", "category", "description"]
+}
+
+# 📦 BATCH OUTPUT SCHEMA - one transaction per numbered input (micro-batching)
+BATCH_TRANSACTION_SCHEMA = {
+    "type": "ARRAY",
+    "description": "One parsed transaction per numbered input line, in input order.",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "index": {
+                "type": "INTEGER",
+                "description": "The number of the input line this transaction was parsed from."
+            },
+            **SINGLE_TRANSACTION_SCHEMA["properties"]
+        },
+        "required": ["index"] + SINGLE_TRANSACTION_SCHEMA["required"]
+    }
+}
+
+# 🧠 AI SYSTEM INSTRUCTION - Precision Data Analyst Persona
+GEMINI_SYSTEM_INSTRUCTION = """
+You are a PRECISION DATA ANALYST specializing in financial transaction processing for Uganda's economic context.
+
+CORE MISSION: Transform ambiguous human language into concrete, structured financial data with mathematical precision.
+
+CRITICAL GUIDELINES:
+
+1. AMOUNT EXTRACTION (Priority #1):
+   - Extract ALL numerical values (including abbreviated forms)
+   - Convert: k/K = 1,000 | M = 1,000,000 | B = 1,000,000,000
+   - Examples: "50k" = 50000, "2.5M" = 2500000, "800" = 800
+   - If multiple amounts, choose the PRIMARY transaction amount
+   - NEVER return 0 or negative amounts
+
+2. TYPE CLASSIFICATION (Priority #2):
+   - INCOME: Salary, business revenue, gifts received, profits, sales
+   - EXPENSE: Purchases, bills, food, transport, services, shopping
+   - LOAN: Money borrowed, credit, advance payments, loans taken
+   - TITHING: Church offerings, religious donations, spiritual giving
+
+3. CATEGORY INFERENCE (Uganda Context):
+   - Use local terminology: "boda" (motorcycle transport), "posho" (food staple)
+   - Common categories: Transport, Food, Utilities, Salary, Business, Church
+   - Be specific but concise: "Grocery Shopping" vs just "Food"
+
+4. DESCRIPTION CLEANING:
+   - Create professional, clean descriptions
+   - Remove redundant words, slang, or unclear terms
+   - Keep essential context and location if relevant
+
+5. EDGE CASES:
+   - Ambiguous text: Make educated assumptions based on context
+   - Multiple transactions: Focus on the MAIN transaction
+   - Unclear amounts: Use reasonable estimation based on context
+
+RESPONSE FORMAT: Return ONLY the structured JSON object matching the schema. No additional text or explanations.
+"""
+GEMINI_PROMPT_VERSION = prompt_version(GEMINI_SYSTEM_INSTRUCTION, json.dumps(SINGLE_TRANSACTION_SCHEMA, sort_keys=True))
+
+def post_to_gemini(payload: Dict[str, Any], endpoint: str = 'parse',
+                   size_hint: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Send a generateContent payload to Gemini. Transient failures are retried
+    by the provider client within its deadline and retry budget.
+
+    Args:
+        payload: Complete request body
+        endpoint: Latency-histogram label ('parse' or 'parse_batch')
+        size_hint: Input text length, selects the adaptive timeout bucket
+
+    Returns:
+        Raw Gemini response JSON
+    """
+    headers = {
+        'Content-Type': 'application/json',
+        'x-goog-api-key': GEMINI_API_KEY
+    }
+
+    return gemini_client.post_json(
+        GEMINI_API_URL,
+        headers=headers,
+        json=payload,
+        timeout=PROVIDER_COLD_TIMEOUT,
+        endpoint=endpoint,
+        size_hint=size_hint
+    )
+
+def call_gemini_api(user_text: str) -> Dict[str, Any]:
+    """
+    Call Gemini API with structured output for transaction parsing.
+
+    Args:
+        user_text: Raw user input text
+
+    Returns:
+        Parsed transaction object
+    """
+    payload = {
+        "contents": [{
+            "parts": [{
+                "text": f"Parse this financial transaction: '{user_text}'"
+            }]
+        }],
+        "systemInstruction": {
+            "parts": [{
+                "text": GEMINI_SYSTEM_INSTRUCTION
+            }]
+        },
+        "generationConfig": {
+            "responseMimeType": "application/json",
+            "responseSchema": SINGLE_TRANSACTION_SCHEMA,
+            "temperature": 0.1,  # Low temperature for consistent parsing
+            "maxOutputTokens": 1024,
+            "candidateCount": 1
+        }
+    }
+
+    return post_to_gemini(payload, 'parse', len(user_text))
+
+def extract_gemini_json(response: Dict[str, Any]) -> Optional[Any]:
+    """
+    Pull the structured JSON answer out of a Gemini response.
+
+    Returns:
+        Decoded JSON, or None when the response carries no candidate text
+    """
+    if 'candidates' in response and response['candidates']:
+        content = response['candidates'][0].get('content', {})
+        parts = content.get('parts', [])
+        if parts and 'text' in parts[0]:
+            return json.loads(parts[0]['text'])
+    return None
+
+def call_gemini_api_batch(user_texts: List[str]) -> List[Any]:
+    """
+    Parse several texts with a single Gemini call (micro-batching).
+
+    The system instruction is sent once for the whole batch and the model
+    returns an array tagged with each input's index.
+
+    Args:
+        user_texts: Raw user input texts
+
+    Returns:
+        One entry per input, in input order: the transaction dict, or an
+        Exception instance when the model returned nothing for that input
+    """
+    if len(user_texts) == 1:
+        return [extract_gemini_json(call_gemini_api(user_texts[0]))]
+
+    numbered_texts = "\n".join(f"{i}: '{text}'" for i, text in enumerate(user_texts))
+    payload = {
+        "contents": [{
+            "parts": [{
+                "text": (
+                    f"Parse each of these {len(user_texts)} financial transactions independently. "
+                    f"Return one object per line and set \"index\" to the line number.\n{numbered_texts}"
+                )
+            }]
+        }],
+        "systemInstruction": {
+            "parts": [{
+                "text": GEMINI_SYSTEM_INSTRUCTION
+            }]
+        },
+        "generationConfig": {
+            "responseMimeType": "application/json",
+            "responseSchema": BATCH_TRANSACTION_SCHEMA,
+            "temperature": 0.1,
+            "maxOutputTokens": min(8192, 256 + 160 * len(user_texts)),
+            "candidateCount": 1
+        }
+    }
+
+    items = extract_gemini_json(post_to_gemini(payload, 'parse_batch', len(numbered_texts)))
+    if not isinstance(items, list):
+        raise ValueError('Batch response is not an array')
+
+    # Scatter by index; anything the model skipped fails only that caller
+    results: List[Any] = [ValueError(f'No result for batch item {i}') for i in range(len(user_texts))]
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        index = item.pop('index', position)
+        if isinstance(index, (int, float)) and 0 <= int(index) < len(user_texts):
+            results[int(index)] = item
+    return results
+
+gemini_micro_batcher = MicroBatcher(
+    call_gemini_api_batch,
+    max_batch_size=MICRO_BATCH_MAX_SIZE,
+    max_wait_ms=MICRO_BATCH_WINDOW_MS,
+    name='gemini-batch'
+) if MICRO_BATCHING_ENABLED else None
+
+def request_gemini_transaction(user_text: str) -> Optional[Dict[str, Any]]:
+    """Ask Gemini for one transaction, through the micro-batcher when enabled"""
+    # Micro-batches serve interactive callers; bulk and background calls go alone in their own lanes
+    if gemini_micro_batcher is not None and current_request_class() == 'interactive':
+        # The batch call itself runs on the batcher's thread; the caller stops waiting at its
+        # deadline or when it disconnects, and the batch carries on for the other callers
+        return wait_for_result(gemini_micro_batcher.submit(user_text), remaining_seconds())
+    return extract_gemini_json(call_gemini_api(user_text))
+
+# ========================================
+# 🤖 OPENAI
+# ========================================
+
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', 'sk-proj-')
+OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
+OPENAI_MODEL = "gpt-3.5-turbo"  # or "gpt-4" for higher accuracy
+OPENAI_TRANSACTION_TYPES = ('INCOME', 'EXPENSE', 'TRANSFER', 'LOAN', 'INVESTMENT', 'SAVING', 'TITHING')
+
+# Resilient OpenAI client: shared keep-alive pool, deadline, retry budget, jittered retries,
+# and p95 hedging (parse calls are idempotent, so a duplicate is harmless)
+openai_client = ProviderClient('openai', default_deadline=PROVIDER_DEADLINE, hedging=HEDGING_ENABLED)
+
+# 🎯 SYSTEM PROMPT FOR TRANSACTION PARSING
+OPENAI_SYSTEM_INSTRUCTION = """You are a financial transaction parser specialized in East African finance (Uganda, Kenya, Tanzania).
+Your job is to parse natural language financial entries and return ONLY valid JSON.
+
+RULES:
+1. ALWAYS return ONLY a JSON object, never include explanations or extra text
+2. Default currency is UGX (Uganda Shilling)
+3. Be specific with categories - use local terminology
+4. Transaction types: INCOME, EXPENSE, TRANSFER, LOAN, INVESTMENT, SAVING, TITHING
+5. Categories: Salary, Business, Food, Transport, Utilities, Shopping, Rent, Health, Education, Entertainment, Gifts, Charity, etc.
+
+RESPONSE FORMAT - Return ONLY this JSON structure:
+{
+  "type": "INCOME|EXPENSE|TRANSFER|LOAN|INVESTMENT|SAVING|TITHING",
+  "amount_ugx": number,
+  "amount_usd": number,
+  "currency": "UGX|USD|KES|etc",
+  "category": "string",
+  "description": "string",
+  "date": "YYYY-MM-DD"
+}
+
+Examples:
+- "bought groceries 50k" → {"type":"EXPENSE","amount_ugx":50000,"category":"Food","description":"Groceries shopping"}
+- "salary 2.5M" → {"type":"INCOME","amount_ugx":2500000,"category":"Salary"}
+- "borrowed 1.2M for business" → {"type":"LOAN","amount_ugx":1200000,"category":"Business"}
+"""
+
+# Appended to OPENAI_SYSTEM_INSTRUCTION when several texts share one call (micro-batching)
+OPENAI_BATCH_INSTRUCTION = """
+BATCH MODE: You will receive several numbered lines, each a separate transaction.
+Return ONLY {"transactions": [...]} with one object per line, in the format above,
+plus an "index" field holding the line number.
+"""
+OPENAI_PROMPT_VERSION = prompt_version(OPENAI_SYSTEM_INSTRUCTION)
+
+def post_to_openai(payload: Dict[str, Any], endpoint: str = 'parse',
+                   size_hint: Optional[int] = None) -> Dict[str, Any]:
+    """Send a chat completion payload to OpenAI; the provider client handles retries"""
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {OPENAI_API_KEY}'
+    }
+
+    logger.info(f"🚀 Calling OpenAI API with model: {OPENAI_MODEL}")
+    return openai_client.post_json(
+        OPENAI_API_URL,
+        headers=headers,
+        json=payload,
+        timeout=PROVIDER_COLD_TIMEOUT,
+        endpoint=endpoint,
+        size_hint=size_hint
+    )
+
+def call_openai_api(user_text: str) -> Dict[str, Any]:
+    """
+    Call OpenAI API with JSON mode for structured output.
+
+    Args:
+        user_text: Raw user input text
+
+    Returns:
+        Parsed transaction object
+    """
+    payload = {
+        "model": OPENAI_MODEL,
+        "messages": [
+            {
+                "role": "system",
+                "content": OPENAI_SYSTEM_INSTRUCTION
+            },
+            {
+                "role": "user",
+                "content": f"Parse this financial transaction: '{user_text}'"
+            }
+        ],
+        "temperature": 0.1,  # Low temperature for consistent parsing
+        "max_tokens": 500,
+        "response_format": { "type": "json_object" }  # Forces JSON output
+    }
+
+    return post_to_openai(payload, 'parse', len(user_text))
+
+def extract_openai_json(response: Dict) -> Any:
+    """Decode the JSON content of the first choice of an OpenAI response"""
+    try:
+        if 'choices' not in response or not response['choices']:
+            raise ValueError('No choices in OpenAI response')
+
+        message = response['choices'][0].get('message', {})
+        content = message.get('content', '')
+
+        if not content:
+            raise ValueError('Empty content in OpenAI response')
+
+        return json.loads(content)
+
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON parsing error: {e}")
+        raise ValueError(f'Invalid JSON in response: {str(e)}')
+
+def normalize_openai_transaction(transaction: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill in required fields and defaults on a transaction returned by OpenAI"""
+    # Validate required fields
+    required_fields = ['type', 'amount_ugx', 'category', 'description']
+    for field in required_fields:
+        if field not in transaction:
+            transaction[field] = 'Unknown'
+
+    # Ensure amount is numeric
+    if not isinstance(transaction.get('amount_ugx'), (int, float)):
+        transaction['amount_ugx'] = 0
+
+    # Set defaults
+    if 'currency' not in transaction:
+        transaction['currency'] = 'UGX'
+    if 'date' not in transaction:
+        transaction['date'] = datetime.now().strftime('%Y-%m-%d')
+    if 'amount_usd' not in transaction:
+        transaction['amount_usd'] = transaction['amount_ugx'] / 3600
+
+    return transaction
+
+def process_openai_response(response: Dict) -> Dict[str, Any]:
+    """Extract and validate transaction from OpenAI response"""
+    try:
+        transaction = normalize_openai_transaction(extract_openai_json(response))
+        logger.info(f"✅ Transaction parsed: {transaction}")
+        return transaction
+
+    except Exception as e:
+        logger.error(f"Response processing error: {e}")
+        raise
+
+def call_openai_api_batch(user_texts: List[str]) -> List[Any]:
+    """
+    Parse several texts with one OpenAI call (micro-batching).
+
+    Returns one entry per input in input order: the normalized transaction,
+    or an Exception instance when the model skipped that input.
+    """
+    if len(user_texts) == 1:
+        return [process_openai_response(call_openai_api(user_texts[0]))]
+
+    numbered_texts = "\n".join(f"{i}: '{text}'" for i, text in enumerate(user_texts))
+    payload = {
+        "model": OPENAI_MODEL,
+        "messages": [
+            {
+                "role": "system",
+                "content": OPENAI_SYSTEM_INSTRUCTION + OPENAI_BATCH_INSTRUCTION
+            },
+            {
+                "role": "user",
+                "content": f"Parse these {len(user_texts)} financial transactions:\n{numbered_texts}"
+            }
+        ],
+        "temperature": 0.1,
+        "max_tokens": min(4096, 200 + 150 * len(user_texts)),
+        "response_format": { "type": "json_object" }
+    }
+
+    items = extract_openai_json(post_to_openai(payload, 'parse_batch', len(numbered_texts))).get('transactions')
+    if not isinstance(items, list):
+        raise ValueError('Batch response has no transactions array')
+
+    # Scatter by index; anything the model skipped fails only that caller
+    results: List[Any] = [ValueError(f'No result for batch item {i}') for i in range(len(user_texts))]
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        index = item.pop('index', position)
+        if isinstance(index, (int, float)) and 0 <= int(index) < len(user_texts):
+            results[int(index)] = normalize_openai_transaction(item)
+    return results
+
+openai_micro_batcher = MicroBatcher(
+    call_openai_api_batch,
+    max_batch_size=MICRO_BATCH_MAX_SIZE,
+    max_wait_ms=MICRO_BATCH_WINDOW_MS,
+    name='openai-batch'
+) if MICRO_BATCHING_ENABLED else None
+
+def request_openai_transaction(user_text: str) -> Dict[str, Any]:
+    """Ask OpenAI for one transaction, through the micro-batcher when enabled"""
+    # Micro-batches serve interactive callers; bulk and background calls go alone in their own lanes
+    if openai_micro_batcher is not None and current_request_class() == 'interactive':
+        # The batch call itself runs on the batcher's thread; the caller stops waiting at its
+        # deadline or when it disconnects, and the batch carries on for the other callers
+        return wait_for_result(openai_micro_batcher.submit(user_text), remaining_seconds())
+    return process_openai_response(call_openai_api(user_text))
+
+# ========================================
+# ⚡ RESULT CACHE KEYS
+# ========================================
+
+# Model and prompt version per provider: a cached answer is keyed by the ones that produced it
+PROVIDER_CACHE_KEYS = {
+    'gemini': (GEMINI_MODEL, GEMINI_PROMPT_VERSION),
+    'openai': (OPENAI_MODEL, OPENAI_PROMPT_VERSION)
+}
+
+# ========================================
+# ⏱️ TIMEOUT DESCRIPTION
+# ========================================
+
+def provider_timeout_info(provider: str, user_text: str) -> Dict[str, Any]:
+    """The timeout calls to provider ('gemini' or 'openai') currently get for this text, for debug metadata"""
+    client, batcher = (gemini_client, gemini_micro_batcher) if provider == 'gemini' else \
+        (openai_client, openai_micro_batcher)
+    static_timeout = client.pool.resolve_timeout(PROVIDER_COLD_TIMEOUT)
+    if batcher is not None:
+        _, info = client.timeouts.choose('parse_batch', None, static_timeout)
+    else:
+        _, info = client.timeouts.choose('parse', len(user_text), static_timeout)
+    return {'provider': provider, **info}
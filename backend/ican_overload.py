@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+ICAN Overload Controller
+========================
+
+Load shedding for the NLP processors. Under overload a fast heuristic
+answer beats a timeout, so the controller watches three signals:
+
+- provider queue depth: callers waiting in the provider governors (see
+  ican_provider_governor)
+- in-flight provider calls: LLM-tier calls started and not yet answered
+- recent latency: the 90th percentile of LLM-tier calls over a short window
+
+When any of them crosses its threshold the controller trips and new
+parse_transaction requests are answered by the local parser with
+ai_confidence "degraded" instead of queueing for the LLM. It recovers once
+every signal has dropped below OVERLOAD_RECOVERY_RATIO of its threshold
+and shedding has lasted OVERLOAD_MIN_SHED_SECONDS, so it does not flap.
+While shedding no new LLM calls start, so queues drain and old latency
+samples age out of the window: the controller recovers on its own.
+
+The state is evaluated at most every OVERLOAD_CHECK_INTERVAL_MS and shown
+on /api/health.
+
+Configuration:
+    OVERLOAD_SHEDDING                   enable load shedding (true)
+    OVERLOAD_MAX_QUEUE_DEPTH            queued provider callers that trip it, 0 = ignore (64)
+    OVERLOAD_MAX_IN_FLIGHT              in-flight LLM calls that trip it, 0 = ignore (64)
+    OVERLOAD_MAX_LATENCY_MS             p90 LLM latency that trips it, 0 = ignore (10000)
+    OVERLOAD_LATENCY_WINDOW_SECONDS     latency samples considered (30)
+    OVERLOAD_RECOVERY_RATIO             fraction of each threshold to get back under (0.5)
+    OVERLOAD_MIN_SHED_SECONDS           shortest shedding period (5)
+    OVERLOAD_CHECK_INTERVAL_MS          how often the signals are re-evaluated (100)
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Tuple
+
+from ican_provider_governor import governor_load
+
+logger = logging.getLogger(__name__)
+
+LATENCY_PERCENTILE = 0.9
+MAX_LATENCY_SAMPLES = 512
+
+
+class OverloadController:
+    """
+    Decide whether new parses should skip the LLM.
+
+    Args:
+        name: Service name for log lines
+        max_queue_depth: Queued provider callers that trip shedding (0 ignores the signal)
+        max_in_flight: In-flight LLM calls that trip shedding (0 ignores the signal)
+        max_latency_ms: p90 LLM latency that trips shedding (0 ignores the signal)
+        load: Returns {'queued': ..., 'in_flight': ...} of the provider
+            governors (defaults to every governor in the process)
+        enabled: When False the controller never sheds
+    """
+
+    def __init__(self, name: str, max_queue_depth: Optional[int] = None, max_in_flight: Optional[int] = None,
+                 max_latency_ms: Optional[float] = None, load: Optional[Callable[[], Dict[str, int]]] = None,
+                 enabled: Optional[bool] = None):
+        self.name = name
+        self.max_queue_depth = (max_queue_depth if max_queue_depth is not None
+                                else int(os.getenv('OVERLOAD_MAX_QUEUE_DEPTH', '64')))
+        self.max_in_flight = max_in_flight if max_in_flight is not None else int(os.getenv('OVERLOAD_MAX_IN_FLIGHT', '64'))
+        self.max_latency = (max_latency_ms if max_latency_ms is not None
+                            else float(os.getenv('OVERLOAD_MAX_LATENCY_MS', '10000'))) / 1000.0
+        self.latency_window = float(os.getenv('OVERLOAD_LATENCY_WINDOW_SECONDS', '30'))
+        self.recovery_ratio = float(os.getenv('OVERLOAD_RECOVERY_RATIO', '0.5'))
+        self.min_shed_seconds = float(os.getenv('OVERLOAD_MIN_SHED_SECONDS', '5'))
+        self.check_interval = float(os.getenv('OVERLOAD_CHECK_INTERVAL_MS', '100')) / 1000.0
+        self.enabled = enabled if enabled is not None else os.getenv('OVERLOAD_SHEDDING', 'true').lower() == 'true'
+        self.load = load or governor_load
+        self._lock = threading.Lock()
+        self._latencies: Deque[Tuple[float, float]] = deque(maxlen=MAX_LATENCY_SAMPLES)
+        self._in_flight = 0
+        self._checked = 0.0
+        self._shedding = False
+        self._shedding_since = 0.0
+        self._reason: Optional[str] = None
+        self._signals: Dict[str, float] = {'queue_depth': 0, 'in_flight': 0, 'latency_p90_ms': 0.0}
+        self.trips = 0
+        self.shed = 0
+        self.shed_seconds = 0.0
+
+    @contextmanager
+    def track_call(self) -> Iterator[None]:
+        """Count an LLM-tier call as in flight and record its latency, whether it succeeds or not"""
+        started = time.monotonic()
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            now = time.monotonic()
+            with self._lock:
+                self._in_flight -= 1
+                self._latencies.append((now, now - started))
+
+    def _latency_p90(self, now: float) -> float:
+        while self._latencies and now - self._latencies[0][0] > self.latency_window:
+            self._latencies.popleft()
+        if not self._latencies:
+            return 0.0
+        ordered = sorted(latency for _, latency in self._latencies)
+        return ordered[min(len(ordered) - 1, int(LATENCY_PERCENTILE * len(ordered)))]
+
+    def _over(self, ratio: float) -> Optional[str]:
+        """Name of the first signal above ratio x its threshold, None when all are below"""
+        signals = self._signals
+        if self.max_queue_depth and signals['queue_depth'] > self.max_queue_depth * ratio:
+            return 'queue_depth'
+        if self.max_in_flight and signals['in_flight'] > self.max_in_flight * ratio:
+            return 'in_flight'
+        if self.max_latency and signals['latency_p90_ms'] / 1000.0 > self.max_latency * ratio:
+            return 'latency'
+        return None
+
+    def _evaluate(self, now: float) -> None:
+        queued = self.load().get('queued', 0)
+        with self._lock:
+            self._checked = now
+            self._signals = {
+                'queue_depth': queued,
+                'in_flight': self._in_flight,
+                'latency_p90_ms': round(1000 * self._latency_p90(now), 1)
+            }
+            if not self._shedding:
+                reason = self._over(1.0)
+                if reason is None:
+                    return
+                self._shedding, self._shedding_since, self._reason = True, now, reason
+                self.trips += 1
+                logger.warning(f"{self.name}: overloaded ({reason}: {self._signals}), shedding to the local parser")
+            elif now - self._shedding_since >= self.min_shed_seconds and self._over(self.recovery_ratio) is None:
+                self._shedding, self._reason = False, None
+                self.shed_seconds += now - self._shedding_since
+                logger.info(f"{self.name}: load back to normal ({self._signals}), LLM parsing resumed")
+
+    def shedding(self) -> bool:
+        """True while new parses should be answered locally (counts each shed parse)"""
+        if not self.enabled:
+            return False
+        now = time.monotonic()
+        if now - self._checked >= self.check_interval:
+            self._evaluate(now)
+        if self._shedding:
+            with self._lock:
+                self.shed += 1
+            return True
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            shedding_for = now - self._shedding_since if self._shedding else 0.0
+            return {
+                'enabled': self.enabled,
+                'shedding': self._shedding,
+                'reason': self._reason,
+                'shedding_seconds': round(shedding_for, 1),
+                'signals': dict(self._signals),
+                'thresholds': {
+                    'queue_depth': self.max_queue_depth,
+                    'in_flight': self.max_in_flight,
+                    'latency_p90_ms': round(self.max_latency * 1000, 1)
+                },
+                'recovery_ratio': self.recovery_ratio,
+                'trips': self.trips,
+                'shed_requests': self.shed,
+                'shed_seconds_total': round(self.shed_seconds + shedding_for, 1)
+            }
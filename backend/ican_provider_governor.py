@@ -0,0 +1,782 @@
+#!/usr/bin/env python3
+"""
+ICAN Provider Governor
+======================
+
+Outbound admission control per provider and model, so that peak traffic
+queues briefly in-process instead of turning into a 429 storm at
+OpenAI/Gemini followed by a round of backoff retries.
+
+Each model has:
+- a concurrency limit, adapted AIMD style: halved on a 429 (at most once a
+  second), grown by one slot per limit-worth of successful calls, up to
+  the configured cap
+- a tokens-per-minute and a requests-per-minute bucket. The minute limits
+  start from configuration (0 = unknown) and are learned from the
+  provider: OpenAI's x-ratelimit-limit-* / x-ratelimit-remaining-* headers
+  on every response, Gemini's QuotaFailure/RetryInfo details on quota
+  errors. A 429 also pauses admissions until the provider's retry delay.
+
+Callers over the limits wait in one lane per request class (see
+ican_request_context). Interactive callers always get the next free slot;
+bulk and background callers share what is left in proportion to their
+weights (stride scheduling), so a statement import cannot starve a user's
+single parse, nor background work starve the import. Within a lane each
+tenant (X-Tenant-ID) has its own FIFO and tenants take turns in
+proportion to their TENANT_WEIGHTS, so one business vetting a whole
+contract portfolio cannot starve the other businesses' calls. A share of
+the concurrency and of the minute quotas is held back for interactive
+calls, so one arriving behind a bulk backlog finds a slot free instead of
+waiting for a bulk call to finish. Lanes and each tenant's part of them
+are bounded in length, and every wait in time (never longer than the
+request's deadline); beyond that the call is rejected at once with
+ProviderSaturated, like an open circuit. Time spent queued is reported
+separately from the time spent at the provider, per model, class and
+tenant.
+
+Limits are per process; with several workers the header-reported
+remaining quota keeps each of them honest about the shared account.
+
+Configuration (per provider, falling back to the GOVERNOR_* defaults):
+    <NAME>_GOVERNOR_MAX_CONCURRENCY / GOVERNOR_MAX_CONCURRENCY  concurrent calls per model (16)
+    <NAME>_GOVERNOR_TPM / GOVERNOR_TPM                          tokens per minute, 0 = learn (0)
+    <NAME>_GOVERNOR_RPM / GOVERNOR_RPM                          requests per minute, 0 = learn (0)
+    <NAME>_GOVERNOR_MAX_QUEUE / GOVERNOR_MAX_QUEUE              callers allowed to wait per model and
+                                                                class (256)
+    <NAME>_GOVERNOR_MAX_QUEUE_PER_TENANT / GOVERNOR_MAX_QUEUE_PER_TENANT
+                                                                of those, callers of one tenant (64)
+    <NAME>_GOVERNOR_MAX_QUEUE_SECONDS / GOVERNOR_MAX_QUEUE_SECONDS
+                                                                longest wait for admission (10)
+    <NAME>_GOVERNOR_CLASS_WEIGHTS / GOVERNOR_CLASS_WEIGHTS      shares of bulk and background calls
+                                                                (bulk:4,background:1)
+    <NAME>_GOVERNOR_INTERACTIVE_RESERVE / GOVERNOR_INTERACTIVE_RESERVE
+                                                                fraction of concurrency and quota only
+                                                                interactive calls may use (0.25)
+    TENANT_WEIGHTS                                              tenant shares within a lane, e.g.
+                                                                biz-42:2,biz-7:0.5 (others weigh 1)
+    GOVERNOR_TENANT_STATS_MAX                                   tenants kept in the stats (1000)
+    GOVERNOR_DOCUMENT_TOKENS_PER_KB                             estimated tokens per KB of an attached
+                                                                document (5)
+    GOVERNOR_DOCUMENT_MIN_TOKENS                                least estimate for one document, about
+                                                                a page (258)
+    GOVERNOR_ENABLED                                            enable the governor (true)
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import itertools
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import requests
+
+from ican_circuit_breaker import CircuitOpenError
+from ican_request_context import (REQUEST_CLASSES, Deadline, DeadlineExceeded, current_request_class,
+                                  current_tenant, record_queue_time, wait_for_result)
+from ican_streamed_body import StreamedJSONBody
+
+logger = logging.getLogger(__name__)
+
+_GEMINI_MODEL_RE = re.compile(r'/models/([^/:]+)')
+_DATA_URL_RE = re.compile(r'data:[^,;]*;base64,')
+
+# Providers bill an attached document by its pages, not by its base64 characters;
+# without a page count its size stands in for it
+DOCUMENT_TOKENS_PER_KB = float(os.getenv('GOVERNOR_DOCUMENT_TOKENS_PER_KB', '5'))
+DOCUMENT_MIN_TOKENS = int(os.getenv('GOVERNOR_DOCUMENT_MIN_TOKENS', '258'))
+
+# Served strictly first; the other classes share the remaining capacity by weight
+PRIORITY_CLASS = REQUEST_CLASSES[0]
+WEIGHTED_CLASSES = REQUEST_CLASSES[1:]
+
+
+def _governor_setting(name: str, setting: str, default: str) -> str:
+    return os.getenv(f'{name.upper()}_GOVERNOR_{setting}', os.getenv(f'GOVERNOR_{setting}', default))
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """'bulk:4,background:1' -> {'bulk': 4.0, 'background': 1.0}; malformed entries are skipped"""
+    weights: Dict[str, float] = {}
+    for part in spec.split(','):
+        key, _, weight = part.rpartition(':')
+        if not key.strip():
+            continue
+        try:
+            weights[key.strip()] = max(0.01, float(weight))
+        except ValueError:
+            logger.warning(f"Ignoring malformed weight: {part}")
+    return weights
+
+
+def parse_class_weights(spec: str) -> Dict[str, float]:
+    """Weight per weighted class (unlisted classes weigh 1)"""
+    weights = {key.lower(): weight for key, weight in parse_weights(spec).items()}
+    return {request_class: weights.get(request_class, 1.0) for request_class in WEIGHTED_CLASSES}
+
+
+class ProviderSaturated(CircuitOpenError):
+    """The provider's admission queue is full or the wait ran out; nothing was sent"""
+
+    status = 'PROVIDER_SATURATED'
+
+
+def model_of(url: str, payload: Any) -> str:
+    """Model a call is billed against: the OpenAI 'model' field or the Gemini URL path"""
+    if isinstance(payload, dict) and payload.get('model'):
+        return str(payload['model'])
+    match = _GEMINI_MODEL_RE.search(url)
+    return match.group(1) if match else 'default'
+
+
+def document_tokens(size_bytes: int) -> int:
+    """Rough token cost of one attached document of size_bytes (decoded)"""
+    return max(DOCUMENT_MIN_TOKENS, int(size_bytes / 1024 * DOCUMENT_TOKENS_PER_KB))
+
+
+def inline_documents(value: Any) -> List[int]:
+    """Base64 lengths of the documents embedded in a payload: Gemini inlineData and data: URLs"""
+    found: List[int] = []
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in ('inlineData', 'inline_data') and isinstance(item, dict) and isinstance(item.get('data'), str):
+                found.append(len(item['data']))
+            else:
+                found.extend(inline_documents(item))
+    elif isinstance(value, list):
+        for item in value:
+            found.extend(inline_documents(item))
+    elif isinstance(value, str):
+        match = _DATA_URL_RE.match(value)
+        if match:
+            found.append(len(value) - match.end())
+    return found
+
+
+def estimate_tokens(payload: Any) -> int:
+    """
+    Rough token cost of a call: prompt characters / 4, plus document_tokens()
+    for each attached document, plus the requested output budget
+    """
+    if isinstance(payload, StreamedJSONBody):
+        # The prompt is the payload around the document, whose size is known without reading it
+        prompt_tokens = (len(payload.prefix) + len(payload.suffix)) // 4 + document_tokens(payload.document.size)
+        payload = payload.payload
+    elif isinstance(payload, dict):
+        documents = inline_documents(payload)
+        prompt_chars = len(json.dumps(payload, ensure_ascii=False)) - sum(documents)
+        prompt_tokens = prompt_chars // 4 + sum(document_tokens(length * 3 // 4) for length in documents)
+    else:
+        return 1
+    output_tokens = payload.get('max_tokens') or (payload.get('generationConfig') or {}).get('maxOutputTokens') or 0
+    return max(1, prompt_tokens + int(output_tokens))
+
+
+def used_tokens(response: requests.Response) -> Optional[int]:
+    """Tokens actually billed, from the OpenAI usage or Gemini usageMetadata block"""
+    try:
+        body = response.json()
+    except ValueError:
+        return None
+    if not isinstance(body, dict):
+        return None
+    usage = body.get('usage') or {}
+    if usage.get('total_tokens') is not None:
+        return int(usage['total_tokens'])
+    metadata = body.get('usageMetadata') or {}
+    if metadata.get('totalTokenCount') is not None:
+        return int(metadata['totalTokenCount'])
+    return None
+
+
+def gemini_quota_error(response: Optional[requests.Response]) -> Dict[str, Any]:
+    """
+    Details of a Gemini RESOURCE_EXHAUSTED error: 'retry_delay' (seconds)
+    from RetryInfo and per-minute 'tpm'/'rpm' limits from QuotaFailure.
+    Empty for other responses.
+    """
+    if response is None or response.status_code != 429:
+        return {}
+    try:
+        error = response.json().get('error') or {}
+    except (ValueError, AttributeError):
+        return {}
+    found: Dict[str, Any] = {}
+    for detail in error.get('details') or []:
+        kind = detail.get('@type', '')
+        if kind.endswith('RetryInfo') and str(detail.get('retryDelay', '')).endswith('s'):
+            try:
+                found['retry_delay'] = float(detail['retryDelay'][:-1])
+            except ValueError:
+                pass
+        elif kind.endswith('QuotaFailure'):
+            for violation in detail.get('violations') or []:
+                quota_id = violation.get('quotaId', '')
+                try:
+                    value = int(violation.get('quotaValue'))
+                except (TypeError, ValueError):
+                    continue
+                if 'PerMinute' not in quota_id:
+                    continue
+                found['tpm' if 'Token' in quota_id else 'rpm'] = value
+    return found
+
+
+class MinuteBucket:
+    """Token bucket refilled at limit per minute; a limit of 0 means unlimited"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.level = float(limit)
+        self._updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        if self.limit:
+            self.level = min(float(self.limit), self.level + (now - self._updated) * self.limit / 60.0)
+        self._updated = now
+
+    def _needed(self, amount: int, keep: float) -> float:
+        # A call larger than the usable bucket may go once the bucket is full
+        kept = self.limit * keep
+        return kept + min(amount, self.limit - kept)
+
+    def has(self, amount: int, keep: float = 0.0) -> bool:
+        """Whether amount fits while leaving the `keep` fraction of the bucket untouched"""
+        return not self.limit or self.level >= self._needed(amount, keep)
+
+    def seconds_until(self, amount: int, keep: float = 0.0) -> float:
+        if self.has(amount, keep):
+            return 0.0
+        return (self._needed(amount, keep) - self.level) * 60.0 / self.limit
+
+    def take(self, amount: int) -> None:
+        """Spend amount (a negative amount refunds an overestimate)"""
+        if self.limit:
+            self.level = min(float(self.limit), self.level - amount)
+
+    def learn(self, limit: Optional[int] = None, remaining: Optional[int] = None) -> None:
+        """Adopt the provider-reported limit, and its remaining quota when lower than ours"""
+        if limit and limit != self.limit:
+            self.level = float(limit) if not self.limit else self.level * limit / self.limit
+            self.limit = limit
+        if remaining is not None and self.limit:
+            self.level = min(self.level, float(remaining))
+
+
+class _Waiter:
+    """A queued caller; its future is set to wake it for another admission check"""
+
+    _arrivals = itertools.count()
+
+    def __init__(self, tokens: int, request_class: str, tenant: str):
+        self.tokens = tokens
+        self.request_class = request_class
+        self.tenant = tenant
+        self.arrival = next(self._arrivals)
+        self.future: Future = Future()
+
+    def wake(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class _FairQueue:
+    """
+    One lane's waiters, in a FIFO per tenant. Tenants take turns by stride
+    scheduling: each admission advances the tenant's pass by 1/weight and
+    the waiting tenant with the lowest pass goes next (earliest arrival on
+    ties). A tenant that starts waiting joins at the lowest pass among the
+    waiting ones, so idle time earns no credit.
+    """
+
+    def __init__(self, weight: Callable[[str], float]):
+        self.weight = weight
+        self.tenants: Dict[str, Deque[_Waiter]] = {}
+        self.passes: Dict[str, float] = {}
+        self.length = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def depth(self, tenant: str) -> int:
+        queue = self.tenants.get(tenant)
+        return len(queue) if queue is not None else 0
+
+    def append(self, waiter: _Waiter) -> None:
+        queue = self.tenants.get(waiter.tenant)
+        if queue is None:
+            queue = self.tenants[waiter.tenant] = deque()
+            self.passes[waiter.tenant] = min(self.passes.values(), default=0.0)
+        queue.append(waiter)
+        self.length += 1
+
+    def head(self) -> Optional[_Waiter]:
+        if not self.length:
+            return None
+        tenant = min(self.tenants, key=lambda key: (self.passes[key], self.tenants[key][0].arrival))
+        return self.tenants[tenant][0]
+
+    def remove(self, waiter: _Waiter, admitted: bool = False) -> bool:
+        """Take waiter out of the lane; an admitted waiter's tenant is charged its turn"""
+        queue = self.tenants.get(waiter.tenant)
+        if queue is None or waiter not in queue:
+            return False
+        queue.remove(waiter)
+        self.length -= 1
+        if admitted:
+            self.passes[waiter.tenant] += 1.0 / self.weight(waiter.tenant)
+        if not queue:
+            del self.tenants[waiter.tenant]
+            del self.passes[waiter.tenant]
+        return True
+
+
+class ModelLimits:
+    """Admission state and stats for one model of a provider"""
+
+    def __init__(self, max_concurrency: int, tpm: int, rpm: int, tenant_weight: Callable[[str], float]):
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+        self.tokens = MinuteBucket(tpm)
+        self.requests = MinuteBucket(rpm)
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.lanes: Dict[str, _FairQueue] = {request_class: _FairQueue(tenant_weight)
+                                             for request_class in REQUEST_CLASSES}
+        # Stride scheduling position of each weighted class; the lowest goes next
+        self.passes: Dict[str, float] = {request_class: 0.0 for request_class in WEIGHTED_CLASSES}
+        self.class_stats: Dict[str, Dict[str, float]] = {
+            request_class: {'admitted': 0, 'queued': 0, 'rejected': 0, 'queue_seconds': 0.0}
+            for request_class in REQUEST_CLASSES}
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.rate_limited = 0
+        self.peak_queue = 0
+        self.queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+        self.provider_seconds = 0.0
+
+    def queue_length(self) -> int:
+        return sum(len(lane) for lane in self.lanes.values())
+
+    def seconds_until_admissible(self, tokens: int, now: float, request_class: str = PRIORITY_CLASS,
+                                 reserve: float = 0.0) -> Optional[float]:
+        """
+        0 when a call may start now, else how long the minute buckets or a
+        pause need (None: wait for a slot). Calls other than interactive ones
+        leave the `reserve` fraction of slots and quota unused.
+        """
+        self.tokens.refill(now)
+        self.requests.refill(now)
+        slots = int(self.concurrency)
+        keep = 0.0
+        if request_class != PRIORITY_CLASS:
+            slots -= int(slots * reserve)
+            keep = reserve
+        if self.in_flight >= slots:
+            return None
+        return max(self.paused_until - now, self.tokens.seconds_until(tokens, keep),
+                   self.requests.seconds_until(1, keep), 0.0)
+
+
+class GovernorPermit:
+    """One admitted call; release() when the provider has answered"""
+
+    def __init__(self, governor: 'ProviderGovernor', model: str, limits: ModelLimits, queue_seconds: float,
+                 tenant: str):
+        self.governor = governor
+        self.model = model
+        self.limits = limits
+        self.tenant = tenant
+        self.queue_seconds = queue_seconds
+        self.started = time.monotonic()
+
+    def release(self, error: Optional[BaseException] = None, retry_after: Optional[float] = None) -> None:
+        """Free the slot; error is the call's failure, retry_after the provider's requested pause"""
+        self.governor._release(self, error, retry_after)
+
+
+class ProviderGovernor:
+    """
+    Caps concurrent calls, tokens and requests per minute for each model of
+    one provider.
+
+    Args:
+        name: Provider name (selects the <NAME>_GOVERNOR_* settings)
+        max_concurrency: Concurrent calls per model (upper bound for adaptation)
+        tpm: Tokens per minute per model, 0 until learned from the provider
+        rpm: Requests per minute per model, 0 until learned from the provider
+        max_queue: Callers allowed to wait per model and request class
+        max_queue_per_tenant: Of those, callers of one tenant
+        max_queue_seconds: Longest wait for admission
+        class_weights: Shares of the weighted classes ({'bulk': 4, 'background': 1})
+        interactive_reserve: Fraction of concurrency and minute quotas kept for interactive calls
+        tenant_weights: Shares of tenants within a lane (unlisted tenants weigh 1)
+        enabled: When False every call is admitted at once
+    """
+
+    def __init__(self, name: str, max_concurrency: Optional[int] = None, tpm: Optional[int] = None,
+                 rpm: Optional[int] = None, max_queue: Optional[int] = None,
+                 max_queue_per_tenant: Optional[int] = None, max_queue_seconds: Optional[float] = None,
+                 class_weights: Optional[Dict[str, float]] = None,
+                 interactive_reserve: Optional[float] = None, tenant_weights: Optional[Dict[str, float]] = None,
+                 enabled: Optional[bool] = None):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency or int(_governor_setting(name, 'MAX_CONCURRENCY', '16')))
+        self.tpm = tpm if tpm is not None else int(_governor_setting(name, 'TPM', '0'))
+        self.rpm = rpm if rpm is not None else int(_governor_setting(name, 'RPM', '0'))
+        self.max_queue = max_queue if max_queue is not None else int(_governor_setting(name, 'MAX_QUEUE', '256'))
+        self.max_queue_per_tenant = (max_queue_per_tenant if max_queue_per_tenant is not None
+                                     else int(_governor_setting(name, 'MAX_QUEUE_PER_TENANT', '64')))
+        self.max_queue_seconds = (max_queue_seconds if max_queue_seconds is not None
+                                  else float(_governor_setting(name, 'MAX_QUEUE_SECONDS', '10')))
+        if class_weights is None:
+            class_weights = parse_class_weights(_governor_setting(name, 'CLASS_WEIGHTS', 'bulk:4,background:1'))
+        self.class_weights = {request_class: class_weights.get(request_class, 1.0)
+                              for request_class in WEIGHTED_CLASSES}
+        reserve = (interactive_reserve if interactive_reserve is not None
+                   else float(_governor_setting(name, 'INTERACTIVE_RESERVE', '0.25')))
+        self.interactive_reserve = min(0.9, max(0.0, reserve))
+        self.tenant_weights = (tenant_weights if tenant_weights is not None
+                               else parse_weights(os.getenv('TENANT_WEIGHTS', '')))
+        self.max_tenant_stats = int(os.getenv('GOVERNOR_TENANT_STATS_MAX', '1000'))
+        self._tenants: 'OrderedDict[str, Dict[str, float]]' = OrderedDict()
+        self.enabled = enabled if enabled is not None else os.getenv('GOVERNOR_ENABLED', 'true').lower() == 'true'
+        self._lock = threading.Lock()
+        self._models: Dict[str, ModelLimits] = {}
+
+    def _limits(self, model: str) -> ModelLimits:
+        if model not in self._models:
+            self._models[model] = ModelLimits(self.max_concurrency, self.tpm, self.rpm, self.tenant_weight)
+        return self._models[model]
+
+    def tenant_weight(self, tenant: str) -> float:
+        return self.tenant_weights.get(tenant, 1.0)
+
+    def _tenant_stats(self, tenant: str) -> Dict[str, float]:
+        """Counters of one tenant, across models (the least recently active are dropped past the cap)"""
+        stats = self._tenants.get(tenant)
+        if stats is None:
+            stats = self._tenants[tenant] = {'waiting': 0, 'admitted': 0, 'queued': 0, 'rejected': 0,
+                                             'queue_seconds': 0.0, 'max_queue_seconds': 0.0,
+                                             'provider_seconds': 0.0}
+            if len(self._tenants) > self.max_tenant_stats:
+                for stale, counts in self._tenants.items():
+                    if not counts['waiting'] and stale != tenant:
+                        del self._tenants[stale]
+                        break
+        else:
+            self._tenants.move_to_end(tenant)
+        return stats
+
+    def _admit(self, limits: ModelLimits, waiter: _Waiter) -> None:
+        limits.in_flight += 1
+        limits.tokens.take(waiter.tokens)
+        limits.requests.take(1)
+        limits.admitted += 1
+        limits.class_stats[waiter.request_class]['admitted'] += 1
+        self._tenant_stats(waiter.tenant)['admitted'] += 1
+        if waiter.request_class != PRIORITY_CLASS:
+            limits.passes[waiter.request_class] += 1.0 / self.class_weights[waiter.request_class]
+
+    def _enqueue(self, limits: ModelLimits, waiter: _Waiter) -> None:
+        request_class = waiter.request_class
+        if request_class != PRIORITY_CLASS and not limits.lanes[request_class]:
+            # A class that was idle rejoins level with the busy ones instead of
+            # cashing in the turns it did not need
+            busy = [limits.passes[other] for other in WEIGHTED_CLASSES if limits.lanes[other]]
+            if busy:
+                limits.passes[request_class] = max(limits.passes[request_class], min(busy))
+            else:
+                limits.passes = {other: 0.0 for other in WEIGHTED_CLASSES}
+        limits.lanes[request_class].append(waiter)
+        self._tenant_stats(waiter.tenant)['waiting'] += 1
+
+    def _dequeue(self, limits: ModelLimits, waiter: _Waiter, admitted: bool = False) -> bool:
+        if not limits.lanes[waiter.request_class].remove(waiter, admitted):
+            return False
+        stats = self._tenants.get(waiter.tenant)
+        if stats is not None:
+            stats['waiting'] -= 1
+        return True
+
+    def _next_waiter(self, limits: ModelLimits) -> Optional[_Waiter]:
+        """
+        The caller to admit next: interactive first, then the weighted class
+        furthest behind; within the class, the tenant whose turn it is
+        """
+        if limits.lanes[PRIORITY_CLASS]:
+            return limits.lanes[PRIORITY_CLASS].head()
+        waiting: List[str] = [request_class for request_class in WEIGHTED_CLASSES if limits.lanes[request_class]]
+        if not waiting:
+            return None
+        return limits.lanes[min(waiting, key=lambda request_class: limits.passes[request_class])].head()
+
+    def _wake_head(self, limits: ModelLimits) -> None:
+        waiter = self._next_waiter(limits)
+        if waiter is not None:
+            waiter.wake()
+
+    def acquire(self, model: str, tokens: int, deadline: Optional[Deadline] = None,
+                request_class: Optional[str] = None, tenant: Optional[str] = None) -> Optional[GovernorPermit]:
+        """
+        Wait for a slot for one call of about `tokens` tokens, in the lane of
+        request_class and the queue of tenant (the current request's class
+        and tenant by default).
+
+        Returns:
+            A permit to release after the call, or None when the governor is disabled
+
+        Raises:
+            ProviderSaturated: The queue is full, or no slot opened within the
+                allowed wait
+            DeadlineExceeded: The request's deadline passed while queued
+            RequestCancelled: The client disconnected while queued
+        """
+        if not self.enabled:
+            return None
+        request_class = request_class or current_request_class()
+        tenant = tenant or current_tenant()
+        started = time.monotonic()
+        wait_limit = self.max_queue_seconds
+        deadline_bound = deadline is not None and deadline.remaining() < wait_limit
+        if deadline_bound:
+            wait_limit = deadline.remaining()
+        waiter: Optional[_Waiter] = None
+        try:
+            while True:
+                with self._lock:
+                    limits = self._limits(model)
+                    now = time.monotonic()
+                    delay = limits.seconds_until_admissible(tokens, now, request_class, self.interactive_reserve)
+                    arriving = waiter is None
+                    if arriving:
+                        lane = limits.lanes[request_class]
+                        full = None
+                        if len(lane) >= self.max_queue:
+                            full = f'{len(lane)} {request_class} calls already queued'
+                        elif lane.depth(tenant) >= self.max_queue_per_tenant:
+                            # One tenant's backlog must not fill the lane and lock the others out
+                            full = f'{lane.depth(tenant)} {request_class} calls of tenant {tenant} already queued'
+                        if full is not None:
+                            limits.rejected += 1
+                            limits.class_stats[request_class]['rejected'] += 1
+                            self._tenant_stats(tenant)['rejected'] += 1
+                            raise ProviderSaturated(f'{self.name}/{model}: {full}', retry_after=max(1.0, delay or 1.0))
+                        # Join the lane first: an arriving caller may still go at once if nothing outranks it
+                        waiter = _Waiter(tokens, request_class, tenant)
+                        self._enqueue(limits, waiter)
+                    if delay == 0.0 and self._next_waiter(limits) is waiter:
+                        self._dequeue(limits, waiter, admitted=True)
+                        self._admit(limits, waiter)
+                        waiter = None
+                        # A freed batch of slots may admit the next caller as well
+                        self._wake_head(limits)
+                        queue_seconds = now - started
+                        if queue_seconds > 0.001:
+                            limits.queue_seconds += queue_seconds
+                            limits.max_queue_seconds = max(limits.max_queue_seconds, queue_seconds)
+                            limits.class_stats[request_class]['queue_seconds'] += queue_seconds
+                            tenant_stats = self._tenant_stats(tenant)
+                            tenant_stats['queue_seconds'] += queue_seconds
+                            tenant_stats['max_queue_seconds'] = max(tenant_stats['max_queue_seconds'], queue_seconds)
+                        break
+                    if arriving:
+                        limits.queued += 1
+                        limits.class_stats[request_class]['queued'] += 1
+                        self._tenant_stats(tenant)['queued'] += 1
+                        limits.peak_queue = max(limits.peak_queue, limits.queue_length())
+                    elif waiter.future.done():
+                        waiter.future = Future()
+                left = wait_limit - (now - started)
+                if left <= 0 or (delay is not None and delay > left):
+                    # Out of time, or a pause/refill that is known to outlast the allowed wait
+                    with self._lock:
+                        limits.rejected += 1
+                        limits.class_stats[request_class]['rejected'] += 1
+                        self._tenant_stats(tenant)['rejected'] += 1
+                    if deadline_bound:
+                        raise DeadlineExceeded(f'{self.name}/{model}: deadline passes before a provider slot frees up')
+                    raise ProviderSaturated(f'{self.name}/{model}: no capacity within {wait_limit:.1f}s',
+                                            retry_after=max(1.0, delay or 1.0))
+                try:
+                    # Woken by a release, or poll when the minute buckets refill
+                    wait_for_result(waiter.future, min(left, delay) if delay else left)
+                except FuturesTimeoutError:
+                    pass
+        finally:
+            if waiter is not None:
+                with self._lock:
+                    was_next = self._next_waiter(limits) is waiter
+                    if self._dequeue(limits, waiter) and was_next:
+                        self._wake_head(limits)
+        record_queue_time(queue_seconds)
+        return GovernorPermit(self, model, limits, queue_seconds, tenant)
+
+    def try_acquire(self, model: str, tokens: int, request_class: Optional[str] = None,
+                    tenant: Optional[str] = None) -> Optional[GovernorPermit]:
+        """
+        A permit only if a slot is free right now and nobody is queued for
+        one, else None; never waits. For optional extra calls such as hedges,
+        which must not take a slot a queued caller is waiting for.
+        """
+        if not self.enabled:
+            return None
+        request_class = request_class or current_request_class()
+        tenant = tenant or current_tenant()
+        with self._lock:
+            limits = self._limits(model)
+            now = time.monotonic()
+            if limits.queue_length() or limits.seconds_until_admissible(
+                    tokens, now, request_class, self.interactive_reserve) != 0.0:
+                return None
+            self._admit(limits, _Waiter(tokens, request_class, tenant))
+        return GovernorPermit(self, model, limits, 0.0, tenant)
+
+    def _release(self, permit: GovernorPermit, error: Optional[BaseException], retry_after: Optional[float]) -> None:
+        limits = permit.limits
+        response = getattr(error, 'response', None)
+        rate_limited = response is not None and response.status_code == 429
+        quota = gemini_quota_error(response) if rate_limited else {}
+        with self._lock:
+            now = time.monotonic()
+            limits.in_flight -= 1
+            limits.provider_seconds += now - permit.started
+            self._tenant_stats(permit.tenant)['provider_seconds'] += now - permit.started
+            if rate_limited:
+                limits.rate_limited += 1
+                # One decrease per second: a burst of 429s is one congestion signal
+                if now - limits.last_decrease >= 1.0:
+                    limits.concurrency = max(1.0, limits.concurrency / 2)
+                    limits.last_decrease = now
+                limits.tokens.learn(limit=quota.get('tpm'), remaining=0 if 'tpm' in quota else None)
+                limits.requests.learn(limit=quota.get('rpm'), remaining=0 if 'rpm' in quota else None)
+                if retry_after:
+                    limits.paused_until = max(limits.paused_until, now + retry_after)
+            elif error is None:
+                limits.concurrency = min(float(self.max_concurrency), limits.concurrency + 1.0 / limits.concurrency)
+            self._wake_head(limits)
+        if rate_limited:
+            logger.warning(f"{self.name}/{permit.model}: rate limited, concurrency now {int(limits.concurrency)}")
+
+    def observe(self, model: str, response: requests.Response, estimated_tokens: int) -> None:
+        """Learn quotas from response headers and settle the token estimate against actual usage"""
+        headers = response.headers
+
+        def header_int(header: str) -> Optional[int]:
+            try:
+                return int(headers[header]) if headers.get(header) else None
+            except ValueError:
+                return None
+
+        actual = used_tokens(response) if response.ok else None
+        with self._lock:
+            limits = self._limits(model)
+            if actual is not None:
+                limits.tokens.take(actual - estimated_tokens)
+            limits.tokens.learn(header_int('x-ratelimit-limit-tokens'), header_int('x-ratelimit-remaining-tokens'))
+            limits.requests.learn(header_int('x-ratelimit-limit-requests'), header_int('x-ratelimit-remaining-requests'))
+            self._wake_head(limits)
+
+    def load(self) -> Dict[str, int]:
+        """Callers queued and calls in flight, summed over models (cheap enough to poll)"""
+        with self._lock:
+            return {
+                'queued': sum(limits.queue_length() for limits in self._models.values()),
+                'in_flight': sum(limits.in_flight for limits in self._models.values())
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        """Limits, queue and time split (queued vs at the provider) per model"""
+        now = time.monotonic()
+        with self._lock:
+            models = {}
+            for model, limits in self._models.items():
+                limits.tokens.refill(now)
+                limits.requests.refill(now)
+                models[model] = {
+                    'concurrency_limit': int(limits.concurrency),
+                    'in_flight': limits.in_flight,
+                    'queue_length': limits.queue_length(),
+                    'peak_queue_length': limits.peak_queue,
+                    'admitted': limits.admitted,
+                    'queued': limits.queued,
+                    'rejected': limits.rejected,
+                    'rate_limited': limits.rate_limited,
+                    'tpm_limit': limits.tokens.limit or None,
+                    'tokens_available': round(limits.tokens.level) if limits.tokens.limit else None,
+                    'rpm_limit': limits.requests.limit or None,
+                    'requests_available': round(limits.requests.level) if limits.requests.limit else None,
+                    'paused_seconds': round(max(0.0, limits.paused_until - now), 1),
+                    'queue_seconds_total': round(limits.queue_seconds, 3),
+                    'queue_seconds_max': round(limits.max_queue_seconds, 3),
+                    'provider_seconds_total': round(limits.provider_seconds, 3),
+                    'classes': {
+                        request_class: {
+                            'queue_length': len(limits.lanes[request_class]),
+                            'admitted': int(counts['admitted']),
+                            'queued': int(counts['queued']),
+                            'rejected': int(counts['rejected']),
+                            'queue_seconds_total': round(counts['queue_seconds'], 3)
+                        }
+                        for request_class, counts in limits.class_stats.items()
+                    }
+                }
+            tenants = {
+                tenant: {
+                    'weight': self.tenant_weight(tenant),
+                    'queue_length': int(counts['waiting']),
+                    'admitted': int(counts['admitted']),
+                    'queued': int(counts['queued']),
+                    'rejected': int(counts['rejected']),
+                    'queue_seconds_total': round(counts['queue_seconds'], 3),
+                    'queue_seconds_mean': round(counts['queue_seconds'] / counts['admitted'], 3)
+                    if counts['admitted'] else 0.0,
+                    'queue_seconds_max': round(counts['max_queue_seconds'], 3),
+                    'provider_seconds_total': round(counts['provider_seconds'], 3)
+                }
+                for tenant, counts in self._tenants.items()
+            }
+        return {
+            'enabled': self.enabled,
+            'max_concurrency': self.max_concurrency,
+            'max_queue': self.max_queue,
+            'max_queue_per_tenant': self.max_queue_per_tenant,
+            'max_queue_seconds': self.max_queue_seconds,
+            'class_weights': self.class_weights,
+            'interactive_reserve': self.interactive_reserve,
+            'models': models,
+            'tenants': tenants
+        }
+
+
+_governors: Dict[str, ProviderGovernor] = {}
+_governors_lock = threading.Lock()
+
+
+def get_governor(name: str) -> ProviderGovernor:
+    """Return the process-wide governor for a provider, creating it on first use"""
+    with _governors_lock:
+        if name not in _governors:
+            _governors[name] = ProviderGovernor(name)
+        return _governors[name]
+
+
+def governor_load() -> Dict[str, int]:
+    """Queued callers and in-flight calls across every provider governor of this process"""
+    with _governors_lock:
+        governors = list(_governors.values())
+    total = {'queued': 0, 'in_flight': 0}
+    for governor in governors:
+        for key, value in governor.load().items():
+            total[key] += value
+    return total
@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+"""
+ICAN Provider Resilience
+========================
+
+One provider-call resilience component shared by the NLP processors and
+the Treasury Guardian services. Retries happen around the outbound HTTP
+call only, never around a Flask view, and are governed by:
+
+- a per-request deadline (no attempt or retry is started that cannot finish
+  in time); taken from the inbound request's context (see
+  ican_request_context) when the caller does not pass one
+- cancellation: once the inbound request's client disconnects, the attempt
+  in flight is aborted and no retry, backoff or hedge follows
+- a process-wide retry budget (retries are capped at a fraction of traffic)
+- full-jitter exponential backoff
+- classification of retryable errors (network errors, 408/425/429/5xx;
+  other 4xx fail immediately)
+- server hints: Retry-After, retry-after-ms and x-ratelimit-reset-* headers
+- a per-provider circuit breaker (see ican_circuit_breaker) that rejects
+  calls instantly while the provider is degraded
+- optional hedging (see ican_request_hedging): an attempt still running
+  after the rolling p95 latency gets one duplicate, within a hedge budget
+- adaptive timeouts (see ican_adaptive_timeouts) derived from observed
+  latency per endpoint and input size; the caller's timeout is the
+  cold-start value
+- an outbound governor (see ican_provider_governor) that caps concurrent
+  calls and tokens/requests per minute per model, adapts to the provider's
+  rate-limit signals and queues excess callers; queue time is excluded
+  from the latency the breaker, hedging and timeouts see
+
+Configuration:
+    PROVIDER_MAX_ATTEMPTS           attempts per call, including the first (3)
+    PROVIDER_RETRY_BASE_DELAY       backoff base in seconds (0.5)
+    PROVIDER_RETRY_MAX_DELAY        backoff cap in seconds (8)
+    PROVIDER_MAX_RETRY_AFTER        longest server-requested wait honoured (30)
+    RETRY_BUDGET_RATIO              retries allowed per request in the window (0.2)
+    RETRY_BUDGET_MIN_PER_SECOND     retries always allowed per second (1)
+    RETRY_BUDGET_WINDOW_SECONDS     budget accounting window (10)
+    HEDGE_BUDGET_RATIO              hedges allowed per attempt in the window (0.05)
+    HEDGE_BUDGET_WINDOW_SECONDS     hedge budget accounting window (60)
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import os
+import re
+import time
+import random
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+
+from ican_circuit_breaker import CircuitBreaker, CircuitOpenError
+from ican_adaptive_timeouts import AdaptiveTimeouts
+from ican_http_pool import PooledSession, get_pool
+from ican_provider_governor import (GovernorPermit, ProviderGovernor, ProviderSaturated, estimate_tokens,
+                                    gemini_quota_error, get_governor, model_of)
+from ican_request_context import (Deadline, DeadlineExceeded, RequestCancelled, current_deadline,
+                                  record_provider_time, request_cancelled, wait_cancellable)
+from ican_request_hedging import Hedger
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+_DURATION_PART_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+
+
+def parse_duration(value: str) -> Optional[float]:
+    """Parse OpenAI style durations such as '20ms', '1s' or '6m0s' into seconds"""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def retry_after_seconds(response: Optional[requests.Response], include_resets: bool = True) -> Optional[float]:
+    """
+    Server-requested wait before retrying, from the standard and OpenAI
+    headers. include_resets=False ignores the x-ratelimit-reset-* estimates
+    (time until the quota is full again) and keeps only explicit pauses.
+    """
+    if response is None:
+        return None
+    headers = response.headers
+
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000.0)
+        except ValueError:
+            pass
+
+    retry_after = headers.get('Retry-After')
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+                return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+
+    if response.status_code == 429 and include_resets:
+        resets = [parse_duration(headers[name]) for name in
+                  ('x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens') if headers.get(name)]
+        resets = [reset for reset in resets if reset is not None]
+        if resets:
+            return max(resets)
+    if response.status_code == 429:
+        # Gemini sends no headers; its quota errors carry a RetryInfo delay in the body
+        return gemini_quota_error(response).get('retry_delay')
+    return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Network failures and transient HTTP statuses are retryable; everything else is not"""
+    if isinstance(error, (DeadlineExceeded, RequestCancelled)):
+        return False
+    if isinstance(error, requests.exceptions.HTTPError):
+        response = error.response
+        return response is not None and response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+class RetryBudget:
+    """
+    Process-wide cap on retries: within a sliding window, retries may not
+    exceed min_per_second * window + ratio * requests. Stops retry storms
+    from multiplying load on a provider that is already failing.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, window_seconds: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window_seconds = window_seconds
+        self._requests: deque = deque()
+        self._retries: deque = deque()
+        self._lock = threading.Lock()
+        self.denied = 0
+
+    def _trim(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        while self._requests and self._requests[0] < cutoff:
+            self._requests.popleft()
+        while self._retries and self._retries[0] < cutoff:
+            self._retries.popleft()
+
+    def record_request(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            self._requests.append(now)
+
+    def try_acquire_retry(self) -> bool:
+        """Reserve one retry; False when the budget is spent"""
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            allowed = self.min_per_second * self.window_seconds + self.ratio * len(self._requests)
+            if len(self._retries) >= allowed:
+                self.denied += 1
+                return False
+            self._retries.append(now)
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._trim(time.monotonic())
+            return {
+                'ratio': self.ratio,
+                'window_seconds': self.window_seconds,
+                'requests_in_window': len(self._requests),
+                'retries_in_window': len(self._retries),
+                'denied': self.denied
+            }
+
+
+default_retry_budget = RetryBudget(
+    ratio=float(os.getenv('RETRY_BUDGET_RATIO', '0.2')),
+    min_per_second=float(os.getenv('RETRY_BUDGET_MIN_PER_SECOND', '1')),
+    window_seconds=float(os.getenv('RETRY_BUDGET_WINDOW_SECONDS', '10'))
+)
+
+
+class ProviderClient:
+    """
+    Resilient HTTP client for one LLM provider.
+
+    Args:
+        name: Provider name (selects the shared connection pool)
+        default_deadline: Seconds a call may take, all retries included, when
+            the caller does not pass its own Deadline
+        max_attempts: Attempts per call, including the first
+        base_delay: Full-jitter backoff base in seconds
+        max_delay: Full-jitter backoff cap in seconds
+        max_retry_after: Longest server-requested wait that is honoured
+        budget: Retry budget; defaults to the process-wide budget
+        pool: Connection pool; defaults to the shared pool for name
+        breaker: Circuit breaker; defaults to one with the BREAKER_* settings
+        hedging: Send a duplicate attempt when one outlives the rolling p95
+            latency (only for idempotent calls such as LLM completions)
+        timeouts: Adaptive timeout policy; defaults to one with the
+            ADAPTIVE_* settings
+        governor: Outbound admission control; defaults to the shared
+            governor for name
+    """
+
+    def __init__(self, name: str, default_deadline: float = 60.0,
+                 max_attempts: Optional[int] = None, base_delay: Optional[float] = None,
+                 max_delay: Optional[float] = None, max_retry_after: Optional[float] = None,
+                 budget: Optional[RetryBudget] = None, pool: Optional[PooledSession] = None,
+                 breaker: Optional[CircuitBreaker] = None, hedging: bool = False,
+                 timeouts: Optional[AdaptiveTimeouts] = None, governor: Optional[ProviderGovernor] = None):
+        self.name = name
+        self.default_deadline = default_deadline
+        self.max_attempts = max_attempts or int(os.getenv('PROVIDER_MAX_ATTEMPTS', '3'))
+        self.base_delay = base_delay if base_delay is not None else float(os.getenv('PROVIDER_RETRY_BASE_DELAY', '0.5'))
+        self.max_delay = max_delay if max_delay is not None else float(os.getenv('PROVIDER_RETRY_MAX_DELAY', '8'))
+        self.max_retry_after = (max_retry_after if max_retry_after is not None
+                                else float(os.getenv('PROVIDER_MAX_RETRY_AFTER', '30')))
+        self.budget = budget or default_retry_budget
+        self.pool = pool or get_pool(name)
+        self.breaker = breaker or CircuitBreaker(name)
+        self.hedger = Hedger(name, RetryBudget(
+            ratio=float(os.getenv('HEDGE_BUDGET_RATIO', '0.05')),
+            min_per_second=0.0,
+            window_seconds=float(os.getenv('HEDGE_BUDGET_WINDOW_SECONDS', '60'))
+        )) if hedging else None
+        self.timeouts = timeouts or AdaptiveTimeouts(name)
+        self.governor = governor or get_governor(name)
+
+        self._lock = threading.Lock()
+        self.counters = {
+            'calls': 0,
+            'attempts': 0,
+            'retries': 0,
+            'successes': 0,
+            'failures': 0,
+            'non_retryable_errors': 0,
+            'budget_exhausted': 0,
+            'deadline_exceeded': 0,
+            'cancelled': 0,
+            'circuit_open': 0,
+            'governor_rejected': 0
+        }
+        # Last rate-limit headers seen (OpenAI sends x-ratelimit-*; Gemini does not)
+        self.quota: Dict[str, Any] = {}
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _attempt_timeout(self, timeout: Union[None, float, Tuple[float, float]],
+                         deadline: Deadline) -> Tuple[float, float]:
+        """Cap the per-attempt (connect, read) timeout by the time left on the deadline"""
+        connect_timeout, read_timeout = self.pool.resolve_timeout(timeout)
+        remaining = deadline.remaining()
+        return (min(connect_timeout, remaining), min(read_timeout, remaining))
+
+    def observe_quota(self, response: requests.Response) -> None:
+        """Remember the provider's remaining request/token quota from its response headers"""
+        quota = {}
+        for kind in ('requests', 'tokens'):
+            remaining = response.headers.get(f'x-ratelimit-remaining-{kind}')
+            limit = response.headers.get(f'x-ratelimit-limit-{kind}')
+            try:
+                if remaining is not None and limit is not None:
+                    quota[kind] = {'remaining': int(remaining), 'limit': int(limit)}
+            except ValueError:
+                continue
+        if quota:
+            with self._lock:
+                self.quota = quota
+
+    def quota_fraction(self) -> Optional[float]:
+        """Smallest remaining/limit ratio across request and token quotas, None if unknown"""
+        with self._lock:
+            quota = dict(self.quota)
+        fractions = [q['remaining'] / q['limit'] for q in quota.values() if q['limit'] > 0]
+        return round(min(fractions), 4) if fractions else None
+
+    def _backoff(self, attempt: int) -> float:
+        """Full jitter: uniform between 0 and the capped exponential delay"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def resolve_deadline(self, deadline: Optional[Deadline] = None) -> Deadline:
+        """The explicit deadline, else the inbound request's, capped by the client default"""
+        default = Deadline.after(self.default_deadline)
+        deadline = deadline or current_deadline()
+        if deadline is None or deadline.expires_at > default.expires_at:
+            return default
+        return deadline
+
+    def _release_permit(self, permit: GovernorPermit, error: Optional[BaseException] = None) -> None:
+        """Free a governor slot, passing on the provider's requested pause (capped) after a failure"""
+        pause = retry_after_seconds(getattr(error, 'response', None), include_resets=False)
+        permit.release(error, min(pause, self.max_retry_after) if pause is not None else None)
+
+    def call(self, attempt_fn: Callable[[Deadline], Any], deadline: Optional[Deadline] = None,
+             admission: Optional[Tuple[str, int]] = None) -> Any:
+        """
+        Run attempt_fn with retries. attempt_fn receives the Deadline and must
+        raise requests exceptions (HTTPError for bad statuses) on failure.
+
+        admission is the (model, estimated tokens) of the call; each attempt
+        then waits for a governor slot first. A requests.Response result
+        gets the total wait as queue_seconds.
+        """
+        deadline = self.resolve_deadline(deadline)
+        self._count('calls')
+        self.budget.record_request()
+
+        attempt = 0
+        queued = 0.0
+        while True:
+            attempt += 1
+            if request_cancelled():
+                self._count('cancelled')
+                raise RequestCancelled(f'{self.name}: client disconnected before attempt {attempt}')
+
+            if deadline.expired():
+                self._count('deadline_exceeded')
+                self._count('failures')
+                raise DeadlineExceeded(f'{self.name}: deadline exceeded before attempt {attempt}')
+
+            permit = None
+            if admission is not None:
+                try:
+                    permit = self.governor.acquire(admission[0], admission[1], deadline)
+                except ProviderSaturated:
+                    self._count('governor_rejected')
+                    self._count('failures')
+                    raise
+                except DeadlineExceeded:
+                    self._count('deadline_exceeded')
+                    self._count('failures')
+                    raise
+                except RequestCancelled:
+                    self._count('cancelled')
+                    raise
+                if permit is not None:
+                    queued += permit.queue_seconds
+
+            if not self.breaker.allow():
+                if permit is not None:
+                    permit.release()
+                self._count('circuit_open')
+                self._count('failures')
+                raise CircuitOpenError(f'{self.name}: circuit open', retry_after=self.breaker.retry_after())
+
+            self._count('attempts')
+            started = time.monotonic()
+            # The hedger releases the permit itself, when the attempt holding it returns
+            hedged = self.hedger is not None
+            try:
+                if hedged:
+                    result = self.hedger.run(
+                        attempt_fn, deadline, permit=permit, release_permit=self._release_permit,
+                        acquire_permit=lambda: self.governor.try_acquire(admission[0], admission[1]))
+                else:
+                    result = attempt_fn(deadline)
+                if permit is not None and not hedged:
+                    self._release_permit(permit)
+                self.breaker.record_success(time.monotonic() - started)
+                record_provider_time(time.monotonic() - started)
+                self._count('successes')
+                if isinstance(result, requests.Response):
+                    result.queue_seconds = round(queued, 3)
+                return result
+            except DeadlineExceeded as error:
+                if permit is not None and not hedged:
+                    self._release_permit(permit, error)
+                # Refused before sending: nothing reached the provider
+                self.breaker.release()
+                self._count('deadline_exceeded')
+                self._count('failures')
+                raise
+            except Exception as error:
+                if permit is not None and not hedged:
+                    self._release_permit(permit, error)
+                record_provider_time(time.monotonic() - started)
+                if request_cancelled():
+                    # Aborted because the client went away; says nothing about the provider
+                    self.breaker.release()
+                    self._count('cancelled')
+                    if isinstance(error, RequestCancelled):
+                        raise
+                    raise RequestCancelled(f'{self.name}: client disconnected during attempt {attempt}') from error
+                if isinstance(error, requests.exceptions.Timeout) and deadline.expired():
+                    # The attempt was cut short by the caller's deadline, not by the provider
+                    self.breaker.release()
+                    self._count('deadline_exceeded')
+                    self._count('failures')
+                    raise DeadlineExceeded(f'{self.name}: deadline exceeded during attempt {attempt}') from error
+                # Only transient failures say the provider is unhealthy; a 400 means it answered
+                if is_retryable(error):
+                    self.breaker.record_failure(time.monotonic() - started)
+                else:
+                    self.breaker.record_success(time.monotonic() - started)
+
+                if not is_retryable(error):
+                    self._count('non_retryable_errors')
+                    self._count('failures')
+                    raise
+                if attempt >= self.max_attempts:
+                    logger.error(f"{self.name}: giving up after {attempt} attempts: {str(error)}")
+                    self._count('failures')
+                    raise
+
+                delay = self._backoff(attempt)
+                server_delay = retry_after_seconds(getattr(error, 'response', None))
+                if server_delay is not None:
+                    if server_delay > self.max_retry_after:
+                        logger.warning(f"{self.name}: Retry-After {server_delay:.1f}s too long, not retrying")
+                        self._count('failures')
+                        raise
+                    delay = max(delay, server_delay)
+
+                if delay >= deadline.remaining():
+                    logger.warning(f"{self.name}: no time left on deadline for a retry")
+                    self._count('deadline_exceeded')
+                    self._count('failures')
+                    raise
+
+                if not self.budget.try_acquire_retry():
+                    logger.warning(f"{self.name}: retry budget exhausted, not retrying")
+                    self._count('budget_exhausted')
+                    self._count('failures')
+                    raise
+
+                self._count('retries')
+                logger.warning(f"{self.name}: attempt {attempt} failed ({str(error)}), retrying in {delay:.2f}s")
+                if wait_cancellable(delay):
+                    self._count('cancelled')
+                    raise RequestCancelled(f'{self.name}: client disconnected before retry {attempt}') from error
+
+    def post(self, url: str, timeout: Union[None, float, Tuple[float, float]] = None,
+             deadline: Optional[Deadline] = None, endpoint: Optional[str] = None,
+             size_hint: Optional[int] = None, **kwargs: Any) -> requests.Response:
+        """
+        POST with retries; raises requests.HTTPError for non-2xx responses.
+
+        endpoint and size_hint (input size in bytes or characters) select the
+        latency histogram for adaptive timeouts; timeout is the cold-start
+        value. The chosen timeout is attached to the response as timeout_info.
+        """
+        endpoint = endpoint or urlsplit(url).path
+        static_timeout = self.pool.resolve_timeout(timeout)
+        payload = kwargs['json'] if 'json' in kwargs else kwargs.get('data')
+        model = model_of(url, payload)
+        tokens = estimate_tokens(payload)
+
+        def attempt(current_deadline: Deadline) -> requests.Response:
+            expected = self.timeouts.expected_seconds(endpoint, size_hint)
+            if expected is not None and current_deadline.remaining() < expected:
+                raise DeadlineExceeded(f'{self.name}: {current_deadline.remaining():.2f}s left, '
+                                       f'a typical {endpoint} call takes {expected:.2f}s')
+            chosen, info = self.timeouts.choose(endpoint, size_hint, static_timeout)
+            attempt_timeout = self._attempt_timeout(chosen, current_deadline)
+            started = time.monotonic()
+            try:
+                response = self.pool.post(url, timeout=attempt_timeout, **kwargs)
+            except requests.exceptions.Timeout:
+                # Censored sample: count it at the limit so a too-short timeout grows
+                self.timeouts.record(endpoint, size_hint, time.monotonic() - started)
+                raise
+            self.timeouts.record(endpoint, size_hint, time.monotonic() - started)
+            response.timeout_info = info
+            self.observe_quota(response)
+            self.governor.observe(model, response, tokens)
+            response.raise_for_status()
+            return response
+
+        return self.call(attempt, deadline, admission=(model, tokens))
+
+    def post_json(self, url: str, timeout: Union[None, float, Tuple[float, float]] = None,
+                  deadline: Optional[Deadline] = None, endpoint: Optional[str] = None,
+                  size_hint: Optional[int] = None, **kwargs: Any) -> Dict[str, Any]:
+        """POST with retries and return the decoded JSON body"""
+        return self.post(url, timeout=timeout, deadline=deadline, endpoint=endpoint,
+                         size_hint=size_hint, **kwargs).json()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            'provider': self.name,
+            'max_attempts': self.max_attempts,
+            'default_deadline': self.default_deadline,
+            **counters,
+            'circuit_state': self.breaker.state,
+            'quota': self.quota,
+            'timeouts': self.timeouts.stats(),
+            'retry_budget': self.budget.stats(),
+            'hedging': self.hedger.stats() if self.hedger is not None else None,
+            'governor': self.governor.stats()
+        }
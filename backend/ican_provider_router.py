@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+ICAN Provider Router
+====================
+
+Holds several LLM backends (Gemini, OpenAI) in one process and spreads
+parse traffic across them by health: rolling latency, error rate and the
+remaining rate-limit quota reported by the provider. A backend whose
+circuit is open gets no traffic until its cool-down is over; it then gets
+its share again, and those calls are the breaker's half-open probes. When the chosen backend fails, the call
+fails over to the next best one before the caller sees an error. A call
+abandoned because the client disconnected, or refused because the caller's
+deadline leaves no time for it, is neither failed over nor held against the
+backend's health. A backend whose call queue is full (ProviderSaturated) is
+skipped for the next one without counting as a failure.
+
+Configuration:
+    ROUTER_LATENCY_ALPHA    EWMA smoothing for latency (0.2)
+    ROUTER_ERROR_ALPHA      EWMA smoothing for the error rate (0.1)
+    ROUTER_MIN_SHARE        traffic share every healthy backend keeps, so a
+                            recovering provider is still measured (0.02)
+    ROUTER_LOW_QUOTA        remaining quota fraction below which a backend
+                            is weighted down (0.1)
+    ROUTER_ERROR_PENALTY_SECONDS
+                            latency charged per unit of error rate, i.e. the
+                            cost of a failed call plus its failover (5)
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ican_provider_governor import ProviderSaturated
+from ican_request_context import DeadlineExceeded, RequestCancelled
+
+logger = logging.getLogger(__name__)
+
+
+class RoutedBackend:
+    """One provider as seen by the router, with its rolling health numbers"""
+
+    def __init__(self, name: str, fn: Callable[..., Any], client: Any = None):
+        self.name = name
+        self.fn = fn
+        self.client = client
+        self.latency_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.failovers = 0
+        self.saturated = 0
+        self.total_seconds = 0.0
+
+    def circuit_open(self) -> bool:
+        """Open and still cooling down; once the cool-down is over the next call is its half-open probe"""
+        breaker = getattr(self.client, 'breaker', None)
+        return breaker is not None and breaker.retry_after() > 0
+
+    def quota_fraction(self) -> Optional[float]:
+        if self.client is None or not hasattr(self.client, 'quota_fraction'):
+            return None
+        return self.client.quota_fraction()
+
+
+class ProviderRouter:
+    """
+    Weighted, health-aware choice between backends with automatic failover.
+
+    Args:
+        name: Router name for logs and stats
+        latency_alpha: EWMA smoothing factor for latency
+        error_alpha: EWMA smoothing factor for the error rate
+        min_share: Share of traffic every healthy backend keeps
+        low_quota: Remaining quota fraction that starts weighting a backend down
+        error_penalty: Seconds of effective latency added per unit of error rate
+    """
+
+    def __init__(self, name: str, latency_alpha: Optional[float] = None,
+                 error_alpha: Optional[float] = None, min_share: Optional[float] = None,
+                 low_quota: Optional[float] = None, error_penalty: Optional[float] = None):
+        self.name = name
+        self.latency_alpha = latency_alpha or float(os.getenv('ROUTER_LATENCY_ALPHA', '0.2'))
+        self.error_alpha = error_alpha or float(os.getenv('ROUTER_ERROR_ALPHA', '0.1'))
+        self.min_share = min_share if min_share is not None else float(os.getenv('ROUTER_MIN_SHARE', '0.02'))
+        self.low_quota = low_quota if low_quota is not None else float(os.getenv('ROUTER_LOW_QUOTA', '0.1'))
+        self.error_penalty = (error_penalty if error_penalty is not None
+                              else float(os.getenv('ROUTER_ERROR_PENALTY_SECONDS', '5')))
+        self.backends: List[RoutedBackend] = []
+        self._lock = threading.Lock()
+        self.exhausted = 0
+
+    def register(self, name: str, fn: Callable[..., Any], client: Any = None) -> None:
+        """Add a backend; fn does the provider call, client (a ProviderClient) supplies breaker and quota"""
+        self.backends.append(RoutedBackend(name, fn, client))
+
+    def _weight(self, backend: RoutedBackend, default_latency: float) -> float:
+        if backend.circuit_open():
+            return 0.0
+        latency = backend.latency_ewma if backend.latency_ewma is not None else default_latency
+        # Success probability over expected cost, where errors cost a failover
+        effective_latency = max(latency, 0.01) + backend.error_ewma * self.error_penalty
+        weight = (1.0 - backend.error_ewma) / effective_latency
+        quota = backend.quota_fraction()
+        if quota is not None and quota < self.low_quota:
+            weight *= max(0.01, quota / self.low_quota)
+        return weight
+
+    def weights(self) -> Dict[str, float]:
+        """Normalised traffic share per backend"""
+        with self._lock:
+            known = [b.latency_ewma for b in self.backends if b.latency_ewma is not None]
+            default_latency = sum(known) / len(known) if known else 1.0
+            raw = {b.name: self._weight(b, default_latency) for b in self.backends}
+        healthy = [name for name, weight in raw.items() if weight > 0]
+        total = sum(raw.values())
+        if not total:
+            return {name: 0.0 for name in raw}
+        shares = {name: weight / total for name, weight in raw.items()}
+        # Keep a trickle of traffic on every healthy backend so its numbers stay fresh
+        floor = min(self.min_share, 1.0 / len(healthy))
+        lifted = {name: max(floor, share) if name in healthy else 0.0 for name, share in shares.items()}
+        lifted_total = sum(lifted.values())
+        return {name: share / lifted_total for name, share in lifted.items()}
+
+    def _order(self) -> List[RoutedBackend]:
+        """Backends in the order to try: one weighted pick, then the rest by weight"""
+        shares = self.weights()
+        by_name = {b.name: b for b in self.backends}
+        healthy = [name for name, share in shares.items() if share > 0]
+        if not healthy:
+            # Every circuit is open: let the first backend fail fast with CircuitOpenError
+            return list(self.backends)
+        first = random.choices(healthy, weights=[shares[name] for name in healthy])[0]
+        rest = sorted((name for name in healthy if name != first), key=lambda name: -shares[name])
+        return [by_name[first]] + [by_name[name] for name in rest]
+
+    def _record(self, backend: RoutedBackend, seconds: float, failed: bool) -> None:
+        with self._lock:
+            backend.calls += 1
+            backend.total_seconds += seconds
+            backend.error_ewma += self.error_alpha * ((1.0 if failed else 0.0) - backend.error_ewma)
+            if failed:
+                backend.failures += 1
+                return
+            backend.successes += 1
+            if backend.latency_ewma is None:
+                backend.latency_ewma = seconds
+            else:
+                backend.latency_ewma += self.latency_alpha * (seconds - backend.latency_ewma)
+
+    def route(self, *args: Any, **kwargs: Any) -> Any:
+        """Call the best backend, failing over to the others; raises the last error if all fail"""
+        return self.route_named(*args, **kwargs)[1]
+
+    def route_named(self, *args: Any, **kwargs: Any) -> Tuple[str, Any]:
+        """Like route(), returning (name of the backend that answered, its result)"""
+        last_error: Optional[Exception] = None
+        for backend in self._order():
+            if last_error is not None:
+                with self._lock:
+                    backend.failovers += 1
+                logger.warning(f"{self.name}: failing over to {backend.name} ({str(last_error)})")
+            started = time.monotonic()
+            try:
+                result = backend.fn(*args, **kwargs)
+            except (RequestCancelled, DeadlineExceeded):
+                # The caller gave up or ran out of time; another backend would not do better
+                raise
+            except ProviderSaturated as error:
+                # Nothing was sent: the backend is busy, not unhealthy
+                with self._lock:
+                    backend.saturated += 1
+                last_error = error
+                continue
+            except Exception as error:
+                self._record(backend, time.monotonic() - started, failed=True)
+                last_error = error
+                continue
+            self._record(backend, time.monotonic() - started, failed=False)
+            return backend.name, result
+        with self._lock:
+            self.exhausted += 1
+        raise last_error
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-backend routing stats: traffic share, health inputs and time spent"""
+        shares = self.weights()
+        with self._lock:
+            total_calls = sum(b.calls for b in self.backends)
+            backends = {
+                b.name: {
+                    'weight': round(shares.get(b.name, 0.0), 4),
+                    'calls': b.calls,
+                    'traffic_share': round(b.calls / total_calls, 4) if total_calls else 0.0,
+                    'successes': b.successes,
+                    'failures': b.failures,
+                    'failovers_to': b.failovers,
+                    'saturated': b.saturated,
+                    'latency_ewma_ms': round(b.latency_ewma * 1000, 1) if b.latency_ewma is not None else None,
+                    'error_rate_ewma': round(b.error_ewma, 4),
+                    'quota_fraction': b.quota_fraction(),
+                    'circuit_open': b.circuit_open(),
+                    'total_seconds': round(b.total_seconds, 3)
+                } for b in self.backends
+            }
+        return {'router': self.name, 'all_backends_failed': self.exhausted, 'backends': backends}
@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+"""
+ICAN Request Context
+====================
+
+Per-request state that has to reach code far below the Flask view (retry
+loops, provider clients) without being threaded through every call: the
+caller's deadline, whether the caller has gone away, and the provider time
+spent on its behalf.
+
+The deadline arrives in a header from the gateway:
+    X-Request-Timeout-Ms    time the caller will still wait, in milliseconds
+    X-Request-Deadline      absolute deadline as a Unix timestamp (seconds or
+                            milliseconds)
+
+It is stored in a context variable for the duration of the request, so
+ProviderClient picks it up automatically and never starts an attempt or
+retry that cannot finish in time. Requests whose deadline has passed get a
+distinct 504 DEADLINE_EXCEEDED, and the provider time they consumed is
+counted as wasted spend.
+
+A watcher thread polls the client sockets of in-flight requests. When a
+client disconnects (a mobile user closing the app mid-request) the
+request is cancelled: its in-flight provider connection is shut down (see
+ican_http_pool), pending retries and hedges are dropped, and waits on
+shared work end early, so the worker is freed and no more tokens are paid
+for an answer nobody will read. In the async serving mode (see
+ican_async_server) the disconnect cancels the request's task instead, and
+the waits below yield to the event loop rather than blocking a thread.
+
+Each request also has a class that decides its lane in the provider
+governor (see ican_provider_governor):
+    X-Request-Class         interactive (a user waiting on the answer, the
+                            default), bulk (imports, backfills) or background
+Endpoints that are bulk by nature (the batch parse) set their own default,
+which the header still overrides. Within a lane, callers are queued fairly
+per tenant (the business the Node gateway is calling for):
+    X-Tenant-ID             tenant identifier; requests without one share
+                            the 'default' tenant
+
+Configuration:
+    CLIENT_DISCONNECT_WATCH     cancel provider calls of disconnected clients (true)
+    CLIENT_DISCONNECT_POLL_MS   how often client sockets are checked (100)
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import os
+import ssl
+import time
+import select
+import socket
+import asyncio
+import logging
+import threading
+from concurrent.futures import ALL_COMPLETED, Future, TimeoutError as FuturesTimeoutError, wait
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT_HEADER = 'X-Request-Timeout-Ms'
+DEADLINE_HEADER = 'X-Request-Deadline'
+CLASS_HEADER = 'X-Request-Class'
+TENANT_HEADER = 'X-Tenant-ID'
+DEFAULT_TENANT = 'default'
+MAX_TENANT_LENGTH = 64
+
+# Request classes in priority order; interactive is the default
+REQUEST_CLASSES = ('interactive', 'bulk', 'background')
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """The per-request deadline passed before the work could complete"""
+
+
+class RequestCancelled(requests.exceptions.RequestException):
+    """The client went away; the work done on its behalf was abandoned"""
+
+
+class Deadline:
+    """A point in (monotonic) time by which a request must be finished"""
+
+    def __init__(self, expires_at: float):
+        self.expires_at = expires_at
+
+    @classmethod
+    def after(cls, seconds: float) -> 'Deadline':
+        return cls(time.monotonic() + seconds)
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+class RequestContext:
+    """State of one inbound request, visible to everything it calls"""
+
+    def __init__(self, deadline: Optional[Deadline] = None, request_class: Optional[str] = None,
+                 tenant: str = DEFAULT_TENANT):
+        self.deadline = deadline
+        self.request_class = request_class
+        self.tenant = tenant
+        self.provider_seconds = 0.0
+        self.queue_seconds = 0.0
+        self.deadline_exceeded = False
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._cancel_callbacks: List[Callable[[], None]] = []
+
+    def on_cancel(self, callback: Callable[[], None]) -> None:
+        """Run callback when the request is cancelled (immediately if it already was)"""
+        with self._lock:
+            if not self.cancelled.is_set():
+                self._cancel_callbacks.append(callback)
+                return
+        callback()
+
+    def remove_cancel_callback(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._cancel_callbacks:
+                self._cancel_callbacks.remove(callback)
+
+    def cancel(self) -> None:
+        """Abandon the request; runs every registered cancel callback once"""
+        with self._lock:
+            if self.cancelled.is_set():
+                return
+            self.cancelled.set()
+            callbacks, self._cancel_callbacks = self._cancel_callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as error:
+                logger.warning(f"Cancel callback failed: {str(error)}")
+
+
+_current: ContextVar[Optional[RequestContext]] = ContextVar('ican_request_context', default=None)
+
+
+def current_context() -> Optional[RequestContext]:
+    return _current.get()
+
+
+def current_deadline() -> Optional[Deadline]:
+    context = _current.get()
+    return context.deadline if context is not None else None
+
+
+def current_request_class() -> str:
+    """Class of the current request: 'interactive', 'bulk' or 'background'"""
+    context = _current.get()
+    if context is None or context.request_class is None:
+        return REQUEST_CLASSES[0]
+    return context.request_class
+
+
+def default_request_class(request_class: str) -> None:
+    """Use request_class for the current request unless its caller chose one with X-Request-Class"""
+    context = _current.get()
+    if context is not None and context.request_class is None:
+        context.request_class = request_class
+
+
+def current_tenant() -> str:
+    """Tenant the current request is made for ('default' when none was named)"""
+    context = _current.get()
+    return context.tenant if context is not None else DEFAULT_TENANT
+
+
+def detached_context() -> RequestContext:
+    """A context with the current request's class and tenant, but no deadline and never cancelled"""
+    context = _current.get()
+    if context is None:
+        return RequestContext()
+    return RequestContext(request_class=context.request_class, tenant=context.tenant)
+
+
+def run_in_context(context: RequestContext, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run fn with context as the current request context (for work handed to another thread)"""
+    token = _current.set(context)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _current.reset(token)
+
+
+def remaining_seconds() -> Optional[float]:
+    """Seconds left on the current request's deadline, None when it has none"""
+    deadline = current_deadline()
+    return max(0.0, deadline.remaining()) if deadline is not None else None
+
+
+def ensure_time_left(stage: str) -> None:
+    """Raise DeadlineExceeded if the current request's deadline has passed"""
+    deadline = current_deadline()
+    if deadline is not None and deadline.expired():
+        raise DeadlineExceeded(f'deadline exceeded before {stage}')
+
+
+def request_cancelled() -> bool:
+    """True once the current request's client has disconnected"""
+    context = _current.get()
+    return context is not None and context.cancelled.is_set()
+
+
+def ensure_not_cancelled(stage: str) -> None:
+    """Raise RequestCancelled if the current request's client has disconnected"""
+    if request_cancelled():
+        raise RequestCancelled(f'client disconnected before {stage}')
+
+
+def wait_cancellable(seconds: float) -> bool:
+    """Sleep for seconds, waking early if the current request is cancelled; True if it was"""
+    from ican_async_bridge import await_only, in_async_bridge
+    if in_async_bridge():
+        try:
+            await_only(asyncio.sleep(seconds))
+        except RequestCancelled:
+            return True
+        return request_cancelled()
+    context = _current.get()
+    if context is None:
+        time.sleep(seconds)
+        return False
+    return context.cancelled.wait(seconds)
+
+
+def _retrieve_exception(wrapped: 'asyncio.Future') -> None:
+    """Done-callback: nobody reads a wrapper's exception (callers use the original future)"""
+    if not wrapped.cancelled():
+        wrapped.exception()
+
+
+async def _wait_wrapped(futures: Iterable[Future], timeout: Optional[float],
+                        return_when: str) -> Tuple[Set[Future], Set[Future]]:
+    wrapped = {}
+    for future in futures:
+        wrapper = asyncio.wrap_future(future)
+        wrapper.add_done_callback(_retrieve_exception)
+        wrapped[wrapper] = future
+    done, pending = await asyncio.wait(wrapped, timeout=timeout, return_when=return_when)
+    return {wrapped[w] for w in done}, {wrapped[w] for w in pending}
+
+
+def wait_futures(futures: Iterable[Future], timeout: Optional[float] = None,
+                 return_when: str = ALL_COMPLETED) -> Tuple[Set[Future], Set[Future]]:
+    """concurrent.futures.wait() that yields to the event loop in the async serving mode"""
+    from ican_async_bridge import await_only, in_async_bridge
+    if in_async_bridge():
+        return await_only(_wait_wrapped(futures, timeout, return_when))
+    return wait(futures, timeout=timeout, return_when=return_when)
+
+
+def wait_for_result(future: Future, timeout: Optional[float] = None) -> Any:
+    """
+    future.result(timeout), but give up with RequestCancelled as soon as the
+    current request is cancelled. The work behind the future carries on for
+    whoever else is waiting on it.
+    """
+    from ican_async_bridge import await_only, in_async_bridge
+    if in_async_bridge():
+        done, _ = await_only(_wait_wrapped([future], timeout, ALL_COMPLETED))
+        if not done:
+            raise FuturesTimeoutError()
+        return future.result(timeout=0)
+    context = _current.get()
+    if context is None:
+        return future.result(timeout=timeout)
+    finished = threading.Event()
+    future.add_done_callback(lambda _: finished.set())
+    context.on_cancel(finished.set)
+    try:
+        finished.wait(timeout)
+    finally:
+        context.remove_cancel_callback(finished.set)
+    if not future.done() and context.cancelled.is_set():
+        raise RequestCancelled('client disconnected while waiting for a shared result')
+    return future.result(timeout=0)
+
+
+def record_provider_time(seconds: float) -> None:
+    """Charge provider time to the current request (for wasted-spend accounting)"""
+    context = _current.get()
+    if context is not None:
+        context.provider_seconds += seconds
+
+
+def record_queue_time(seconds: float) -> None:
+    """Charge time spent waiting for provider admission (see ican_provider_governor) to the current request"""
+    context = _current.get()
+    if context is not None:
+        context.queue_seconds += seconds
+
+
+def deadline_from_headers(headers: Any) -> Optional[Deadline]:
+    """Build a Deadline from X-Request-Timeout-Ms or X-Request-Deadline; None if absent or malformed"""
+    timeout_ms = headers.get(TIMEOUT_HEADER)
+    if timeout_ms:
+        try:
+            return Deadline.after(float(timeout_ms) / 1000.0)
+        except ValueError:
+            logger.warning(f"Ignoring malformed {TIMEOUT_HEADER}: {timeout_ms}")
+
+    absolute = headers.get(DEADLINE_HEADER)
+    if absolute:
+        try:
+            timestamp = float(absolute)
+        except ValueError:
+            logger.warning(f"Ignoring malformed {DEADLINE_HEADER}: {absolute}")
+            return None
+        if timestamp > 1e11:  # milliseconds since the epoch
+            timestamp /= 1000.0
+        return Deadline.after(timestamp - time.time())
+    return None
+
+
+def request_class_from_headers(headers: Any) -> Optional[str]:
+    """The class named in X-Request-Class; None if absent or unknown"""
+    value = headers.get(CLASS_HEADER)
+    if not value:
+        return None
+    request_class = value.strip().lower()
+    if request_class not in REQUEST_CLASSES:
+        logger.warning(f"Ignoring unknown {CLASS_HEADER}: {value}")
+        return None
+    return request_class
+
+
+def tenant_from_headers(headers: Any) -> str:
+    """The tenant named in X-Tenant-ID, or 'default'"""
+    tenant = (headers.get(TENANT_HEADER) or '').strip()
+    return tenant[:MAX_TENANT_LENGTH] if tenant else DEFAULT_TENANT
+
+
+class DeadlineStats:
+    """How often callers' deadlines were hit, and what provider time that wasted"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests_with_deadline = 0
+        self.expired_on_arrival = 0
+        self.exceeded = 0
+        self.wasted_provider_seconds = 0.0
+
+    def finish(self, context: RequestContext) -> None:
+        if context.deadline is None:
+            return
+        with self._lock:
+            self.requests_with_deadline += 1
+            if context.deadline_exceeded:
+                self.exceeded += 1
+                self.wasted_provider_seconds += context.provider_seconds
+
+    def arrived_expired(self) -> None:
+        with self._lock:
+            self.expired_on_arrival += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'requests_with_deadline': self.requests_with_deadline,
+                'expired_on_arrival': self.expired_on_arrival,
+                'deadline_exceeded': self.exceeded,
+                'wasted_provider_seconds': round(self.wasted_provider_seconds, 3)
+            }
+
+
+deadline_stats = DeadlineStats()
+
+
+def mark_deadline_exceeded() -> None:
+    """Flag the current request as having missed its deadline"""
+    context = _current.get()
+    if context is not None:
+        context.deadline_exceeded = True
+
+
+def _peer_closed(sock: socket.socket) -> bool:
+    """True when the client has closed its end of the connection"""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        # Readable with nothing to read is EOF; pipelined data means the client is still there
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except ValueError:
+        return False  # the server already closed the socket
+    except OSError:
+        return True  # reset by peer
+
+
+class DisconnectWatcher:
+    """
+    Background thread that cancels requests whose client has disconnected.
+
+    Args:
+        poll_interval: Seconds between checks of the watched sockets
+        enabled: When False, nothing is watched
+    """
+
+    def __init__(self, poll_interval: Optional[float] = None, enabled: Optional[bool] = None):
+        self.poll_interval = (poll_interval if poll_interval is not None
+                              else float(os.getenv('CLIENT_DISCONNECT_POLL_MS', '100')) / 1000)
+        self.enabled = (enabled if enabled is not None
+                        else os.getenv('CLIENT_DISCONNECT_WATCH', 'true').lower() == 'true')
+        self._lock = threading.Lock()
+        self._watched: Dict[int, Any] = {}
+        self._owner_pid = None
+        self.counters = {
+            'watched_requests': 0,
+            'unsupported_sockets': 0,
+            'disconnects': 0,
+            'cancelled_requests': 0
+        }
+        self.wasted_provider_seconds = 0.0
+
+    def _ensure_started(self) -> None:
+        """Start the watcher thread lazily (and again in a forked worker)"""
+        if self._owner_pid == os.getpid():
+            return
+        with self._lock:
+            if self._owner_pid == os.getpid():
+                return
+            self._watched = {}
+            threading.Thread(target=self._watch_loop, name='client-disconnect-watcher', daemon=True).start()
+            self._owner_pid = os.getpid()
+
+    def watch(self, sock: Any, context: RequestContext) -> bool:
+        """Cancel context if sock's peer disconnects; False if the socket cannot be watched"""
+        if not self.enabled:
+            return False
+        if not isinstance(sock, socket.socket) or isinstance(sock, ssl.SSLSocket):
+            # MSG_PEEK is not available through TLS; terminate TLS at the proxy to get cancellation
+            with self._lock:
+                self.counters['unsupported_sockets'] += 1
+            return False
+        self._ensure_started()
+        with self._lock:
+            self._watched[id(context)] = (sock, context)
+            self.counters['watched_requests'] += 1
+        return True
+
+    def finish(self, context: RequestContext) -> None:
+        """Stop watching a finished request and account for it if it was cancelled"""
+        with self._lock:
+            self._watched.pop(id(context), None)
+            if context.cancelled.is_set():
+                self.counters['cancelled_requests'] += 1
+                self.wasted_provider_seconds += context.provider_seconds
+
+    def _watch_loop(self) -> None:
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                watched = list(self._watched.items())
+            for key, (sock, context) in watched:
+                if context.cancelled.is_set() or not _peer_closed(sock):
+                    continue
+                with self._lock:
+                    if self._watched.pop(key, None) is None:
+                        continue  # the request finished meanwhile
+                self.disconnected(context)
+
+    def disconnected(self, context: RequestContext) -> None:
+        """Count a client disconnect and cancel the request it belonged to"""
+        with self._lock:
+            self.counters['disconnects'] += 1
+        logger.info("Client disconnected, cancelling its provider calls")
+        context.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'poll_ms': round(self.poll_interval * 1000, 1),
+                'watching': len(self._watched),
+                **self.counters,
+                'wasted_provider_seconds': round(self.wasted_provider_seconds, 3)
+            }
+
+
+disconnect_watcher = DisconnectWatcher()
+
+
+def init_request_context(app: Any, on_expired: Callable[[], Any]) -> None:
+    """
+    Give every request of a Flask app a RequestContext built from its
+    headers, cancelled when the client disconnects (development server and
+    gunicorn sync/gthread workers expose the client socket in the environ).
+
+    Args:
+        app: Flask application
+        on_expired: Returns the app's 504 response; used when a request
+            arrives with its deadline already in the past
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _open_request_context():
+        context = RequestContext(deadline_from_headers(request.headers), request_class_from_headers(request.headers),
+                                 tenant_from_headers(request.headers))
+        g.ican_request_context = context
+        g.ican_request_context_token = _current.set(context)
+        client_socket = request.environ.get('werkzeug.socket') or request.environ.get('gunicorn.socket')
+        if client_socket is not None:
+            disconnect_watcher.watch(client_socket, context)
+        if context.deadline is not None and context.deadline.expired():
+            deadline_stats.arrived_expired()
+            context.deadline_exceeded = True
+            return on_expired()
+        return None
+
+    @app.teardown_request
+    def _close_request_context(error=None):
+        context = g.pop('ican_request_context', None)
+        token = g.pop('ican_request_context_token', None)
+        if context is not None:
+            deadline_stats.finish(context)
+            disconnect_watcher.finish(context)
+        if token is not None:
+            _current.reset(token)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+ICAN Request Hedging
+====================
+
+Tail-latency hedging for provider calls. A rolling window of successful
+attempt latencies gives the hedge delay (p95 by default); when an attempt
+has not returned by then, one duplicate is issued and the first good
+response wins. The slower copy is ignored and its response released when
+it eventually completes. Hedges are capped by a budget so they add at most
+a small fraction of extra calls, and under a provider governor a hedge is
+only sent when a second slot is free; each copy holds its own slot until it
+returns. Attempts run in the caller's request context, so a client
+disconnect aborts them and suppresses the hedge.
+
+Configuration (constructor arguments override these):
+    HEDGE_PERCENTILE            latency percentile that triggers a hedge (0.95)
+    HEDGE_BUDGET_RATIO          hedges allowed per attempt in the window (0.05)
+    HEDGE_BUDGET_WINDOW_SECONDS hedge budget accounting window (60)
+    HEDGE_MIN_SAMPLES           latencies observed before hedging starts (20)
+    HEDGE_MIN_DELAY_MS          never hedge sooner than this (50)
+    HEDGE_SAMPLE_WINDOW         latencies kept for the percentile (500)
+    HEDGE_MAX_WORKERS           concurrent hedged attempts per provider (32)
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor
+from contextvars import copy_context
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from ican_request_context import request_cancelled, wait_for_result, wait_futures
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """Rolling window of latencies with percentile lookup"""
+
+    def __init__(self, max_samples: int = 500):
+        self._samples: deque = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Nearest-rank percentile of the window, None while it is empty"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, int(round(fraction * len(samples))) - 1))
+        return samples[index]
+
+
+class Hedger:
+    """
+    Runs attempts with at most one hedge each.
+
+    Args:
+        name: Provider name, used for thread names and logs
+        budget: Object with record_request() / try_acquire_retry() used as the
+            hedge budget (a RetryBudget with min_per_second=0 works well)
+        percentile: Latency percentile after which a hedge is sent
+        min_samples: Latencies required before the percentile is trusted
+        min_delay: Lower bound on the hedge delay in seconds
+        max_samples: Size of the rolling latency window
+        max_workers: Attempts that may run hedged at once; beyond that,
+            attempts run inline without a hedge
+    """
+
+    def __init__(self, name: str, budget: Any, percentile: Optional[float] = None,
+                 min_samples: Optional[int] = None, min_delay: Optional[float] = None,
+                 max_samples: Optional[int] = None, max_workers: Optional[int] = None):
+        self.name = name
+        self.budget = budget
+        self.percentile = percentile or float(os.getenv('HEDGE_PERCENTILE', '0.95'))
+        self.min_samples = min_samples or int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+        self.min_delay = (min_delay if min_delay is not None
+                          else float(os.getenv('HEDGE_MIN_DELAY_MS', '50')) / 1000)
+        self.max_workers = max_workers or int(os.getenv('HEDGE_MAX_WORKERS', '32'))
+        self.latencies = LatencyTracker(max_samples or int(os.getenv('HEDGE_SAMPLE_WINDOW', '500')))
+
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._active = 0
+        self.counters = {
+            'attempts': 0,
+            'hedges_issued': 0,
+            'hedge_wins': 0,
+            'primary_wins': 0,
+            'budget_denied': 0,
+            'losers_ignored': 0,
+            'inline_no_capacity': 0,
+            'no_free_permit': 0
+        }
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self.counters[counter] += 1
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, None until enough latencies were seen"""
+        if len(self.latencies) < self.min_samples:
+            return None
+        return max(self.min_delay, self.latencies.percentile(self.percentile))
+
+    def _timed(self, attempt_fn: Callable[..., Any], *args: Any) -> Any:
+        started = time.monotonic()
+        result = attempt_fn(*args)
+        self.latencies.record(time.monotonic() - started)
+        return result
+
+    def _submit(self, attempt_fn: Callable[..., Any], args: Tuple[Any, ...], permit: Any = None,
+                release_permit: Optional[Callable[[Any, Optional[BaseException]], None]] = None) -> Future:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix=f'{self.name}-hedge')
+            executor = self._executor
+        future = executor.submit(copy_context().run, self._timed, attempt_fn, *args)
+        future.add_done_callback(partial(self._finish, permit=permit, release_permit=release_permit))
+        return future
+
+    def _finish(self, future: Future, permit: Any = None,
+                release_permit: Optional[Callable[[Any, Optional[BaseException]], None]] = None) -> None:
+        """Done-callback of every attempt: frees its worker and permit once it has really returned"""
+        with self._lock:
+            self._active -= 1
+        if permit is not None:
+            release_permit(permit, None if future.cancelled() else future.exception())
+
+    @staticmethod
+    def _release(future: Future) -> None:
+        """Close the response of an attempt nobody is waiting for any more"""
+        if future.cancelled() or future.exception() is not None:
+            return
+        close = getattr(future.result(), 'close', None)
+        if callable(close):
+            close()
+
+    def run(self, attempt_fn: Callable[..., Any], *args: Any, permit: Any = None,
+            acquire_permit: Optional[Callable[[], Any]] = None,
+            release_permit: Optional[Callable[[Any, Optional[BaseException]], None]] = None) -> Any:
+        """
+        Run attempt_fn(*args), hedging it once if it outlives the hedge delay.
+
+        permit is the governor permit the call was admitted under, and run()
+        then owns it. A hedge needs a permit of its own: acquire_permit()
+        returns one without waiting (None: no hedge is sent). Each permit is
+        handed to release_permit(permit, error) when its own attempt returns,
+        so the slower copy keeps its provider slot while it is still running.
+        """
+        self._count('attempts')
+        self.budget.record_request()
+
+        delay = self.hedge_delay()
+        with self._lock:
+            has_capacity = self._active + 2 <= self.max_workers
+            if delay is not None and has_capacity:
+                self._active += 2
+        if delay is None or not has_capacity:
+            if delay is not None:
+                self._count('inline_no_capacity')
+            try:
+                result = self._timed(attempt_fn, *args)
+            except BaseException as error:
+                if permit is not None:
+                    release_permit(permit, error)
+                raise
+            if permit is not None:
+                release_permit(permit, None)
+            return result
+
+        # Two workers were reserved; each submitted attempt frees its own when it returns
+        unused_workers = 2
+        try:
+            primary = self._submit(attempt_fn, args, permit, release_permit)
+            unused_workers -= 1
+            wait_futures([primary], timeout=delay)
+            if primary.done() or request_cancelled():
+                return wait_for_result(primary)
+            if not self.budget.try_acquire_retry():
+                self._count('budget_denied')
+                return wait_for_result(primary)
+            hedge_permit = acquire_permit() if permit is not None else None
+            if permit is not None and hedge_permit is None:
+                # A hedge would have to queue behind other callers for a provider slot
+                self._count('no_free_permit')
+                return wait_for_result(primary)
+
+            self._count('hedges_issued')
+            logger.info(f"{self.name}: no response after {delay:.2f}s, sending hedge")
+            hedge = self._submit(attempt_fn, args, hedge_permit, release_permit)
+            unused_workers -= 1
+
+            pending = {primary, hedge}
+            first_error: Optional[BaseException] = None
+            while pending:
+                done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        self._count('hedge_wins' if future is hedge else 'primary_wins')
+                        for loser in pending:
+                            self._count('losers_ignored')
+                            loser.add_done_callback(self._release)
+                        return future.result()
+                    first_error = first_error or future.exception()
+            raise first_error
+        finally:
+            with self._lock:
+                self._active -= unused_workers
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.counters)
+        delay = self.hedge_delay()
+        attempts = counters['attempts']
+        return {
+            'percentile': self.percentile,
+            'hedge_delay_ms': round(delay * 1000, 1) if delay is not None else None,
+            'samples': len(self.latencies),
+            **counters,
+            'hedge_rate': round(counters['hedges_issued'] / attempts, 4) if attempts else 0.0,
+            'budget': self.budget.stats()
+        }
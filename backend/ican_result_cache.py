@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+ICAN Result Cache
+=================
+
+Bounded, thread-safe LRU cache with per-entry TTL. Sits in front of the
+LLM provider calls so that phrases users re-enter every day
+("boda 5000", "lunch 15000 at cafe javas") are answered in microseconds
+instead of a full provider round trip.
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    """Case-fold and collapse whitespace so trivially different inputs share a key"""
+    return _WHITESPACE_RE.sub(' ', text.strip().lower())
+
+
+def prompt_version(*parts: str) -> str:
+    """
+    Fingerprint the prompt material (system instruction, schema, ...).
+
+    Any edit to the prompt changes the version and therefore every cache key,
+    so stale results produced by an older prompt are never served.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()[:12]
+
+
+class TTLCache:
+    """
+    LRU cache with a time-to-live on every entry.
+
+    Args:
+        max_entries: Maximum number of entries before least-recently-used eviction
+        ttl_seconds: Lifetime of an entry after it is stored
+    """
+
+    def __init__(self, max_entries: int = 5000, ttl_seconds: float = 86400):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = float(ttl_seconds)
+        self._entries: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(text: str, model: str, version: str) -> Tuple[str, str, str]:
+        """Build a cache key from normalized input text plus model and prompt version"""
+        return (normalize_text(text), model, version)
+
+    def _lookup(self, key: Hashable, now: float) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= now:
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value or None on a miss / expired entry"""
+        return self.get_first([key])
+
+    def get_first(self, keys: Iterable[Hashable]) -> Optional[Any]:
+        """Value of the first key present (e.g. one key per model that may have answered); one hit or miss"""
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                value = self._lookup(key, now)
+                if value is not None:
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store a value, evicting least-recently-used entries when full"""
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self._entries[key] = (expires_at, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> int:
+        """Drop every entry; returns the number of entries removed"""
+        with self._lock:
+            removed = len(self._entries)
+            self._entries.clear()
+            return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for the metrics endpoint"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
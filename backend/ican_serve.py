@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+ICAN Production Server
+======================
+
+Multi-process entry point for the NLP and Treasury services, replacing the
+single-process development server of their __main__ blocks.
+
+The service module is imported once in the gunicorn master before the
+workers are forked (preload), so the Flask app, compiled regexes, keyword
+tables, caches and provider clients are built once and shared
+copy-on-write. Each worker then drops the pooled provider connections it
+inherited (a socket must not be shared between processes) and reseeds its
+random generator, so routing and retry jitter differ between workers.
+
+A worker whose resident memory grows past WORKER_MAX_RSS_MB is told to
+exit after its in-flight requests finish, and the master replaces it.
+
+Usage:
+    python ican_serve.py nlp|nlp-openai|treasury|treasury-openai
+
+Configuration:
+    ICAN_BIND                   listen address (0.0.0.0:<service port>)
+    ICAN_WORKERS                worker processes (2 x CPUs + 1)
+    ICAN_THREADS                threads per worker (16)
+    ICAN_SERVER_MODE            threaded (gthread workers) or async (aiohttp
+                                workers, see ican_async_server)
+    ICAN_WORKER_TIMEOUT         seconds a silent worker is allowed (30)
+    ICAN_GRACEFUL_TIMEOUT       seconds to finish requests on restart (30)
+    ICAN_KEEPALIVE              keep-alive seconds for client connections (5)
+    WORKER_MAX_RSS_MB           recycle a worker above this memory, 0 = off (512)
+    WORKER_MEMORY_CHECK_SECONDS how often worker memory is checked (10)
+    WORKER_MAX_REQUESTS         also recycle after this many requests, 0 = off (0)
+
+Requires the optional gunicorn package.
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import importlib
+import threading
+import multiprocessing
+from typing import Any, Dict, Optional
+
+from ican_async_server import server_mode
+from ican_http_pool import reset_pools
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # optional: only the production entry point needs it
+    BaseApplication = object
+
+logger = logging.getLogger(__name__)
+
+# Service name -> (module, default port); NLP and Treasury must not collide
+SERVICES = {
+    'nlp': ('ican_nlp_processor', 5000),
+    'nlp-openai': ('ican_nlp_processor_openai', 5000),
+    'treasury': ('treasury_guardian_api', 5001),
+    'treasury-openai': ('treasury_guardian_openai', 5001),
+}
+
+
+def resident_memory_mb() -> Optional[float]:
+    """Current resident memory of this process in MB (None where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def _watch_memory(worker: Any, limit_mb: float, interval: float) -> None:
+    """Ask the worker to exit gracefully once its memory passes the limit"""
+    while worker.alive:
+        rss = resident_memory_mb()
+        if rss is not None and rss > limit_mb:
+            worker.log.warning(f"Worker {worker.pid} uses {rss:.0f}MB (limit {limit_mb:.0f}MB), recycling")
+            worker.alive = False
+            return
+        time.sleep(interval)
+
+
+def post_fork(server: Any, worker: Any) -> None:
+    """Per-worker setup: fresh provider connections, own random stream, memory limit"""
+    reset_pools()
+    random.seed()
+    limit_mb = float(os.getenv('WORKER_MAX_RSS_MB', '512'))
+    if limit_mb > 0:
+        interval = float(os.getenv('WORKER_MEMORY_CHECK_SECONDS', '10'))
+        threading.Thread(target=_watch_memory, args=(worker, limit_mb, interval),
+                         name='worker-memory-watch', daemon=True).start()
+
+
+def gunicorn_options(default_port: int) -> Dict[str, Any]:
+    """gunicorn settings from the environment"""
+    threaded = server_mode() != 'async'
+    return {
+        'bind': os.getenv('ICAN_BIND', f'0.0.0.0:{default_port}'),
+        'workers': int(os.getenv('ICAN_WORKERS', str(2 * multiprocessing.cpu_count() + 1))),
+        'worker_class': 'gthread' if threaded else 'aiohttp.GunicornWebWorker',
+        'threads': int(os.getenv('ICAN_THREADS', '16')) if threaded else 1,
+        'timeout': int(os.getenv('ICAN_WORKER_TIMEOUT', '30')),
+        'graceful_timeout': int(os.getenv('ICAN_GRACEFUL_TIMEOUT', '30')),
+        'keepalive': int(os.getenv('ICAN_KEEPALIVE', '5')),
+        'max_requests': int(os.getenv('WORKER_MAX_REQUESTS', '0')),
+        'max_requests_jitter': int(os.getenv('WORKER_MAX_REQUESTS', '0')) // 10,
+        'preload_app': True,
+        'post_fork': post_fork,
+    }
+
+
+class ICANServer(BaseApplication):
+    """gunicorn application serving one ICAN Flask service"""
+
+    def __init__(self, module_name: str, options: Dict[str, Any]):
+        self.module_name = module_name
+        self.options = options
+        super().__init__()
+
+    def load_config(self) -> None:
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self) -> Any:
+        # Runs once in the master (preload_app): everything built at import time is shared
+        flask_app = importlib.import_module(self.module_name).app
+        if server_mode() != 'async':
+            return flask_app
+        from aiohttp import web
+        from ican_async_server import create_async_app
+
+        async def runner() -> Any:
+            # handler_cancellation: a client disconnect cancels its handler task
+            return web.AppRunner(create_async_app(flask_app), handler_cancellation=True)
+        return runner
+
+
+def main() -> None:
+    if len(sys.argv) != 2 or sys.argv[1] not in SERVICES:
+        print(f"Usage: python ican_serve.py {'|'.join(SERVICES)}")
+        sys.exit(2)
+    if BaseApplication is object:
+        print("❌ ican_serve needs the gunicorn package (pip install gunicorn)")
+        sys.exit(1)
+    module_name, default_port = SERVICES[sys.argv[1]]
+    ICANServer(module_name, gunicorn_options(default_port)).run()
+
+
+if __name__ == '__main__':
+    main()
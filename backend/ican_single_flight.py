@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+ICAN Single-Flight
+==================
+
+In-flight request coalescing. While a call for a given key is running,
+identical calls wait on the same future instead of starting their own,
+so client retries and double-submits cost one provider round trip.
+
+A waiter whose own client disconnects stops waiting; if the caller running
+the call disconnects, the call is abandoned and the next waiter runs it.
+Likewise when the call fails with DeadlineExceeded: that was the running
+caller's deadline, so a waiter with time left runs the call itself.
+
+The shared call runs in the context of the caller that started it: its
+deadline, request class and tenant govern the provider call (lane, queue
+and quota) for everyone waiting on it.
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from ican_request_context import (DeadlineExceeded, RequestCancelled, current_deadline, request_cancelled,
+                                  wait_for_result)
+
+
+# Returned by _do_once when the call this caller waited on hit its leader's deadline
+_RETRY = object()
+
+
+class SingleFlight:
+    """Run at most one call per key at a time and share its outcome"""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        Execute fn for key, or join the call already in flight for key.
+
+        Returns:
+            Tuple of (result, shared) where shared is True when this caller
+            waited on another caller's call. Exceptions propagate to every
+            waiter, except a RequestCancelled or DeadlineExceeded of the
+            caller running the call: a waiter still in time runs it again.
+            A waiter gives up after timeout seconds with
+            concurrent.futures.TimeoutError; the call itself carries on.
+        """
+        while True:
+            try:
+                outcome = self._do_once(key, fn, timeout)
+                if outcome is not _RETRY:
+                    return outcome
+            except RequestCancelled:
+                # The caller running the call went away; unless this caller did too, take over
+                if request_cancelled():
+                    raise
+
+    def _do_once(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float]) -> Any:
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = Future()
+                self._inflight[key] = future
+                self.calls += 1
+                leader = True
+
+        if not leader:
+            try:
+                return wait_for_result(future, timeout), True
+            except DeadlineExceeded:
+                # The leader ran out of time; this caller may not have
+                deadline = current_deadline()
+                if deadline is not None and deadline.expired():
+                    raise
+                return _RETRY
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for the metrics endpoint"""
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._inflight)
+            }
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+ICAN Streamed Body
+==================
+
+Outbound JSON request bodies that carry a document without building it as
+one string. A multi-megabyte document embedded in a payload dict and sent
+with requests' json= is copied and scanned several times over: the base64
+string, json.dumps of the whole payload, its UTF-8 encoding, and again by
+the governor's token estimate.
+
+StreamedJSONBody serializes the payload once with a placeholder where the
+document goes and splits it there into a prefix and a suffix. Sending it
+yields the prefix, the document base64-encoded a chunk at a time straight
+from its spool (one reusable read buffer, no full-document intermediate)
+and the suffix. Its length is known up front, so it goes out with a
+Content-Length rather than chunked, and it can be iterated again for a
+retry. It works as data= for requests and for aiohttp in the async
+serving mode, where the spool reads and encoding run in the event loop's
+thread pool instead of stalling the loop.
+
+Configuration:
+    DOCUMENT_CHUNK_KB   document bytes encoded per chunk (256, see ican_document_upload)
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import json
+import asyncio
+import binascii
+from typing import Any, AsyncIterator, Dict, Iterator, Tuple
+
+from ican_document_upload import CHUNK_BYTES, SpooledDocument
+
+# Stands in for the document's base64 text while the rest of the payload is serialized
+DOCUMENT_PLACEHOLDER = '\x00ican-document\x00'
+
+
+class StreamedJSONBody:
+    """
+    A JSON payload with one string value streamed as the base64 of a document.
+
+    Args:
+        payload: The request payload, with DOCUMENT_PLACEHOLDER as the value
+            that is to carry the document
+        document: The spooled document
+    """
+
+    def __init__(self, payload: Dict[str, Any], document: SpooledDocument):
+        self.payload = payload
+        self.document = document
+        text = json.dumps(payload, ensure_ascii=False)
+        marker = json.dumps(DOCUMENT_PLACEHOLDER)[1:-1]
+        if text.count(marker) != 1:
+            raise ValueError('Payload must contain DOCUMENT_PLACEHOLDER exactly once')
+        prefix, suffix = text.split(marker)
+        self.prefix = prefix.encode('utf-8')
+        self.suffix = suffix.encode('utf-8')
+        # Whole 3-byte groups per chunk, so no padding appears before the last one
+        self.chunk_bytes = max(3, CHUNK_BYTES // 3 * 3)
+
+    def __len__(self) -> int:
+        return len(self.prefix) + self.document.base64_length + len(self.suffix)
+
+    def _encode_at(self, offset: int, buffer: bytearray) -> Tuple[int, bytes]:
+        """Read the document chunk at offset into buffer; (bytes read, their base64)"""
+        size = self.document.readinto_at(offset, buffer)
+        return size, binascii.b2a_base64(memoryview(buffer)[:size], newline=False)
+
+    def __iter__(self) -> Iterator[memoryview]:
+        yield memoryview(self.prefix)
+        buffer = bytearray(self.chunk_bytes)
+        offset = 0
+        while True:
+            size, encoded = self._encode_at(offset, buffer)
+            if not size:
+                break
+            offset += size
+            yield memoryview(encoded)
+        yield memoryview(self.suffix)
+
+    async def __aiter__(self) -> AsyncIterator[memoryview]:
+        # aiohttp streams async iterables. Spool reads and encoding are blocking CPU work, so
+        # they run in the loop's thread pool, one chunk ahead of the one being sent.
+        loop = asyncio.get_running_loop()
+        yield memoryview(self.prefix)
+        buffer = bytearray(self.chunk_bytes)
+        pending = loop.run_in_executor(None, self._encode_at, 0, buffer)
+        offset = 0
+        while True:
+            size, encoded = await pending
+            if not size:
+                break
+            offset += size
+            # encoded is a copy, so the buffer is free for the next chunk
+            pending = loop.run_in_executor(None, self._encode_at, offset, buffer)
+            yield memoryview(encoded)
+        yield memoryview(self.suffix)
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        """Headers describing the body (Content-Length, so it is not sent chunked)"""
+        return {'Content-Type': 'application/json', 'Content-Length': str(len(self))}
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Concurrent-request capacity of the NLP service: threaded vs async serving
+=========================================================================
+
+Starts a fake OpenAI endpoint that answers every call after a fixed delay
+(a slow LLM), then runs ican_nlp_processor_openai once with the threaded
+server and once with ICAN_SERVER_MODE=async, and fires waves of concurrent
+parse requests at each. Every text is unique and vague enough to need the
+LLM, so each request really waits on the provider.
+
+Reports per wave: completed requests, errors, wall time, throughput, p50/p99
+latency, and the service process's peak thread count and resident memory.
+
+Usage:
+    python backend/scripts/benchmark_async_serving.py [--concurrency 200 1000 2000]
+                                                      [--latency 1.0]
+
+Needs aiohttp and greenlet (the async mode's optional dependencies). Linux
+only for the thread/memory figures (read from /proc).
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import subprocess
+from typing import Any, Dict, List
+
+import aiohttp
+from aiohttp import web
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROVIDER_PORT = 18700
+SERVICE_PORT = 18701
+
+SERVICE_SCRIPT = '''
+import sys, logging
+sys.path.insert(0, {backend!r})
+logging.disable(logging.WARNING)
+import ican_nlp_providers
+import ican_nlp_processor_openai as service
+ican_nlp_providers.OPENAI_API_URL = 'http://127.0.0.1:{provider_port}/v1/chat/completions'
+if {mode!r} == 'async':
+    service.run_async(service.app, host='127.0.0.1', port={port})
+else:
+    service.app.run(host='127.0.0.1', port={port}, threaded=True)
+'''
+
+
+async def start_fake_provider(latency: float) -> web.AppRunner:
+    """OpenAI-shaped endpoint that takes `latency` seconds per call"""
+    completion = {'choices': [{'message': {'content': json.dumps(
+        {'amount_ugx': 5000, 'type': 'EXPENSE', 'category': 'General Expense', 'description': 'benchmark'})}}]}
+
+    async def handle(request: web.Request) -> web.Response:
+        await request.read()
+        await asyncio.sleep(latency)
+        return web.json_response(completion)
+
+    app = web.Application()
+    app.router.add_post('/v1/chat/completions', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', PROVIDER_PORT, backlog=4096).start()
+    return runner
+
+
+def process_usage(pid: int) -> Dict[str, int]:
+    """Thread count and resident memory (KB) of a process, from /proc"""
+    usage = {'threads': 0, 'rss_kb': 0}
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('Threads:'):
+                    usage['threads'] = int(line.split()[1])
+                elif line.startswith('VmRSS:'):
+                    usage['rss_kb'] = int(line.split()[1])
+    except OSError:
+        pass
+    return usage
+
+
+async def wait_until_up(session: aiohttp.ClientSession) -> None:
+    for _ in range(100):
+        try:
+            async with session.get(f'http://127.0.0.1:{SERVICE_PORT}/api/health') as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError('service did not start')
+
+
+async def run_wave(session: aiohttp.ClientSession, pid: int, concurrency: int, wave: int) -> Dict[str, Any]:
+    """Fire `concurrency` parse requests at once and wait for all of them"""
+    peak = {'threads': 0, 'rss_kb': 0}
+    latencies: List[float] = []
+    errors = 0
+
+    async def one(index: int) -> None:
+        nonlocal errors
+        text = f'vague note {wave}-{index} about {index * 7 + 3} and {index * 11 + 5} things'
+        started = time.perf_counter()
+        try:
+            async with session.post(f'http://127.0.0.1:{SERVICE_PORT}/api/ai/parse_transaction',
+                                    json={'text': text}) as response:
+                body = await response.json()
+                if response.status != 200 or body.get('tier') != 'llm':
+                    errors += 1
+                    return
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            errors += 1
+            return
+        latencies.append(time.perf_counter() - started)
+
+    async def sample() -> None:
+        while True:
+            usage = process_usage(pid)
+            peak['threads'] = max(peak['threads'], usage['threads'])
+            peak['rss_kb'] = max(peak['rss_kb'], usage['rss_kb'])
+            await asyncio.sleep(0.05)
+
+    sampler = asyncio.ensure_future(sample())
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+
+    latencies.sort()
+    percentile = lambda fraction: latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] if latencies else 0.0
+    return {
+        'concurrency': concurrency,
+        'ok': len(latencies),
+        'errors': errors,
+        'wall_s': round(elapsed, 2),
+        'req_per_s': round(len(latencies) / elapsed, 1),
+        'p50_s': round(percentile(0.50), 2),
+        'p99_s': round(percentile(0.99), 2),
+        'peak_threads': peak['threads'],
+        'peak_rss_mb': round(peak['rss_kb'] / 1024, 1)
+    }
+
+
+async def benchmark_mode(mode: str, concurrencies: List[int]) -> List[Dict[str, Any]]:
+    script = SERVICE_SCRIPT.format(backend=BACKEND_DIR, provider_port=PROVIDER_PORT, port=SERVICE_PORT, mode=mode)
+    # Serving capacity only: no inbound rate limits, outbound provider governor or load shedding
+    env = dict(os.environ, NLP_HEDGING='false', ADAPTIVE_TIMEOUTS='false', ADMISSION_CONTROL='false',
+               GOVERNOR_ENABLED='false', OVERLOAD_SHEDDING='false')
+    service = subprocess.Popen([sys.executable, '-c', script], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        timeout = aiohttp.ClientTimeout(total=120)
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=timeout) as session:
+            await wait_until_up(session)
+            return [await run_wave(session, service.pid, concurrency, wave)
+                    for wave, concurrency in enumerate(concurrencies)]
+    finally:
+        service.terminate()
+        service.wait()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[200, 1000, 2000])
+    parser.add_argument('--latency', type=float, default=1.0, help='fake provider latency in seconds')
+    args = parser.parse_args()
+
+    provider = await start_fake_provider(args.latency)
+    try:
+        columns = ['concurrency', 'ok', 'errors', 'wall_s', 'req_per_s', 'p50_s', 'p99_s',
+                   'peak_threads', 'peak_rss_mb']
+        print(f"Provider latency {args.latency}s")
+        for mode in ('threaded', 'async'):
+            print(f"\n{mode}")
+            print('  '.join(f'{column:>12}' for column in columns))
+            for row in await benchmark_mode(mode, args.concurrency):
+                print('  '.join(f'{row[column]:>12}' for column in columns))
+    finally:
+        await provider.cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Cost of sending a contract document to Gemini: JSON payload vs streamed body
+============================================================================
+
+Measures vet_contract's handling of documents of several sizes, from the
+request body as received to the provider call sent, once the way it used
+to be done and once with the streamed body:
+
+- json:          the JSON request body parsed, its base64 document embedded
+                 as a str in the payload dict, token-estimated and sent
+                 with requests' json=
+- json-streamed: the same JSON request body parsed, its base64 document
+                 decoded into a spool (spool_base64), wrapped in an
+                 ican_streamed_body.StreamedJSONBody, token-estimated and
+                 sent with data=
+- upload:        the raw document as a multipart upload delivers it,
+                 spooled from the stream (spool_stream) and then sent as
+                 in json-streamed
+
+json and json-streamed start from the same received bytes, so they compare
+the two paths for JSON clients; upload shows what clients sending the file
+itself save on top of that. Each run is a fresh process posting to a local
+sink that reads and drops the body. Reports the median CPU time and the
+peak resident memory added from ingest to sent request, per MB of
+document.
+
+Usage:
+    python backend/scripts/benchmark_document_passthrough.py [--sizes 1 5 20] [--runs 3]
+
+Linux only (peak memory is read from /proc).
+
+Author: ICAN Capital Engine
+Version: 1.0.0
+"""
+
+import os
+import sys
+import json
+import argparse
+import threading
+import statistics
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SINK_PORT = 18710
+
+RUN_SCRIPT = '''
+import io, os, sys, json, time, base64
+sys.path.insert(0, {backend!r})
+import requests
+from ican_document_upload import spool_base64, spool_stream
+from ican_provider_governor import estimate_tokens
+from ican_streamed_body import DOCUMENT_PLACEHOLDER, StreamedJSONBody
+
+def memory_kb(field):
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+
+def payload_with(data):
+    return {{'contents': [{{'parts': [{{'text': 'Vet this contract'}},
+                                     {{'inlineData': {{'mimeType': 'application/pdf', 'data': data}}}}]}}],
+            'generationConfig': {{'temperature': 0.1, 'maxOutputTokens': 8192}}}}
+
+url = 'http://127.0.0.1:{port}/v1beta/models/gemini-2.5-flash:generateContent'
+session = requests.Session()
+session.post(url, json={{}}).close()  # connection and imports warmed up outside the measurement
+document = os.urandom({size})
+if {mode!r} == 'upload':
+    # What the view had in hand: the multipart part's stream
+    received = io.BytesIO(document)
+else:
+    # What the view had in hand: the raw JSON request body
+    received = json.dumps({{'prompt': 'Vet this contract', 'mime_type': 'application/pdf',
+                           'file_base64': base64.b64encode(document).decode()}}).encode()
+del document
+
+with open('/proc/self/clear_refs', 'w') as clear_refs:
+    clear_refs.write('5')  # reset the peak (VmHWM) to the current resident size
+baseline_kb = memory_kb('VmRSS')
+started = time.process_time()
+if {mode!r} == 'json':
+    payload = payload_with(json.loads(received)['file_base64'])
+    estimate_tokens(payload)
+    session.post(url, json=payload).close()
+else:
+    if {mode!r} == 'upload':
+        spooled = spool_stream(received, {size})
+    else:
+        spooled = spool_base64(json.loads(received)['file_base64'], {size})
+    body = StreamedJSONBody(payload_with(DOCUMENT_PLACEHOLDER), spooled)
+    estimate_tokens(body)
+    session.post(url, data=body, headers=body.headers).close()
+cpu_seconds = time.process_time() - started
+print(json.dumps({{'cpu_seconds': cpu_seconds, 'peak_added_kb': memory_kb('VmHWM') - baseline_kb}}))
+'''
+
+
+class SinkHandler(BaseHTTPRequestHandler):
+    """Reads and drops the request body, answers a tiny JSON document"""
+
+    def do_POST(self) -> None:
+        remaining = int(self.headers.get('Content-Length', 0))
+        while remaining:
+            remaining -= len(self.rfile.read(min(remaining, 1 << 20)))
+        reply = b'{"candidates": []}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+def run_once(mode: str, size: int) -> Dict[str, float]:
+    script = RUN_SCRIPT.format(backend=BACKEND_DIR, port=SINK_PORT, mode=mode, size=size)
+    output = subprocess.run([sys.executable, '-c', script], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def benchmark(mode: str, size_mb: float, runs: int) -> Dict[str, Any]:
+    size = int(size_mb * 1024 * 1024)
+    results = [run_once(mode, size) for _ in range(runs)]
+    cpu = statistics.median(result['cpu_seconds'] for result in results)
+    peak_mb = statistics.median(result['peak_added_kb'] for result in results) / 1024
+    return {
+        'mode': mode,
+        'doc_mb': size_mb,
+        'cpu_ms': round(cpu * 1000, 1),
+        'cpu_ms_per_mb': round(cpu * 1000 / size_mb, 2),
+        'peak_rss_mb': round(peak_mb, 1),
+        'peak_rss_mb_per_mb': round(peak_mb / size_mb, 2)
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1, 5, 20], help='document sizes in MB')
+    parser.add_argument('--runs', type=int, default=3, help='runs per case (the median is reported)')
+    args = parser.parse_args()
+
+    sink = ThreadingHTTPServer(('127.0.0.1', SINK_PORT), SinkHandler)
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+    try:
+        columns = ['mode', 'doc_mb', 'cpu_ms', 'cpu_ms_per_mb', 'peak_rss_mb', 'peak_rss_mb_per_mb']
+        print('  '.join(f'{column:>18}' for column in columns))
+        rows: List[Dict[str, Any]] = []
+        for size_mb in args.sizes:
+            for mode in ('json', 'json-streamed', 'upload'):
+                rows.append(benchmark(mode, size_mb, args.runs))
+                print('  '.join(f'{rows[-1][column]:>18}' for column in columns))
+    finally:
+        sink.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+from ican_admission import AdmissionController
+
+
+def test_exempt_paths_add_to_the_configured_ones(monkeypatch):
+    monkeypatch.setenv('ADMISSION_EXEMPT_PATHS', '/api/health,/metrics')
+    controller = AdmissionController(1024, exempt_paths=['/api/treasury_guardian/health'])
+    assert controller.exempt_paths == {'/api/health', '/metrics', '/api/treasury_guardian/health'}
@@ -0,0 +1,21 @@
+import pytest
+
+import ican_nlp_processor
+import ican_nlp_processor_openai
+
+
+@pytest.mark.parametrize('service', [ican_nlp_processor, ican_nlp_processor_openai])
+@pytest.mark.parametrize('body', [['coffee 5000'], 'coffee 5000', 5000, None])
+def test_batch_rejects_a_body_that_is_not_an_object(service, body):
+    response = service.app.test_client().post('/api/ai/parse_transactions', json=body)
+    assert response.status_code == 400
+    assert response.get_json()['code'] == 'MISSING_TEXTS'
+
+
+@pytest.mark.parametrize('service', [ican_nlp_processor, ican_nlp_processor_openai])
+def test_confident_local_answer_is_not_flagged_as_fallback(service):
+    response = service.app.test_client().post('/api/ai/parse_transactions',
+                                              json={'texts': ['boda boda 5000']})
+    item = response.get_json()['results'][0]
+    assert item['tier'] == 'local'
+    assert item['fallback'] is False
@@ -0,0 +1,66 @@
+import time
+
+from ican_circuit_breaker import CLOSED, OPEN, CircuitBreaker, CircuitOpenError
+from ican_provider_router import ProviderRouter
+
+
+class FakeClient:
+    """Stands in for a ProviderClient: a breaker in front of a call that may fail"""
+
+    def __init__(self, name, open_seconds):
+        self.breaker = CircuitBreaker(name, window_seconds=60, min_calls=2, failure_rate=0.5,
+                                      open_seconds=open_seconds, half_open_probes=1)
+        self.failing = False
+        self.calls = 0
+
+    def call(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError('open', retry_after=self.breaker.retry_after())
+        self.calls += 1
+        if self.failing:
+            self.breaker.record_failure(0.01)
+            raise RuntimeError('provider down')
+        self.breaker.record_success(0.01)
+        return 'ok'
+
+
+def trip(router, client):
+    """Route until the failing client's breaker opens (it only gets its weighted share of calls)"""
+    client.failing = True
+    for _ in range(1000):
+        if client.breaker.state == OPEN:
+            return
+        assert router.route() == 'ok'
+    raise AssertionError('breaker never opened')
+
+
+def make_router(open_seconds):
+    router = ProviderRouter('test', min_share=0.2)
+    clients = {name: FakeClient(name, open_seconds) for name in ('primary', 'secondary')}
+    for name, client in clients.items():
+        router.register(name, client.call, client)
+    return router, clients
+
+
+def test_open_backend_gets_no_traffic_while_cooling_down():
+    router, clients = make_router(open_seconds=60)
+    trip(router, clients['primary'])
+    calls = clients['primary'].calls
+    for _ in range(50):
+        router.route()
+    assert clients['primary'].calls == calls
+    assert router.weights()['primary'] == 0.0
+
+
+def test_traffic_returns_once_the_cool_down_is_over():
+    router, clients = make_router(open_seconds=0.2)
+    trip(router, clients['primary'])
+    clients['primary'].failing = False
+    time.sleep(0.25)
+
+    assert router.weights()['primary'] > 0
+    calls = clients['primary'].calls
+    for _ in range(200):
+        assert router.route() == 'ok'
+    assert clients['primary'].calls > calls
+    assert clients['primary'].breaker.state == CLOSED
@@ -0,0 +1,53 @@
+import threading
+import time
+
+import pytest
+
+from ican_request_context import Deadline, DeadlineExceeded, RequestContext, run_in_context
+from ican_single_flight import SingleFlight
+
+
+def test_waiter_with_time_left_runs_the_call_after_the_leaders_deadline():
+    flight = SingleFlight()
+    leader_started = threading.Event()
+    calls = []
+
+    def leader_call():
+        calls.append('leader')
+        leader_started.set()
+        time.sleep(0.1)
+        raise DeadlineExceeded('leader out of time')
+
+    def waiter_call():
+        calls.append('waiter')
+        return 'parsed'
+
+    def lead():
+        with pytest.raises(DeadlineExceeded):
+            run_in_context(RequestContext(Deadline.after(0.05)), flight.do, 'boda 5000', leader_call)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    leader_started.wait(1)
+    result = run_in_context(RequestContext(Deadline.after(30)), flight.do, 'boda 5000', waiter_call)
+    leader.join()
+
+    assert result == ('parsed', False)
+    assert calls == ['leader', 'waiter']
+
+
+def test_waiter_whose_own_deadline_passed_gets_the_error():
+    flight = SingleFlight()
+    leader_started = threading.Event()
+
+    def leader_call():
+        leader_started.set()
+        time.sleep(0.1)
+        raise DeadlineExceeded('leader out of time')
+
+    leader = threading.Thread(target=lambda: pytest.raises(DeadlineExceeded, flight.do, 'key', leader_call))
+    leader.start()
+    leader_started.wait(1)
+    with pytest.raises(DeadlineExceeded):
+        run_in_context(RequestContext(Deadline.after(0.05)), flight.do, 'key', lambda: 'never')
+    leader.join()
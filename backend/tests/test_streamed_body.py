@@ -0,0 +1,38 @@
+import asyncio
+import base64
+import json
+import os
+import threading
+
+from ican_document_upload import SpooledDocument
+from ican_streamed_body import DOCUMENT_PLACEHOLDER, StreamedJSONBody
+
+
+def make_body(size):
+    document = SpooledDocument(size, 'application/pdf')
+    content = os.urandom(size)
+    document.write(content)
+    body = StreamedJSONBody({'parts': [{'inlineData': {'data': DOCUMENT_PLACEHOLDER}}]}, document)
+    body.chunk_bytes = 3 * 1024
+    return body, content
+
+
+def test_async_iteration_matches_sync_and_encodes_off_the_loop():
+    body, content = make_body(100_000)
+    encoding_threads = set()
+    encode_at = body._encode_at
+
+    def recording_encode_at(offset, buffer):
+        encoding_threads.add(threading.get_ident())
+        return encode_at(offset, buffer)
+
+    body._encode_at = recording_encode_at
+
+    async def collect():
+        return b''.join([bytes(chunk) async for chunk in body]), threading.get_ident()
+
+    streamed, loop_thread = asyncio.run(collect())
+    assert encoding_threads and loop_thread not in encoding_threads
+    assert streamed == b''.join(bytes(chunk) for chunk in body)
+    assert len(streamed) == len(body)
+    assert base64.b64decode(json.loads(streamed)['parts'][0]['inlineData']['data']) == content
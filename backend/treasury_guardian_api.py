@@ -8,13 +8,24 @@ contract vetting, legal risk assessment, and financial safety evaluation.
 Specialized for Ugandan law and financial regulations.
 """
 
+import os
 import json
 import time
 import requests
-from functools import wraps
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 
+from ican_admission import init_admission_control
+from ican_async_server import run_async, server_mode
+from ican_circuit_breaker import CircuitBreaker, CircuitOpenError
+from ican_document_upload import (DocumentTooLarge, InvalidDocument, is_streamed_upload, receive_upload,
+                                  spool_base64)
+from ican_memory_budget import init_memory_budget
+from ican_provider_resilience import ProviderClient
+from ican_request_context import (DeadlineExceeded, RequestCancelled, deadline_stats, disconnect_watcher,
+                                  ensure_time_left, init_request_context, mark_deadline_exceeded)
+from ican_streamed_body import DOCUMENT_PLACEHOLDER, StreamedJSONBody
+
 # ========================================
 # 🔧 CORE CONFIGURATION & INITIALIZATION
 # ========================================
@@ -26,40 +37,17 @@ CORS(app)  # Enable cross-origin requests from React frontend
 GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-pro:generateContent"
 API_KEY = ""  # TO BE CONFIGURED: Add your Gemini API key here
 
-# ========================================
-# 🛡️ RESILIENCE & STABILITY MECHANISMS
-# ========================================
-
-def retry_with_backoff(max_retries=3, backoff_factor=2):
-    """
-    🔄 Advanced Retry Decorator with Exponential Backoff
-    
-    Ensures connection stability and resilience for high-stakes financial requests.
-    Critical for Treasury Guardian operations where reliability is paramount.
-    
-    Args:
-        max_retries (int): Maximum number of retry attempts
-        backoff_factor (float): Exponential backoff multiplier
-    """
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            for attempt in range(max_retries + 1):
-                try:
-                    return func(*args, **kwargs)
-                except requests.exceptions.RequestException as e:
-                    if attempt == max_retries:
-                        print(f"🚨 TREASURY GUARDIAN ERROR: Final attempt failed - {str(e)}")
-                        raise e
-                    
-                    wait_time = backoff_factor ** attempt
-                    print(f"⏳ Retry attempt {attempt + 1}/{max_retries} in {wait_time}s...")
-                    time.sleep(wait_time)
-                except Exception as e:
-                    print(f"💥 TREASURY GUARDIAN CRITICAL ERROR: {str(e)}")
-                    raise e
-            return wrapper
-        return decorator
+# 🛡️ Resilient Gemini client: shared keep-alive pool, per-request deadline,
+# retry budget and jittered retries at the provider call (not the view)
+gemini_client = ProviderClient(
+    'gemini',
+    default_deadline=float(os.getenv('TG_DEADLINE_SECONDS', '150')),
+    # Document analysis is legitimately slow; only flag calls near the 60s timeout
+    breaker=CircuitBreaker('gemini', slow_call_seconds=float(os.getenv('TG_BREAKER_SLOW_CALL_SECONDS', '55')))
+)
+# Read timeout until enough analyses are observed; afterwards the timeout follows
+# the live p99 for the document's size bucket (ADAPTIVE_* settings)
+TG_COLD_TIMEOUT_SECONDS = float(os.getenv('TG_PROVIDER_TIMEOUT_SECONDS', '60'))
 
 # ========================================
 # 📋 STRUCTURED OUTPUT SCHEMA DEFINITION
@@ -197,8 +185,68 @@ Be precise, actionable, and executive-ready in all assessments.
 # 🎯 MULTI-MODAL CONTRACT VETTING ENDPOINT
 # ========================================
 
+# ========================================
+# ⏰ REQUEST DEADLINES
+# ========================================
+
+def deadline_exceeded_response():
+    """504 for requests whose caller-supplied deadline has passed"""
+    mark_deadline_exceeded()
+    return jsonify({
+        "error": "TREASURY_GUARDIAN_DEADLINE_EXCEEDED",
+        "message": "The caller's deadline passed before the analysis could complete",
+        "status": "DEADLINE_EXCEEDED"
+    }), 504
+
+def client_closed_response():
+    """499 for requests whose client disconnected mid-analysis; the provider call was aborted"""
+    return jsonify({
+        "error": "TREASURY_GUARDIAN_CLIENT_CLOSED",
+        "message": "The client disconnected before the analysis completed",
+        "status": "CLIENT_CLOSED_REQUEST"
+    }), 499
+
+def admission_rejected_response(status: int, reason: str, retry_after: float):
+    """429 for clients over their rate limit, 413 for oversized documents (sent before the body is read)"""
+    if status == 413:
+        return jsonify({
+            "error": "TREASURY_GUARDIAN_DOCUMENT_TOO_LARGE",
+            "message": f"Documents are limited to {MAX_FILE_SIZE_MB:g}MB",
+            "status": reason
+        }), 413
+    return jsonify({
+        "error": "TREASURY_GUARDIAN_RATE_LIMITED",
+        "message": "Too many analysis requests, please retry later",
+        "status": reason,
+        "retry_after_seconds": round(retry_after, 1)
+    }), 429
+
+def memory_budget_exhausted_response(retry_after: float):
+    """503 when the documents already in flight fill this worker's memory budget"""
+    return jsonify({
+        "error": "TREASURY_GUARDIAN_BUSY",
+        "message": "Too many documents are being analysed right now, please retry shortly",
+        "status": "MEMORY_BUDGET_EXHAUSTED",
+        "retry_after_seconds": round(retry_after, 1)
+    }), 503
+
+# Per-API-key / per-IP rate limits (RATE_LIMIT_PER_MINUTE) and the document size cap
+# (MAX_FILE_SIZE_MB, as base64 JSON) come first, so rejected requests never parse JSON
+MAX_FILE_SIZE_MB = float(os.getenv('MAX_FILE_SIZE_MB', '50'))
+MAX_FILE_BYTES = int(MAX_FILE_SIZE_MB * 1024 * 1024)
+admission = init_admission_control(app, int(MAX_FILE_SIZE_MB * 1024 * 1024 * 4 / 3) + 1024 * 1024,
+                                   admission_rejected_response, exempt_paths=['/api/treasury_guardian/health'])
+
+# X-Request-Timeout-Ms / X-Request-Deadline from the gateway bound every provider call;
+# a client disconnect cancels them, and X-Request-Class picks their provider lane
+init_request_context(app, deadline_exceeded_response)
+
+# Documents in flight reserve their decoded size from DOCUMENT_BUDGET_MB before the JSON is
+# parsed; when it is used up they wait (within their deadline) or get a 503
+document_budget = init_memory_budget(app, ['/api/ai/vet_contract'], memory_budget_exhausted_response,
+                                     client_closed_response)
+
 @app.route('/api/ai/vet_contract', methods=['POST'])
-@retry_with_backoff(max_retries=3, backoff_factor=2)
 def vet_contract():
     """
     🏛️ TREASURY GUARDIAN - Multi-Modal Contract Vetting Endpoint
@@ -213,26 +261,35 @@ def vet_contract():
         "mime_type": "Document MIME type (application/pdf, image/jpeg, etc.)"
     }
     
+    or multipart/form-data with a "file" part and "prompt" (optionally "mime_type")
+    fields, or the raw document as the body with its MIME type as Content-Type and
+    ?prompt=... in the query string. Uploads are spooled to disk as they stream in.
+    
     Returns:
     Structured JSON with financial_safety_score, critical_risks, mitigation_steps,
     key_financial_terms, and executive-ready risk assessment.
     """
     
+    document = None
     try:
         # 📥 SECURE INPUT EXTRACTION AND VALIDATION
-        if not request.is_json:
+        if is_streamed_upload(request):
+            # Multipart or raw-body upload: size-checked and hashed while it streams to disk
+            document, data = receive_upload(request, MAX_FILE_BYTES)
+            file_base64 = ''
+        elif request.is_json:
+            data = request.get_json()
+            file_base64 = data.get('file_base64', '').strip()
+        else:
             return jsonify({
                 "error": "TREASURY_GUARDIAN_ERROR",
-                "message": "Request must contain JSON data",
+                "message": "Request must contain JSON data or a document upload",
                 "status": "INVALID_REQUEST_FORMAT"
             }), 400
         
-        data = request.get_json()
-        
         # Extract and validate required inputs
         prompt = data.get('prompt', '').strip()
-        file_base64 = data.get('file_base64', '').strip()
-        mime_type = data.get('mime_type', '').strip()
+        mime_type = (data.get('mime_type') or (document.mime_type if document else '')).strip()
         
         if not prompt:
             return jsonify({
@@ -241,7 +298,7 @@ def vet_contract():
                 "status": "MISSING_PROMPT"
             }), 400
             
-        if not file_base64:
+        if document is None and not file_base64:
             return jsonify({
                 "error": "TREASURY_GUARDIAN_ERROR", 
                 "message": "Document file (Base64 encoded) is required for analysis",
@@ -263,7 +320,12 @@ def vet_contract():
                 "status": "API_KEY_MISSING"
             }), 500
         
-        print(f"🏛️ TREASURY GUARDIAN: Analyzing document of type {mime_type}")
+        if document is None:
+            # JSON base64 is decoded into a spool too, so both paths share one pipeline
+            document = spool_base64(file_base64, MAX_FILE_BYTES, mime_type)
+        
+        print(f"🏛️ TREASURY GUARDIAN: Analyzing document of type {mime_type} "
+              f"({document.size} bytes, sha256 {document.sha256[:12]})")
         print(f"📋 Analysis Request: {prompt[:100]}...")
         
         # ========================================
@@ -305,7 +367,7 @@ def vet_contract():
                         {
                             "inlineData": {
                                 "mimeType": mime_type,
-                                "data": file_base64
+                                "data": DOCUMENT_PLACEHOLDER
                             }
                         }
                     ]
@@ -332,8 +394,10 @@ def vet_contract():
         # 📡 SECURE API EXECUTION WITH MONITORING
         # ========================================
         
+        # The document is base64-encoded chunk by chunk from its spool while the body is sent
+        body = StreamedJSONBody(payload, document)
         headers = {
-            'Content-Type': 'application/json',
+            **body.headers,
             'User-Agent': 'ICAN-Treasury-Guardian/1.0'
         }
         
@@ -342,12 +406,18 @@ def vet_contract():
         print("🚀 Sending multi-modal analysis request to Gemini API...")
         start_time = time.time()
         
-        response = requests.post(
-            api_url_with_key,
-            headers=headers,
-            json=payload,
-            timeout=60  # 60 second timeout for complex document analysis
-        )
+        try:
+            response = gemini_client.post(
+                api_url_with_key,
+                headers=headers,
+                data=body,
+                timeout=TG_COLD_TIMEOUT_SECONDS,
+                endpoint='vet_contract',
+                size_hint=document.base64_length
+            )
+        except requests.exceptions.HTTPError as http_error:
+            # Non-retryable status, or retries exhausted: report it below
+            response = http_error.response
         
         processing_time = time.time() - start_time
         print(f"⏱️ Analysis completed in {processing_time:.2f} seconds")
@@ -368,6 +438,7 @@ def vet_contract():
         
         # Parse and validate AI response
         try:
+            ensure_time_left('response parsing')
             ai_response = response.json()
             
             # Extract the structured analysis from Gemini response
@@ -384,8 +455,11 @@ def vet_contract():
                         "analysis_timestamp": int(time.time()),
                         "processing_time_seconds": round(processing_time, 2),
                         "document_type": mime_type,
+                        "document": document.describe(),
                         "api_version": "treasury_guardian_v1.0",
-                        "risk_assessment_grade": "INSTITUTIONAL"
+                        "risk_assessment_grade": "INSTITUTIONAL",
+                        "provider_timeout": getattr(response, 'timeout_info', None),
+                        "provider_queue_seconds": getattr(response, 'queue_seconds', None)
                     }
                     
                     print("✅ TREASURY GUARDIAN: Analysis completed successfully")
@@ -411,6 +485,35 @@ def vet_contract():
                 "details": str(e)
             }), 500
     
+    except DocumentTooLarge:
+        return admission_rejected_response(413, 'BODY_TOO_LARGE', 0.0)
+    
+    except InvalidDocument as e:
+        return jsonify({
+            "error": "TREASURY_GUARDIAN_ERROR",
+            "message": str(e),
+            "status": "INVALID_DOCUMENT"
+        }), 400
+    
+    except CircuitOpenError as e:
+        print(f"🔌 TREASURY GUARDIAN: Gemini unavailable ({e.status}), rejecting without calling provider")
+        response = jsonify({
+            "error": "TREASURY_GUARDIAN_UNAVAILABLE",
+            "message": "AI analysis service is temporarily unavailable, please retry later",
+            "status": e.status,
+            "retry_after_seconds": round(e.retry_after, 1)
+        })
+        response.headers['Retry-After'] = str(max(1, int(e.retry_after)))
+        return response, 503
+    
+    except DeadlineExceeded as e:
+        print(f"⏰ TREASURY GUARDIAN: Caller deadline exceeded ({str(e)})")
+        return deadline_exceeded_response()
+    
+    except RequestCancelled as e:
+        print(f"🔌 TREASURY GUARDIAN: Client disconnected, analysis cancelled ({str(e)})")
+        return client_closed_response()
+    
     except requests.exceptions.Timeout:
         print("⏰ TREASURY GUARDIAN: Request timeout")
         return jsonify({
@@ -434,6 +537,10 @@ def vet_contract():
             "message": "Internal system error during analysis",
             "status": "SYSTEM_FAILURE"
         }), 500
+    
+    finally:
+        if document is not None:
+            document.close()
 
 # ========================================
 # 🔍 HEALTH CHECK AND STATUS ENDPOINTS
@@ -448,6 +555,13 @@ def health_check():
         "version": "1.0",
         "timestamp": int(time.time()),
         "api_key_configured": bool(API_KEY),
+        "connection_pool": gemini_client.pool.stats(),
+        "provider": gemini_client.stats(),
+        "circuit_breaker": gemini_client.breaker.stats(),
+        "admission": admission.stats(),
+        "document_budget": document_budget.stats(),
+        "deadlines": deadline_stats.stats(),
+        "cancellations": disconnect_watcher.stats(),
         "capabilities": [
             "multi_modal_analysis",
             "contract_vetting", 
@@ -474,11 +588,19 @@ if __name__ == '__main__':
     print("📋 Multi-modal contract vetting service initialized")
     print("⚖️ Ugandan law compliance analysis ready")
     print("🔐 Configure GEMINI API_KEY before production use")
+    print("🏭 Production: python ican_serve.py treasury")
+    
+    # Treasury Guardian API port (the NLP processor owns 5000)
+    port = int(os.getenv('TREASURY_PORT', '5001'))
     
-    # Development server configuration
-    app.run(
-        host='0.0.0.0',  # Accept connections from any IP
-        port=5000,       # Treasury Guardian API port
-        debug=True,      # Enable debug mode for development
-        threaded=True    # Handle multiple requests concurrently
-    )
\ No newline at end of file
+    # ICAN_SERVER_MODE=async: one event loop serves all waiting requests
+    if server_mode() == 'async':
+        run_async(app, host='0.0.0.0', port=port)
+    else:
+        # Development server configuration
+        app.run(
+            host='0.0.0.0',  # Accept connections from any IP
+            port=port,
+            debug=os.getenv('FLASK_DEBUG', 'false').lower() == 'true',  # Debugger only on request
+            threaded=True    # Handle multiple requests concurrently
+        )
\ No newline at end of file
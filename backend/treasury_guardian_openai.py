@@ -12,11 +12,23 @@ import json
 import time
 import requests
 import base64
-from functools import wraps
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import os
 from datetime import datetime
+from typing import Any, Dict, Optional
+
+from ican_admission import init_admission_control
+from ican_async_bridge import run_blocking
+from ican_async_server import run_async, server_mode
+from ican_circuit_breaker import CircuitBreaker, CircuitOpenError
+from ican_document_text import UnsupportedDocument, normalize_whitespace, text_extractor
+from ican_document_upload import (DocumentTooLarge, InvalidDocument, is_streamed_upload, receive_upload,
+                                  spool_base64)
+from ican_memory_budget import init_memory_budget
+from ican_provider_resilience import ProviderClient
+from ican_request_context import (DeadlineExceeded, RequestCancelled, deadline_stats, disconnect_watcher,
+                                  ensure_time_left, init_request_context, mark_deadline_exceeded)
 
 app = Flask(__name__)
 CORS(app)
@@ -28,38 +40,108 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', 'sk-proj-')
 OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
 OPENAI_MODEL = "gpt-4-turbo-preview"  # Better for complex document analysis
 
+# 🛡️ Resilient OpenAI client: shared keep-alive pool, per-request deadline,
+# retry budget and jittered retries at the provider call (not the view)
+openai_client = ProviderClient(
+    'openai',
+    default_deadline=float(os.getenv('TG_DEADLINE_SECONDS', '150')),
+    # Contract analysis is legitimately slow; only flag calls near the 60s timeout
+    breaker=CircuitBreaker('openai', slow_call_seconds=float(os.getenv('TG_BREAKER_SLOW_CALL_SECONDS', '55')))
+)
+# Read timeout until enough analyses are observed; afterwards the timeout follows
+# the live p99 per endpoint and prompt size (ADAPTIVE_* settings)
+TG_COLD_TIMEOUT_SECONDS = float(os.getenv('TG_PROVIDER_TIMEOUT_SECONDS', '60'))
+
 # ========================================
-# 🛡️ RESILIENCE MECHANISMS
+# 🔌 CIRCUIT OPEN RESPONSE
 # ========================================
 
-def retry_with_backoff(max_retries=3, backoff_factor=2):
-    """Retry decorator with exponential backoff"""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            delay = 1
-            last_error = None
-            
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    last_error = e
-                    if attempt < max_retries - 1:
-                        print(f"⚠️ Attempt {attempt + 1} failed, retrying in {delay}s...")
-                        time.sleep(delay)
-                        delay *= backoff_factor
-            
-            raise last_error
-        return wrapper
-    return decorator
+def circuit_open_response(error: CircuitOpenError):
+    """503 with Retry-After while the OpenAI circuit is open or its call queue is full"""
+    print(f"🔌 TREASURY GUARDIAN: OpenAI unavailable ({error.status}), rejecting without calling provider")
+    response = jsonify({
+        "error": "TREASURY_GUARDIAN_UNAVAILABLE",
+        "message": "AI analysis service is temporarily unavailable, please retry later",
+        "status": error.status,
+        "retry_after_seconds": round(error.retry_after, 1),
+        "timestamp": datetime.now().isoformat()
+    })
+    response.headers['Retry-After'] = str(max(1, int(error.retry_after)))
+    return response, 503
+
+# ========================================
+# ⏰ REQUEST DEADLINES
+# ========================================
+
+def deadline_exceeded_response():
+    """504 for requests whose caller-supplied deadline has passed"""
+    mark_deadline_exceeded()
+    return jsonify({
+        "error": "TREASURY_GUARDIAN_DEADLINE_EXCEEDED",
+        "message": "The caller's deadline passed before the analysis could complete",
+        "status": "DEADLINE_EXCEEDED",
+        "timestamp": datetime.now().isoformat()
+    }), 504
+
+def client_closed_response():
+    """499 for requests whose client disconnected mid-analysis; the provider call was aborted"""
+    return jsonify({
+        "error": "TREASURY_GUARDIAN_CLIENT_CLOSED",
+        "message": "The client disconnected before the analysis completed",
+        "status": "CLIENT_CLOSED_REQUEST",
+        "timestamp": datetime.now().isoformat()
+    }), 499
+
+def admission_rejected_response(status: int, reason: str, retry_after: float):
+    """429 for clients over their rate limit, 413 for oversized documents (sent before the body is read)"""
+    if status == 413:
+        return jsonify({
+            "error": "TREASURY_GUARDIAN_DOCUMENT_TOO_LARGE",
+            "message": f"Documents are limited to {MAX_FILE_SIZE_MB:g}MB",
+            "status": reason,
+            "timestamp": datetime.now().isoformat()
+        }), 413
+    return jsonify({
+        "error": "TREASURY_GUARDIAN_RATE_LIMITED",
+        "message": "Too many analysis requests, please retry later",
+        "status": reason,
+        "retry_after_seconds": round(retry_after, 1),
+        "timestamp": datetime.now().isoformat()
+    }), 429
+
+def memory_budget_exhausted_response(retry_after: float):
+    """503 when the documents already in flight fill this worker's memory budget"""
+    return jsonify({
+        "error": "TREASURY_GUARDIAN_BUSY",
+        "message": "Too many documents are being analysed right now, please retry shortly",
+        "status": "MEMORY_BUDGET_EXHAUSTED",
+        "retry_after_seconds": round(retry_after, 1),
+        "timestamp": datetime.now().isoformat()
+    }), 503
+
+# Per-API-key / per-IP rate limits (RATE_LIMIT_PER_MINUTE) and the document size cap
+# (MAX_FILE_SIZE_MB, as base64 JSON) come first, so rejected requests never parse JSON
+MAX_FILE_SIZE_MB = float(os.getenv('MAX_FILE_SIZE_MB', '50'))
+MAX_FILE_BYTES = int(MAX_FILE_SIZE_MB * 1024 * 1024)
+admission = init_admission_control(app, int(MAX_FILE_SIZE_MB * 1024 * 1024 * 4 / 3) + 1024 * 1024,
+                                   admission_rejected_response)
+
+# X-Request-Timeout-Ms / X-Request-Deadline from the gateway bound every provider call;
+# a client disconnect cancels them, and X-Request-Class picks their provider lane
+init_request_context(app, deadline_exceeded_response)
+
+# Documents in flight reserve their decoded size from DOCUMENT_BUDGET_MB before the JSON is
+# parsed; when it is used up they wait (within their deadline) or get a 503
+document_budget = init_memory_budget(app, ['/api/ai/vet_contract'], memory_budget_exhausted_response,
+                                     client_closed_response)
 
 # ========================================
 # 🤖 OPENAI ANALYSIS ENGINE
 # ========================================
 
-def call_openai_for_analysis(prompt: str, max_tokens: int = 2000) -> str:
-    """Call OpenAI API for contract analysis"""
+def call_openai_for_analysis(prompt: str, max_tokens: int = 2000, endpoint: str = 'analysis',
+                             call_info: Optional[Dict[str, Any]] = None) -> str:
+    """Call OpenAI API for contract analysis; call_info, if given, receives the chosen timeout and queue wait"""
     headers = {
         'Content-Type': 'application/json',
         'Authorization': f'Bearer {OPENAI_API_KEY}'
@@ -84,17 +166,28 @@ Always respond with ONLY valid JSON, no additional text."""
         "response_format": { "type": "json_object" }
     }
     
-    response = requests.post(
-        OPENAI_API_URL,
-        headers=headers,
-        json=payload,
-        timeout=60
-    )
+    try:
+        response = openai_client.post(
+            OPENAI_API_URL,
+            headers=headers,
+            json=payload,
+            timeout=TG_COLD_TIMEOUT_SECONDS,
+            endpoint=endpoint,
+            size_hint=len(prompt)
+        )
+    except requests.exceptions.HTTPError as http_error:
+        # Non-retryable status, or retries exhausted
+        response = http_error.response
+    
+    if call_info is not None:
+        call_info['provider_timeout'] = getattr(response, 'timeout_info', None)
+        call_info['provider_queue_seconds'] = getattr(response, 'queue_seconds', None)
     
     if response.status_code != 200:
         error_details = response.text
         raise Exception(f"OpenAI API error: {response.status_code} - {error_details}")
     
+    ensure_time_left('response parsing')
     data = response.json()
     return data['choices'][0]['message']['content']
 
@@ -111,21 +204,39 @@ def health_check():
         'version': '2.0.0',
         'ai_provider': 'OpenAI',
         'model': OPENAI_MODEL,
+        'connection_pool': openai_client.pool.stats(),
+        'provider': openai_client.stats(),
+        'circuit_breaker': openai_client.breaker.stats(),
+        'admission': admission.stats(),
+        'document_budget': document_budget.stats(),
+        'text_extraction': text_extractor.stats(),
+        'deadlines': deadline_stats.stats(),
+        'cancellations': disconnect_watcher.stats(),
         'timestamp': datetime.now().isoformat()
     })
 
 @app.route('/api/ai/vet_contract', methods=['POST'])
-@retry_with_backoff(max_retries=3, backoff_factor=2)
 def vet_contract():
     """
     Analyze contract for legal and financial risks
+    
+    Takes JSON (prompt, contract_text or file_base64, mime_type), multipart/form-data
+    with a "file" part and the same fields, or the raw document as the body with
+    ?prompt=... in the query string. Uploads are spooled to disk as they stream in;
+    the text of PDF, DOCX and plain-text documents is extracted locally for the prompt.
     """
+    document = None
     try:
-        data = request.get_json()
+        if is_streamed_upload(request):
+            # Multipart or raw-body upload: size-checked and hashed while it streams to disk
+            document, data = receive_upload(request, MAX_FILE_BYTES)
+            file_base64 = ''
+        else:
+            data = request.get_json()
+            file_base64 = data.get('file_base64', '')
         prompt = data.get('prompt', '')
         contract_text = data.get('contract_text', '')
-        file_base64 = data.get('file_base64', '')
-        mime_type = data.get('mime_type', 'text/plain')
+        mime_type = data.get('mime_type') or (document.mime_type if document else 'text/plain')
         
         # Validate inputs
         if not prompt:
@@ -135,17 +246,31 @@ def vet_contract():
                 "status": "MISSING_PROMPT"
             }), 400
         
-        if not contract_text and not file_base64:
+        if not contract_text and document is None and not file_base64:
             return jsonify({
                 "error": "TREASURY_GUARDIAN_ERROR",
                 "message": "Contract text or file is required",
                 "status": "MISSING_CONTENT"
             }), 400
         
-        # Use provided text or decode file
-        analysis_text = contract_text or file_base64[:5000]
+        if contract_text:
+            analysis_text = normalize_whitespace(contract_text)
+        else:
+            if document is None:
+                document = spool_base64(file_base64, MAX_FILE_BYTES, mime_type)
+            # The model only ever sees the document's own words, never its encoded bytes;
+            # parsing them is CPU work, kept off the event loop in the async serving mode
+            analysis_text = run_blocking(text_extractor.extract, document)
+            if not analysis_text:
+                return jsonify({
+                    "error": "TREASURY_GUARDIAN_ERROR",
+                    "message": "No text could be extracted from the document (scanned pages need OCR); "
+                               "send the contract text instead",
+                    "status": "NO_EXTRACTABLE_TEXT",
+                    "timestamp": datetime.now().isoformat()
+                }), 422
         
-        print(f"🏛️ TREASURY GUARDIAN: Analyzing document")
+        print(f"🏛️ TREASURY GUARDIAN: Analyzing document ({len(analysis_text)} characters of text)")
         print(f"📋 Analysis Request: {prompt[:100]}...")
         
         # ========================================
@@ -157,8 +282,8 @@ def vet_contract():
 
 USER QUESTION: {prompt}
 
-CONTRACT/DOCUMENT EXCERPT (First 5000 chars):
-{analysis_text[:5000]}
+CONTRACT/DOCUMENT EXCERPT (First {text_extractor.max_chars} chars):
+{analysis_text[:text_extractor.max_chars]}
 
 ---
 
@@ -180,7 +305,9 @@ Please analyze this contract and return ONLY a JSON object with:
         print("🚀 Sending analysis request to OpenAI API...")
         start_time = time.time()
         
-        analysis_response = call_openai_for_analysis(enhanced_prompt, max_tokens=2000)
+        call_info: Dict[str, Any] = {}
+        analysis_response = call_openai_for_analysis(enhanced_prompt, max_tokens=2000,
+                                                     endpoint='vet_contract', call_info=call_info)
         
         processing_time = time.time() - start_time
         print(f"⏱️ Analysis completed in {processing_time:.2f} seconds")
@@ -207,13 +334,46 @@ Please analyze this contract and return ONLY a JSON object with:
             "processing_time": f"{processing_time:.2f}s",
             "timestamp": datetime.now().isoformat(),
             "ai_provider": "OpenAI",
-            "model": OPENAI_MODEL
+            "model": OPENAI_MODEL,
+            **call_info
         }
+        if document is not None:
+            response["document"] = document.describe()
         
         print(f"✅ Analysis complete. Safety Score: {analysis.get('financial_safety_score', 'N/A')}")
         
         return jsonify(response)
     
+    except DocumentTooLarge:
+        return admission_rejected_response(413, 'BODY_TOO_LARGE', 0.0)
+    
+    except InvalidDocument as error:
+        return jsonify({
+            "error": "TREASURY_GUARDIAN_ERROR",
+            "message": str(error),
+            "status": "INVALID_DOCUMENT",
+            "timestamp": datetime.now().isoformat()
+        }), 400
+    
+    except UnsupportedDocument as error:
+        return jsonify({
+            "error": "TREASURY_GUARDIAN_ERROR",
+            "message": f"{str(error)}; send PDF, DOCX or plain text, or the contract text itself",
+            "status": "UNSUPPORTED_DOCUMENT",
+            "timestamp": datetime.now().isoformat()
+        }), 415
+    
+    except CircuitOpenError as error:
+        return circuit_open_response(error)
+    
+    except DeadlineExceeded as error:
+        print(f"⏰ TREASURY GUARDIAN: Caller deadline exceeded ({str(error)})")
+        return deadline_exceeded_response()
+    
+    except RequestCancelled as error:
+        print(f"🔌 TREASURY GUARDIAN: Client disconnected, analysis cancelled ({str(error)})")
+        return client_closed_response()
+    
     except Exception as error:
         print(f"🚨 TREASURY GUARDIAN ERROR: {str(error)}")
         return jsonify({
@@ -222,9 +382,12 @@ Please analyze this contract and return ONLY a JSON object with:
             "status": "ANALYSIS_FAILURE",
             "timestamp": datetime.now().isoformat()
         }), 500
+    
+    finally:
+        if document is not None:
+            document.close()
 
 @app.route('/api/ai/contract_summary', methods=['POST'])
-@retry_with_backoff(max_retries=3, backoff_factor=2)
 def contract_summary():
     """Generate executive summary of contract"""
     try:
@@ -253,15 +416,29 @@ Contract:
 {contract_text[:5000]}
 """
         
-        response_text = call_openai_for_analysis(prompt, max_tokens=1000)
+        call_info: Dict[str, Any] = {}
+        response_text = call_openai_for_analysis(prompt, max_tokens=1000,
+                                                 endpoint='contract_summary', call_info=call_info)
         summary = json.loads(response_text)
         
         return jsonify({
             "success": True,
             "summary": summary,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now().isoformat(),
+            **call_info
         })
     
+    except CircuitOpenError as error:
+        return circuit_open_response(error)
+    
+    except DeadlineExceeded as error:
+        print(f"⏰ TREASURY GUARDIAN: Caller deadline exceeded ({str(error)})")
+        return deadline_exceeded_response()
+    
+    except RequestCancelled as error:
+        print(f"🔌 TREASURY GUARDIAN: Client disconnected, analysis cancelled ({str(error)})")
+        return client_closed_response()
+    
     except Exception as error:
         return jsonify({
             "error": str(error),
@@ -277,16 +454,21 @@ if __name__ == '__main__':
     print("🏛️ TREASURY GUARDIAN API - OpenAI Edition")
     print(f"📡 AI Provider: OpenAI")
     print(f"🤖 Model: {OPENAI_MODEL}")
-    print(f"🌐 Running on: http://localhost:5000")
+    port = int(os.getenv('TREASURY_PORT', '5001'))
+    print(f"🌐 Running on: http://localhost:{port}")
     print(f"📝 Endpoints:")
     print(f"   - Health: GET /api/health")
     print(f"   - Vet Contract: POST /api/ai/vet_contract")
     print(f"   - Summary: POST /api/ai/contract_summary")
+    print(f"🏭 Production: python ican_serve.py treasury-openai")
     print("=" * 60)
     
-    app.run(
-        host='0.0.0.0',
-        port=5000,
-        debug=True,
-        use_reloader=False
-    )
+    if server_mode() == 'async':
+        run_async(app, host='0.0.0.0', port=port)
+    else:
+        app.run(
+            host='0.0.0.0',
+            port=port,
+            debug=os.getenv('FLASK_DEBUG', 'false').lower() == 'true',
+            use_reloader=False
+        )